@@ -4,15 +4,22 @@
 """
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
+import json
+import math
+import httpx
 
-from core.database import get_db
+from core.database import get_db, AsyncSessionLocal
 from core.security import get_current_user
 from models.user import User
 from models.conversation import Conversation, Message
 from services.rag_service import RAGService, MemoryService
+from services.llm_gateway import LLMError, ProviderUnavailable
+from services.conversation_summary import schedule_summary
+from core.config import settings
 from sqlalchemy import select
 
 router = APIRouter()
@@ -25,6 +32,9 @@ class ChatRequest(BaseModel):
     document_ids: Optional[List[int]] = None
     user_prompt: str = ""
     temperature: float = 0.7
+    # ANN向量索引的召回/延迟参数（可选）
+    ef_search: Optional[int] = Field(default=None, ge=1, le=settings.HNSW_MAX_EF_SEARCH)
+    nprobe: Optional[int] = Field(default=None, ge=1, le=settings.IVF_NLIST)
 
 
 class ChatResponse(BaseModel):
@@ -33,6 +43,7 @@ class ChatResponse(BaseModel):
     conversation_id: int
     response: str
     sources: List[dict]
+    usage: dict = {}  # 上下文占用的token数（context_tokens / history_tokens）
     created_at: str
 
 
@@ -44,6 +55,96 @@ class MemoryRequest(BaseModel):
     tags: List[str] = None
 
 
+def _dump_sources(sources: List[dict]) -> Optional[str]:
+    """序列化来源元数据（文件名、文档ID、页码、得分）"""
+    if not sources:
+        return None
+    return json.dumps(
+        [
+            {
+                "document_id": s.get("document_id"),
+                "file_name": s.get("file_name"),
+                "page_start": s.get("page_start"),
+                "page_end": s.get("page_end"),
+                "score": s.get("score")
+            }
+            for s in sources
+        ],
+        ensure_ascii=False
+    )
+
+
+def _load_sources(retrieval_context: Optional[str]) -> List[dict]:
+    """反序列化来源元数据"""
+    if not retrieval_context:
+        return []
+    try:
+        return json.loads(retrieval_context)
+    except ValueError:
+        return []
+
+
+def _sse(event: str, data: dict) -> str:
+    """格式化一条Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _get_or_create_conversation(db: AsyncSession, request: ChatRequest, user_id: int) -> Conversation:
+    """获取指定对话，未指定时创建新对话"""
+    if request.conversation_id:
+        query = select(Conversation).where(
+            Conversation.id == request.conversation_id,
+            Conversation.user_id == user_id
+        )
+        result = await db.execute(query)
+        conversation = result.scalar_one_or_none()
+        if not conversation:
+            raise HTTPException(status_code=404, detail="对话不存在")
+        return conversation
+
+    # 创建新对话
+    conversation = Conversation(
+        user_id=user_id,
+        title=request.message[:50] + "..."
+    )
+    db.add(conversation)
+    await db.commit()
+    await db.refresh(conversation)
+    return conversation
+
+
+async def _load_history(db: AsyncSession, conversation: Conversation) -> List[dict]:
+    """获取摘要之后的最近消息（最多 SUMMARY_TRIGGER_MESSAGES 条，读取量与对话长度无关）"""
+    history_query = select(Message).where(
+        Message.conversation_id == conversation.id,
+        Message.id > (conversation.summary_message_id or 0)
+    ).order_by(Message.id.desc()).limit(settings.SUMMARY_TRIGGER_MESSAGES)
+    history_result = await db.execute(history_query)
+    messages = list(reversed(history_result.scalars().all()))
+
+    return [
+        {"role": msg.message_type, "content": msg.content}
+        for msg in messages
+    ]
+
+
+def _maybe_summarize(conversation_id: int, history_count: int):
+    """本轮新增2条消息后，摘要之后的消息数超过阈值时在后台压缩"""
+    if history_count + 2 > settings.SUMMARY_TRIGGER_MESSAGES:
+        schedule_summary(conversation_id)
+
+
+def _llm_http_error(error: Exception) -> HTTPException:
+    """大模型调用失败转换为HTTP错误（网关拒绝返回503并带Retry-After）"""
+    if isinstance(error, ProviderUnavailable):
+        return HTTPException(
+            status_code=503,
+            detail=str(error),
+            headers={"Retry-After": str(math.ceil(error.retry_after))}
+        )
+    return HTTPException(status_code=502, detail=f"AI回复生成失败：{error}")
+
+
 def get_rag_service(db: AsyncSession = Depends(get_db)) -> RAGService:
     """获取RAGService实例"""
     return RAGService(db)
@@ -64,76 +165,147 @@ async def chat(
     rag_service = get_rag_service(db)
 
     # 获取或创建对话
-    if request.conversation_id:
-        query = select(Conversation).where(
-            Conversation.id == request.conversation_id,
-            Conversation.user_id == current_user.id
-        )
-        result = await db.execute(query)
-        conversation = result.scalar_one_or_none()
-        if not conversation:
-            raise HTTPException(status_code=404, detail="对话不存在")
-    else:
-        # 创建新对话
-        conversation = Conversation(
-            user_id=current_user.id,
-            title=request.message[:50] + "..."
-        )
-        db.add(conversation)
-        await db.commit()
-        await db.refresh(conversation)
+    conversation = await _get_or_create_conversation(db, request, current_user.id)
 
-    # 获取对话历史
-    history_query = select(Message).where(
-        Message.conversation_id == conversation.id
-    ).order_by(Message.created_at)
-    history_result = await db.execute(history_query)
-    messages = history_result.scalars().all()
+    # 获取对话历史（滚动摘要 + 最近消息）
+    conversation_history = await _load_history(db, conversation)
 
-    conversation_history = [
-        {"role": msg.role, "content": msg.content}
-        for msg in messages[-20:]  # 最近20条
-    ]
-
-    # RAG生成回复
-    result = await rag_service.chat(
-        query=request.message,
-        user_id=current_user.id,
-        conversation_history=conversation_history,
-        user_prompt=request.user_prompt,
-        document_ids=request.document_ids,
-        temperature=request.temperature
-    )
+    # RAG生成回复（失败时不保存消息）
+    try:
+        result = await rag_service.chat(
+            query=request.message,
+            user_id=current_user.id,
+            conversation_history=conversation_history,
+            user_prompt=request.user_prompt,
+            document_ids=request.document_ids,
+            temperature=request.temperature,
+            ef_search=request.ef_search,
+            nprobe=request.nprobe,
+            conversation_summary=conversation.context_summary
+        )
+    except (LLMError, httpx.HTTPError) as e:
+        print(f"❌ Chat API调用失败: {e}")
+        raise _llm_http_error(e)
 
     # 保存用户消息
     user_message = Message(
         conversation_id=conversation.id,
-        role="user",
+        user_id=current_user.id,
+        message_type="user",
         content=request.message
     )
     db.add(user_message)
     await db.commit()
 
-    # 保存AI回复
+    # 保存AI回复（来源只保存元数据，不保存原文）
     ai_message = Message(
         conversation_id=conversation.id,
-        role="assistant",
+        user_id=current_user.id,
+        message_type="assistant",
         content=result["response"],
-        sources=result.get("sources", [])
+        retrieval_context=_dump_sources(result.get("sources", []))
     )
     db.add(ai_message)
     await db.commit()
     await db.refresh(ai_message)
 
+    _maybe_summarize(conversation.id, len(conversation_history))
+
     return ChatResponse(
         message_id=ai_message.id,
         conversation_id=conversation.id,
         response=result["response"],
         sources=result.get("sources", []),
+        usage=result.get("usage", {}),
         created_at=ai_message.created_at.isoformat()
     )
 
 
+@router.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """智能对话（流式，Server-Sent Events）
+
+    事件顺序：sources（检索来源）→ delta（增量文本，多次）→ done（回复已保存）；失败时发送 error
+    """
+    rag_service = get_rag_service(db)
+    conversation = await _get_or_create_conversation(db, request, current_user.id)
+    conversation_history = await _load_history(db, conversation)
+
+    # 检索在响应开始前完成，首个事件即可带上来源
+    prepared = await rag_service.prepare_chat(
+        query=request.message,
+        user_id=current_user.id,
+        conversation_history=conversation_history,
+        user_prompt=request.user_prompt,
+        document_ids=request.document_ids,
+        ef_search=request.ef_search,
+        nprobe=request.nprobe,
+        conversation_summary=conversation.context_summary
+    )
+
+    # 保存用户消息
+    db.add(Message(
+        conversation_id=conversation.id,
+        user_id=current_user.id,
+        message_type="user",
+        content=request.message
+    ))
+    await db.commit()
+
+    conversation_id, user_id = conversation.id, current_user.id
+    sources = prepared["sources"]
+
+    async def event_stream():
+        yield _sse("sources", {
+            "conversation_id": conversation_id,
+            "sources": sources,
+            "usage": prepared["usage"]
+        })
+
+        parts = []
+        try:
+            async for delta in rag_service.llm.stream_chat(prepared["messages"], request.temperature):
+                parts.append(delta)
+                yield _sse("delta", {"content": delta})
+        except Exception as e:
+            print(f"❌ 流式回复失败: {e}")
+            error = _llm_http_error(e)
+            yield _sse("error", {"status": error.status_code, "detail": error.detail})
+            return
+
+        # 请求的数据库会话在响应开始前已关闭，使用独立会话保存AI回复
+        async with AsyncSessionLocal() as session:
+            ai_message = Message(
+                conversation_id=conversation_id,
+                user_id=user_id,
+                message_type="assistant",
+                content="".join(parts),
+                retrieval_context=_dump_sources(sources)
+            )
+            session.add(ai_message)
+            await session.commit()
+            await session.refresh(ai_message)
+
+        _maybe_summarize(conversation_id, len(conversation_history))
+
+        yield _sse("done", {
+            "message_id": ai_message.id,
+            "conversation_id": conversation_id,
+            "created_at": ai_message.created_at.isoformat()
+        })
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # 禁止代理（nginx）缓冲，保证增量文本及时送达
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/conversations")
 async def list_conversations(
     limit: int = 20,
@@ -193,9 +365,9 @@ async def get_conversation_messages(
         "messages": [
             {
                 "id": msg.id,
-                "role": msg.role,
+                "role": msg.message_type,
                 "content": msg.content,
-                "sources": msg.sources,
+                "sources": _load_sources(msg.retrieval_context),
                 "created_at": msg.created_at.isoformat()
             }
             for msg in messages
@@ -3,18 +3,22 @@
 上传、删除、查询文档
 """
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
 import os
-import uuid
-import aiofiles
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
 from core.database import get_db
 from core.security import get_current_user
+from core.upload import ReceivedFile, receive_upload
 from models.user import User
 from services.document_service import DocumentService
 from services.rag_service import RAGService
+from services.ingestion_queue import IngestionQueue, get_job_status
+from services.parsers import detect_format
+from services.upload_session import UploadSessionService, UploadConflictError, UploadTooLargeError
 from core.config import settings
 
 router = APIRouter()
@@ -26,58 +30,298 @@ def get_document_service(db: AsyncSession = Depends(get_db)) -> DocumentService:
     return DocumentService(db, rag_service)
 
 
-@router.post("/upload")
+# 请求体由 receive_upload 流式解析，这里只描述表单结构供接口文档使用
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "doc_key": {"type": "string", "description": "文档逻辑标识，默认文件名"}
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+class UploadProbeRequest(BaseModel):
+    """上传前探测请求（客户端计算的文件SHA-256和大小）"""
+    sha256: str = Field(pattern=r"^[0-9a-fA-F]{64}$")
+    size: int = Field(ge=0)
+
+
+def _upload_result(document, job) -> dict:
+    """上传/探测接口返回的文档信息"""
+    return {
+        "id": document.id,
+        "filename": document.filename,
+        "status": document.status,
+        "version": document.version,
+        "job_id": job.id if job else None,
+        "chunk_count": document.chunk_count,
+        "total_chars": document.total_chars,
+        "created_at": document.created_at.isoformat()
+    }
+
+
+@router.post("/probe")
+async def probe_upload(
+    probe: UploadProbeRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """上传前探测：已上传过相同内容时直接返回已有文档，客户端无需再传输文件
+
+    只匹配当前用户自己的文档（仅凭哈希不能证明持有文件内容，其他用户的文件须完整上传）
+    """
+    if probe.size > settings.MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"文件大小超过限制（最大 {settings.MAX_FILE_SIZE // (1024*1024)}MB）"
+        )
+
+    doc_service = get_document_service(db)
+    document = await doc_service.find_by_hash(current_user.id, probe.sha256.lower())
+    if document is None or document.file_size != probe.size:
+        return {"exists": False}
+
+    job = await doc_service.get_latest_job(document.id)
+    return {"exists": True, "document": _upload_result(document, job)}
+
+
+@router.post("/upload", openapi_extra=UPLOAD_REQUEST_BODY)
 async def upload_document(
-    file: UploadFile = File(...),
+    request: Request,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """上传文档"""
-    # 验证文件类型
-    ext = os.path.splitext(file.filename)[1].lower()[1:]
+    """上传文档（流式写入磁盘，边接收边计算哈希并校验大小）
+
+    表单字段 doc_key 为文档逻辑标识（默认文件名）：与已有文档相同时作为新版本，只重建变化部分的索引
+    """
+    upload = await receive_upload(
+        request,
+        settings.UPLOAD_DIR,
+        max_size=settings.MAX_FILE_SIZE,
+        allowed_extensions=settings.ALLOWED_EXTENSIONS
+    )
+
+    try:
+        return await _ingest_upload(get_document_service(db), current_user.id, upload)
+    except BaseException:
+        upload.discard()
+        raise
+
+
+async def _ingest_upload(doc_service: DocumentService, user_id: int, upload: ReceivedFile) -> dict:
+    """创建文档记录并入队（解析+索引由入库worker异步完成）；重复文件直接返回已有文档"""
+    # 按文件内容识别格式（不信任客户端声明的Content-Type）
+    fmt = await run_in_threadpool(detect_format, upload.path, upload.filename)
+    if fmt is None:
+        raise HTTPException(status_code=400, detail="无法识别的文件内容，请确认文件格式正确")
+
+    document, job = await doc_service.upload_document(
+        user_id=user_id,
+        file_path=upload.path,
+        filename=upload.filename,
+        file_size=upload.size,
+        mime_type=fmt.mime_type,
+        file_hash=upload.sha256,
+        doc_key=upload.fields.get("doc_key")
+    )
+    return _upload_result(document, job)
+
+
+class UploadSessionRequest(BaseModel):
+    """创建断点续传会话"""
+    filename: str = Field(min_length=1, max_length=255)
+    size: int = Field(ge=1)
+    doc_key: Optional[str] = Field(default=None, max_length=255)
+
+
+def _session_result(session) -> dict:
+    return {
+        "upload_id": session.id,
+        "filename": session.filename,
+        "size": session.size,
+        "offset": session.offset,
+        "chunk_size": settings.UPLOAD_CHUNK_SIZE,
+        "expires_at": session.expires_at.isoformat()
+    }
+
+
+async def _get_session(sessions: UploadSessionService, upload_id: str, user_id: int):
+    session = await sessions.get(upload_id, user_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+    return session
+
+
+def _conflict(e: UploadConflictError) -> HTTPException:
+    return HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+
+
+@router.post("/uploads")
+async def create_upload_session(
+    req: UploadSessionRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """创建断点续传上传会话（大文件分段上传，网络中断后从已接收的偏移量继续）
+
+    流程：创建会话 → PATCH /uploads/{upload_id} 按偏移量追加 → GET 查询偏移量（中断后）→ POST /uploads/{upload_id}/complete
+    """
+    filename = os.path.basename(req.filename.replace("\\", "/"))
+    ext = os.path.splitext(filename)[1].lower()[1:]
     if ext not in settings.ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400,
             detail=f"不支持此文件类型。支持的格式: {', '.join(settings.ALLOWED_EXTENSIONS)}"
         )
-
-    # 验证文件大小
-    content = await file.read()
-    if len(content) > settings.MAX_FILE_SIZE:
+    if req.size > settings.MAX_FILE_SIZE:
         raise HTTPException(
-            status_code=400,
+            status_code=413,
             detail=f"文件大小超过限制（最大 {settings.MAX_FILE_SIZE // (1024*1024)}MB）"
         )
 
-    # 保存文件
-    upload_dir = settings.UPLOAD_DIR
-    os.makedirs(upload_dir, exist_ok=True)
+    session = await UploadSessionService(db).create(current_user.id, filename, req.size, req.doc_key)
+    return _session_result(session)
 
-    # 生成唯一文件名
-    unique_filename = f"{uuid.uuid4()}_{file.filename}"
-    file_path = os.path.join(upload_dir, unique_filename)
 
-    async with aiofiles.open(file_path, "wb") as f:
-        await f.write(content)
+@router.get("/uploads/{upload_id}")
+async def get_upload_session(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """查询上传会话已接收的偏移量"""
+    session = await _get_session(UploadSessionService(db), upload_id, current_user.id)
+    return _session_result(session)
 
-    # 创建文档记录并处理
+
+@router.patch("/uploads/{upload_id}")
+async def append_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(alias="Upload-Offset", ge=0),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """从 Upload-Offset 起追加文件数据（请求体为原始字节），返回新的偏移量
+
+    Upload-Offset 须等于已接收的字节数，不符时返回409（响应头 Upload-Offset 为当前偏移量）
+    """
+    sessions = UploadSessionService(db)
+    session = await _get_session(sessions, upload_id, current_user.id)
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and upload_offset + int(content_length) > session.size:
+        raise HTTPException(status_code=413, detail=f"数据超出声明的文件大小（{session.size} 字节）")
+
+    try:
+        offset = await sessions.append(session, upload_offset, request.stream())
+    except UploadConflictError as e:
+        raise _conflict(e)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    return {"upload_id": upload_id, "offset": offset, "size": session.size}
+
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """完成断点续传：文件接收完整后创建文档并入队（与普通上传相同）"""
+    sessions = UploadSessionService(db)
+    session = await _get_session(sessions, upload_id, current_user.id)
     doc_service = get_document_service(db)
-    document = await doc_service.upload_document(
-        user_id=current_user.id,
-        file_path=file_path,
-        filename=file.filename,
-        file_size=len(content),
-        mime_type=file.content_type or "application/octet-stream"
-    )
 
-    return {
-        "id": document.id,
-        "filename": document.filename,
-        "status": document.status,
-        "chunk_count": document.chunk_count,
-        "total_chars": document.total_chars,
-        "created_at": document.created_at.isoformat()
-    }
+    try:
+        return await sessions.complete(
+            session,
+            lambda upload: _ingest_upload(doc_service, current_user.id, upload)
+        )
+    except UploadConflictError as e:
+        raise _conflict(e)
+
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """取消上传，删除已接收的数据"""
+    sessions = UploadSessionService(db)
+    session = await _get_session(sessions, upload_id, current_user.id)
+    await sessions.abort(session)
+    return {"message": "上传已取消"}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """查询入库任务状态（上传后轮询）"""
+    status = await get_job_status(db, job_id, current_user.id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="任务不存在或无权限")
+
+    return status
+
+
+@router.post("/jobs/{job_id}/retry")
+async def retry_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """重新投递进入死信的入库任务"""
+    if await get_job_status(db, job_id, current_user.id) is None:
+        raise HTTPException(status_code=404, detail="任务不存在或无权限")
+
+    if not await IngestionQueue().retry_dead(job_id):
+        raise HTTPException(status_code=409, detail="只能重试失败（死信）的任务")
+
+    return {"message": "任务已重新排队", "job_id": job_id}
+
+
+@router.post("/reindex")
+async def reindex_documents(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """重建当前用户所有文档的索引（如调整分块参数后；读取解析结果缓存，不重新解析）"""
+    doc_service = get_document_service(db)
+    jobs = await doc_service.reindex_documents(current_user.id)
+
+    return {"message": f"已提交 {len(jobs)} 个文档重建索引", "job_ids": [job.id for job in jobs]}
+
+
+@router.post("/{document_id}/reindex")
+async def reindex_document(
+    document_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """重建单个文档的索引"""
+    doc_service = get_document_service(db)
+    jobs = await doc_service.reindex_documents(current_user.id, [document_id])
+    if not jobs:
+        raise HTTPException(status_code=404, detail="文档不存在或无权限")
+
+    return {"message": "已提交重建索引", "job_id": jobs[0].id}
 
 
 @router.get("")
@@ -96,6 +340,7 @@ async def list_documents(
             {
                 "id": doc.id,
                 "filename": doc.filename,
+                "version": doc.version or 1,
                 "status": doc.status,
                 "chunk_count": doc.chunk_count,
                 "total_chars": doc.total_chars,
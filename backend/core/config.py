@@ -23,12 +23,32 @@ class Settings(BaseSettings):
     MILVUS_HOST: str = "localhost"
     MILVUS_PORT: int = 19530
     MILVUS_COLLECTION: str = "enterprise_rag"
-    MILVUS_DIMENSION: int = 768
-
-    # Redis配置（禁用，使用内存缓存）
+    MILVUS_DIMENSION: int = 768  # 向量维度（Milvus与本地向量索引共用）
+
+    # 本地向量索引（ENABLE_MILVUS关闭时使用）
+    VECTOR_INDEX_DIR: str = "./vector_index"
+    # 索引类型：flat（精确检索）/ hnsw（图索引）/ ivf（IVF-Flat），ANN索引使用内存映射文件
+    VECTOR_INDEX_TYPE: str = "flat"
+    HNSW_M: int = 16  # 每层邻居数
+    HNSW_EF_CONSTRUCTION: int = 200
+    HNSW_EF_SEARCH: int = 64  # 默认查询参数，可按请求覆盖
+    HNSW_MAX_EF_SEARCH: int = 1024  # 按请求覆盖时的上限
+    IVF_NLIST: int = 1024  # 粗量化器质心数
+    IVF_NPROBE: int = 16  # 默认探测簇数，可按请求覆盖（上限为 IVF_NLIST）
+    # 向量量化（flat索引）：none / int8（4倍压缩）/ pq（乘积量化，768维约32倍压缩）
+    VECTOR_QUANTIZATION: str = "none"
+    PQ_M: int = 96  # PQ子空间数，需整除向量维度
+    RERANK_FACTOR: int = 8  # 压缩码粗排取 top_k*RERANK_FACTOR 个候选，再用原始向量精排
+
+    # Redis配置（二级缓存，多worker共享；关闭时仅使用进程内缓存）
     ENABLE_REDIS: bool = False
     REDIS_URL: str = "redis://localhost:6379/0"
 
+    # 进程内缓存（LRU + TTL）
+    CACHE_MAX_ENTRIES: int = 10000
+    CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # 64MB
+    CACHE_TTL_SECONDS: int = 300
+
     # 百度千帆API配置（Coding Plan Lite）
     BAIYUN_API_KEY: str = ""
     BAIYUN_ACCESS_KEY: str = ""
@@ -37,17 +57,61 @@ class Settings(BaseSettings):
     BAIYUN_API_BASE: str = "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop"
     EMBEDDING_MODEL: str = "embedding-v1"
     EMBEDDING_API_BASE: str = "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/embeddings/embedding-v1"
+    EMBEDDING_PROVIDER: str = "baidu"  # baidu（千帆接口）/ hashing（本地哈希嵌入，离线测试用）
+    EMBEDDING_BATCH_SIZE: int = 16  # 单次接口调用的文本数（千帆上限16）
+    EMBEDDING_CONCURRENCY: int = 4  # 每个进程同时调用的批次数（所有入库任务共享）
+    EMBEDDING_MAX_RETRIES: int = 3
+    EMBEDDING_RETRY_BACKOFF: float = 0.5  # 秒，指数退避基数
 
     # 文档处理配置
     MAX_FILE_SIZE: int = 50 * 1024 * 1024  # 50MB
-    ALLOWED_EXTENSIONS: list = ["pdf", "docx", "txt", "md", "xlsx", "xls"]
+    ALLOWED_EXTENSIONS: list = ["pdf", "docx", "txt", "md", "xlsx"]
     UPLOAD_DIR: str = "./uploads"
+    # 断点续传上传（大文件分段上传，中断后从已接收的偏移量继续）
+    UPLOAD_CHUNK_SIZE: int = 5 * 1024 * 1024  # 建议客户端每段的字节数
+    UPLOAD_SESSION_TTL: int = 24 * 3600  # 秒，上传会话无新数据后保留的时长
     CHUNK_SIZE: int = 512
     CHUNK_OVERLAP: int = 50
+    # 文档解析进程池（PDF/DOCX/XLSX解析不阻塞事件循环）
+    PARSER_WORKERS: int = 2  # 解析子进程数
+    PARSER_MAX_TASKS_PER_CHILD: int = 50  # 子进程解析该数量的文件后替换，0表示不替换
+    PARSER_TIMEOUT: float = 120.0  # 秒，单个解析任务超时
+    PDF_PAGES_PER_TASK: int = 50  # 大PDF按页范围拆分并行解析，每个任务的最大页数
+    # 解析结果缓存（按文件哈希+解析器版本，gzip压缩），重建索引时跳过解析
+    PARSE_ARTIFACT_CACHE: bool = True
+    PARSE_ARTIFACT_DIR: str = "./artifacts"
+
+    # 文档入库队列（上传只入队，由worker解析+索引）
+    # API进程内置worker；独立部署 python -m workers.ingest 时关闭，并启用Redis使检索缓存跨进程失效
+    INGEST_EMBEDDED_WORKER: bool = True
+    INGEST_CONCURRENCY: int = 2  # 每个worker同时处理的文档数
+    INGEST_MAX_ATTEMPTS: int = 3  # 最大尝试次数，超过后进入死信
+    INGEST_LEASE_SECONDS: int = 300  # 租约时长（秒），处理期间每1/3时长续约一次
+    INGEST_RETRY_BACKOFF: float = 30.0  # 秒，重试退避基数（30s、60s、120s...）
+    INGEST_POLL_INTERVAL: float = 2.0  # 秒，队列为空时的轮询间隔
 
     # RAG配置
+    RETRIEVAL_MODE: str = "keyword"  # keyword（BM25）/ vector（本地向量索引）/ hybrid（混合检索）
     TOP_K: int = 5
+    # 混合检索配置
+    FUSION_METHOD: str = "rrf"  # rrf（倒数排名融合）/ weighted（加权分数归一化）
+    RRF_K: int = 60
+    HYBRID_VECTOR_WEIGHT: float = 0.5  # 向量检索权重，关键词检索权重为 1 - 该值
+    HYBRID_CANDIDATE_FACTOR: int = 4  # 每路召回 top_k * 该值 个候选参与融合
+    KEYWORD_SEARCH_TIMEOUT: float = 2.0  # 秒
+    VECTOR_SEARCH_TIMEOUT: float = 3.0  # 秒（含查询向量生成）
     SIMILARITY_THRESHOLD: float = 0.0  # 关键词搜索不使用相似度阈值
+    BM25_K1: float = 1.5  # 词频饱和参数
+    BM25_B: float = 0.75  # 文档长度归一化参数
+    # 提示词上下文预算（估算token数，中文约1字1个token）
+    CONTEXT_TOKEN_BUDGET: int = 3000  # 检索来源
+    HISTORY_TOKEN_BUDGET: int = 1500  # 对话历史
+    CONTEXT_DEDUP_THRESHOLD: float = 0.8  # 来源之间词集合Jaccard相似度超过该值视为重复
+    # 对话历史滚动摘要
+    SUMMARY_TRIGGER_MESSAGES: int = 16  # 摘要之后的消息数超过该值时后台压缩（也是每轮读取的消息上限）
+    SUMMARY_KEEP_MESSAGES: int = 6  # 压缩时保留原文的最近消息数
+    SUMMARY_BATCH_MESSAGES: int = 40  # 单次压缩最多合并的消息数
+    SUMMARY_MAX_CHARS: int = 800  # 摘要长度上限（字符）
 
     # 长期记忆配置
     MEMORY_MAX_ENTRIES: int = 1000
@@ -64,6 +128,30 @@ class Settings(BaseSettings):
 
     # 百度千帆认证服务器
     BAIYUN_AUTH_URL: str = "https://aip.baidubce.com/oauth/2.0/token"
+    BAIYUN_TOKEN_REFRESH_AHEAD: int = 24 * 3600  # 秒，令牌到期前提前在后台刷新
+    BAIYUN_TOKEN_CACHE_FILE: str = "./.qianfan_token.json"  # 未启用Redis时多worker共享令牌的文件
+
+    # 外部API的HTTP客户端（共享连接池）
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0  # 秒，空闲连接保留时间
+    HTTP_ENABLE_HTTP2: bool = True  # 需安装 h2，未安装时自动使用HTTP/1.1
+    HTTP_CONNECT_TIMEOUT: float = 5.0  # 秒
+    HTTP_POOL_TIMEOUT: float = 10.0  # 秒，等待空闲连接
+    HTTP_READ_TIMEOUT: float = 60.0  # 秒，默认读超时
+    AUTH_TIMEOUT: float = 10.0  # 秒
+    EMBEDDING_TIMEOUT: float = 30.0  # 秒
+    CHAT_TIMEOUT: float = 60.0  # 秒
+
+    # 大模型调用准入控制（并发上限 + 排队 + AIMD自适应 + 熔断）
+    LLM_MAX_CONCURRENCY: int = 8  # 同时在途请求数上限
+    LLM_MIN_CONCURRENCY: int = 1
+    LLM_MAX_QUEUE: int = 100  # 排队请求数上限，超出直接拒绝
+    LLM_QUEUE_TIMEOUT: float = 10.0  # 秒，排队超过该时间直接拒绝
+    LLM_LATENCY_TARGET: float = 15.0  # 秒，响应（流式为首个token）慢于该值时减小并发
+    LLM_DECREASE_FACTOR: float = 0.5  # 限流/超时/慢响应时并发上限的乘性缩减系数
+    LLM_BREAKER_THRESHOLD: int = 5  # 连续故障次数达到该值时熔断
+    LLM_BREAKER_COOLDOWN: float = 30.0  # 秒，熔断持续时间
 
     class Config:
         env_file = ".env"
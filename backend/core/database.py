@@ -4,6 +4,7 @@
 
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy import inspect, text
 from sqlmodel import SQLModel
 
 from core.config import settings
@@ -31,8 +32,34 @@ async def init_db():
         from models.document import Document
         from models.memory import Memory
         from models.conversation import Conversation, Message
+        from models.chunk import DocumentChunk, ChunkPosting, KeywordIndexStats
+        from models.embedding import EmbeddingCacheEntry
+        from models.job import IngestionJob
+        from models.blob import Blob
+        from models.upload import UploadSession
 
         await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+
+
+def _add_missing_columns(sync_conn):
+    """为已有表补齐新增的列（create_all 不会修改已有表；新增列一律按可空添加）"""
+    inspector = inspect(sync_conn)
+    existing_tables = set(inspector.get_table_names())
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            for index in table.indexes:
+                if column.name in index.columns:
+                    index.create(sync_conn, checkfirst=True)
+            print(f"🛠️  数据库迁移: {table.name} 新增列 {column.name}")
 
 
 async def get_db() -> AsyncSession:
@@ -0,0 +1,56 @@
+"""
+共享异步HTTP客户端
+应用启动时创建（连接池 + keep-alive + HTTP/2），所有外部API调用复用，不阻塞事件循环
+"""
+
+from typing import Optional
+
+import httpx
+
+from core.config import settings
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    """HTTP/2 需要 h2 包（httpx[http2]）"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def request_timeout(read: float) -> httpx.Timeout:
+    """单次请求超时：读超时按接口指定，连接/连接池等待超时使用全局配置"""
+    return httpx.Timeout(
+        read,
+        connect=settings.HTTP_CONNECT_TIMEOUT,
+        pool=settings.HTTP_POOL_TIMEOUT
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享客户端（未经应用生命周期初始化时懒创建，如独立脚本）"""
+    global _client
+    if _client is None or _client.is_closed:
+        http2 = settings.HTTP_ENABLE_HTTP2 and _http2_available()
+        _client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=request_timeout(settings.HTTP_READ_TIMEOUT)
+        )
+        print(f"🌐 HTTP客户端已创建（HTTP/2: {'开启' if http2 else '关闭'}，最大连接数: {settings.HTTP_MAX_CONNECTIONS}）")
+    return _client
+
+
+async def close_http_client():
+    """关闭共享客户端（应用关闭时调用）"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,181 @@
+"""
+流式文件上传
+直接解析请求体（multipart/form-data），边接收边写入临时文件并计算SHA-256，
+超过大小限制立即中止：内存占用与文件大小无关，文件只落盘一次
+"""
+
+import os
+import uuid
+import hashlib
+from typing import Dict, List, Optional
+
+import aiofiles
+from fastapi import HTTPException, Request
+from multipart.multipart import MultipartParser, parse_options_header
+from multipart.exceptions import MultipartParseError
+
+# 普通表单字段（标题、描述等）的大小上限
+MAX_FIELD_SIZE = 64 * 1024
+# multipart 边界和part头部的额外开销估计，用于 Content-Length 预检
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class ReceivedFile:
+    """已接收的上传文件（位于临时路径，由调用方移动或删除）"""
+
+    def __init__(self, path: str, filename: str, content_type: str, size: int, sha256: str, fields: Dict[str, str]):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.sha256 = sha256
+        self.fields = fields
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _too_large(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"文件大小超过限制（最大 {max_size // (1024*1024)}MB）"
+    )
+
+
+class _StreamingForm:
+    """python-multipart 回调：文件part的数据暂存为待写入片段，其余part收集为字段"""
+
+    def __init__(self, file_field: str, allowed_extensions: List[str] = None):
+        self.file_field = file_field
+        self.allowed_extensions = allowed_extensions
+        self.fields: Dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.content_type = "application/octet-stream"
+        self.pending: List[bytes] = []
+
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_name = b""
+        self._header_value = b""
+        self._name: Optional[str] = None
+        self._is_file = False
+        self._data = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._name = None
+        self._is_file = False
+        self._data = b""
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = options.get(b"name", b"").decode("utf-8", "replace")
+        if self._name == self.file_field and b"filename" in options:
+            if self.filename is not None:
+                raise HTTPException(status_code=400, detail="一次只能上传一个文件")
+            self._is_file = True
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            # 收到文件数据之前校验类型
+            ext = os.path.splitext(self.filename)[1].lower()[1:]
+            if self.allowed_extensions is not None and ext not in self.allowed_extensions:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"不支持此文件类型。支持的格式: {', '.join(self.allowed_extensions)}"
+                )
+            content_type = self._headers.get(b"content-type")
+            if content_type:
+                self.content_type = content_type.decode("latin-1")
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._is_file:
+            self.pending.append(data[start:end])
+        else:
+            self._data += data[start:end]
+            if len(self._data) > MAX_FIELD_SIZE:
+                raise HTTPException(status_code=400, detail="表单字段过长")
+
+    def on_part_end(self):
+        if not self._is_file and self._name:
+            self.fields[self._name] = self._data.decode("utf-8", "replace")
+
+
+async def receive_upload(
+    request: Request,
+    dest_dir: str,
+    max_size: int,
+    allowed_extensions: List[str] = None,
+    file_field: str = "file"
+) -> ReceivedFile:
+    """流式接收 multipart 请求中的文件，返回临时文件路径、大小和SHA-256
+
+    超过 max_size 时返回413（Content-Length 明显超限时不读取请求体）
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="请使用 multipart/form-data 上传文件")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise _too_large(max_size)
+
+    os.makedirs(dest_dir, exist_ok=True)
+    tmp_path = os.path.join(dest_dir, f".upload-{uuid.uuid4().hex}.part")
+    form = _StreamingForm(file_field, allowed_extensions)
+    parser = MultipartParser(params[b"boundary"], form.callbacks())
+    sha256 = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                for data in form.pending:
+                    size += len(data)
+                    if size > max_size:
+                        raise _too_large(max_size)
+                    sha256.update(data)
+                    await f.write(data)
+                form.pending.clear()
+        parser.finalize()
+    except MultipartParseError:
+        os.remove(tmp_path)
+        raise HTTPException(status_code=400, detail="上传请求格式错误")
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if form.filename is None:
+        os.remove(tmp_path)
+        raise HTTPException(status_code=400, detail="未找到上传文件")
+
+    return ReceivedFile(
+        path=tmp_path,
+        filename=os.path.basename(form.filename.replace("\\", "/")),
+        content_type=form.content_type,
+        size=size,
+        sha256=sha256.hexdigest(),
+        fields=form.fields
+    )
@@ -6,19 +6,43 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 
 from core.config import settings
 from core.database import init_db
+from core.http import get_http_client, close_http_client
 from api import documents, chat, users, memory
+from services.cache import search_cache
+from services.token_manager import qianfan_token
+from services.document_parser import parser_pool
+from services.llm_gateway import chat_gateway
+from services.ingestion_queue import IngestionWorker, require_shared_cache
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     # 启动时初始化
     await init_db()
+    await search_cache.start()
+    get_http_client()
+    await qianfan_token.start()
+    # 单进程部署时在API进程内处理入库队列；独立部署的worker经Redis通知本进程缓存失效
+    ingest_worker, ingest_task = None, None
+    if settings.INGEST_EMBEDDED_WORKER:
+        ingest_worker = IngestionWorker()
+        ingest_task = asyncio.create_task(ingest_worker.run())
+    else:
+        require_shared_cache(search_cache)
     print("🚀 企业级RAG系统启动成功！")
     yield
     # 关闭时清理
+    if ingest_worker:
+        ingest_worker.stop()
+        await ingest_task
+    parser_pool.shutdown()
+    await qianfan_token.close()
+    await close_http_client()
+    await search_cache.close()
     print("👋 企业级RAG系统已关闭")
 
 app = FastAPI(
@@ -58,5 +82,9 @@ async def health_check():
     return {
         "status": "healthy",
         "database": "connected",
-        "vector_db": "connected"
+        "vector_db": "connected",
+        "cache": search_cache.stats(),
+        "qianfan_token": qianfan_token.stats(),
+        "llm": chat_gateway.stats(),
+        "parser": parser_pool.stats()
     }
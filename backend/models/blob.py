@@ -0,0 +1,16 @@
+"""
+上传文件存储模型
+文件按SHA-256内容寻址，相同内容只存一份；每个引用该文件的文档记录持有一个引用计数
+"""
+
+from sqlmodel import SQLModel, Field
+from datetime import datetime
+
+
+class Blob(SQLModel, table=True):
+    """文件内容表"""
+    sha256: str = Field(primary_key=True, max_length=64)
+    size: int = Field(default=0)  # 字节
+    ref_count: int = Field(default=0)  # 引用该文件的文档数，降为0后回收
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
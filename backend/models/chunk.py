@@ -0,0 +1,51 @@
+"""
+文档块与倒排索引模型
+支持：文档块存储、BM25关键词检索（按用户分区）
+"""
+
+from sqlalchemy import Column, Text
+from sqlmodel import SQLModel, Field
+from datetime import datetime
+from typing import Optional
+
+
+class DocumentChunk(SQLModel, table=True):
+    """文档块表"""
+    __tablename__ = "document_chunk"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    document_id: int = Field(foreign_key="document.id", index=True)
+    chunk_index: int = Field(default=0)  # 文档内序号
+    page_start: Optional[int] = Field(default=None)  # 分页文档（PDF）的起止页码，从1开始
+    page_end: Optional[int] = Field(default=None)
+    file_name: str = Field(max_length=255)
+    content: str = Field(sa_column=Column(Text, nullable=False))
+    content_hash: Optional[str] = Field(default=None, max_length=64)  # 内容SHA256，文档新版本据此复用未变化的块
+    length: int = Field(default=0)  # 词元数（BM25文档长度）
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ChunkPosting(SQLModel, table=True):
+    """倒排索引表（词项 -> 文档块）
+
+    主键按 (user_id, term, chunk_id) 排列，查询某用户某词项的倒排链只需一次索引范围扫描
+    """
+    __tablename__ = "chunk_posting"
+
+    user_id: int = Field(primary_key=True)
+    term: str = Field(primary_key=True, max_length=64)
+    chunk_id: int = Field(primary_key=True)
+    document_id: int = Field(index=True)
+    tf: int = Field(default=1)  # 词频
+    doc_len: int = Field(default=0)  # 冗余文档块长度，打分时无需回表
+
+
+class KeywordIndexStats(SQLModel, table=True):
+    """每个用户的倒排索引统计（BM25所需的全局量）"""
+    __tablename__ = "keyword_index_stats"
+
+    user_id: int = Field(primary_key=True)
+    chunk_count: int = Field(default=0)
+    total_length: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -23,6 +23,8 @@ class Conversation(ConversationBase, table=True):
     user_id: int = Field(foreign_key="user.id", index=True)
     message_count: int = Field(default=0)
     is_active: bool = Field(default=True)
+    # context_summary 已覆盖到的最后一条消息ID（之后的消息以原文进入提示词）
+    summary_message_id: Optional[int] = Field(default=None)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
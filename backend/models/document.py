@@ -27,6 +27,8 @@ class Document(DocumentBase, table=True):
     filename: str = Field(max_length=255)  # 原始文件名
     file_path: str = Field(max_length=500)
     file_hash: str = Field(default="", max_length=64)  # SHA256哈希，用于去重
+    doc_key: Optional[str] = Field(default=None, max_length=255, index=True)  # 逻辑标识（默认文件名），同一标识再次上传视为新版本
+    version: int = Field(default=1)  # 当前版本号
     mime_type: str = Field(default="application/octet-stream", max_length=100)
     total_chars: int = Field(default=0)  # 字符总数
     chunk_count: int = Field(default=0)  # 分块数量
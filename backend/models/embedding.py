@@ -0,0 +1,19 @@
+"""
+向量缓存模型
+按 sha256(模型 + 文本) 寻址，内容不变的文档块不再重复调用Embedding接口
+"""
+
+from sqlalchemy import Column, LargeBinary
+from sqlmodel import SQLModel, Field
+from datetime import datetime
+
+
+class EmbeddingCacheEntry(SQLModel, table=True):
+    """向量缓存表"""
+    __tablename__ = "embedding_cache"
+
+    key: str = Field(primary_key=True, max_length=64)  # sha256(model + "\n" + text)
+    model: str = Field(max_length=100)
+    dimension: int
+    vector: bytes = Field(sa_column=Column(LargeBinary, nullable=False))  # float32字节序列
+    created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,32 @@
+"""
+文档入库任务模型
+数据库队列：租约领取 + 失败重试（指数退避）+ 死信
+"""
+
+from sqlmodel import SQLModel, Field
+from datetime import datetime
+from typing import Optional
+
+
+class IngestionJob(SQLModel, table=True):
+    """文档入库任务表"""
+    __tablename__ = "ingestion_job"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    document_id: int = Field(foreign_key="document.id", index=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+
+    # queued（等待）/ running（处理中）/ succeeded（成功）/ dead（重试耗尽，死信）
+    status: str = Field(default="queued", max_length=20, index=True)
+    attempts: int = Field(default=0)  # 已领取次数
+    max_attempts: int = Field(default=3)
+    available_at: datetime = Field(default_factory=datetime.utcnow, index=True)  # 最早可领取时间（退避）
+
+    # 租约：worker领取后在 lease_expires_at 前独占该任务，过期未续约视为worker失联，任务可被重新领取
+    lease_owner: Optional[str] = Field(default=None, max_length=100)
+    lease_expires_at: Optional[datetime] = Field(default=None)
+
+    last_error: Optional[str] = Field(default=None, max_length=1000)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = Field(default=None)
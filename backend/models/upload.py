@@ -0,0 +1,27 @@
+"""
+断点续传上传会话模型
+客户端先创建会话，再按偏移量分段追加文件内容，中断后查询已接收的偏移量继续上传
+"""
+
+from sqlmodel import SQLModel, Field
+from datetime import datetime
+from typing import Optional
+
+
+class UploadSession(SQLModel, table=True):
+    """上传会话表"""
+    __tablename__ = "upload_session"
+
+    id: str = Field(primary_key=True, max_length=32)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    filename: str = Field(max_length=255)
+    doc_key: Optional[str] = Field(default=None, max_length=255)
+    size: int  # 文件总字节数（创建时声明）
+    offset: int = Field(default=0)  # 已接收的字节数
+
+    # 追加/完成期间独占会话，防止同一会话的并发写入；过期视为请求已中断
+    lease_expires_at: Optional[datetime] = Field(default=None)
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime = Field(index=True)  # 每次追加后顺延，过期的会话和临时文件被清理
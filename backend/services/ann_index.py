@@ -0,0 +1,670 @@
+"""
+近似最近邻（ANN）向量索引
+支持：HNSW图索引、IVF-Flat倒排聚类索引；向量与图结构均存放在内存映射文件中
+"""
+
+import os
+import json
+import math
+import heapq
+import random
+import threading
+from typing import List, Dict, Tuple, Optional, Set
+
+import numpy as np
+
+from services.vector_index import normalize
+
+# 带文档过滤的查询：候选行数不超过该值时直接精确检索
+FILTER_EXACT_LIMIT = 20000
+# 精确扫描时每次读入的行数
+SCAN_BLOCK_ROWS = 65536
+# HNSW逐层搜索时每轮同时扩展的候选数
+EXPAND_WIDTH = 16
+
+
+def _write_json(path: str, data: Dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _top_k(rows: np.ndarray, scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    """从 (行号, 分数) 中取top_k，按分数降序"""
+    if len(scores) == 0 or k <= 0:
+        return []
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(rows[i]), float(scores[i])) for i in top]
+
+
+class MmapVectorStore:
+    """追加写入的内存映射向量存储
+
+    vectors / chunk_ids / document_ids / deleted 为定长记录的裸二进制文件，
+    meta.json 中的 count 是已提交的行数，追加前截掉崩溃遗留的尾部数据
+    （只读打开不修改文件，其他进程可同时读取）
+    """
+
+    def __init__(self, path: str, dimension: int):
+        self.path = path
+        self.dimension = dimension
+        os.makedirs(path, exist_ok=True)
+
+        meta = _read_json(self._meta_file)
+        if meta and meta["dimension"] != dimension:
+            raise ValueError(
+                f"向量索引维度 {meta['dimension']} 与配置 MILVUS_DIMENSION={dimension} 不一致"
+            )
+        self.count = meta.get("count", 0)
+        self._columns = {
+            "vectors": (np.float32, (dimension,)),
+            "chunk_ids": (np.int64, ()),
+            "document_ids": (np.int64, ()),
+            "deleted": (np.uint8, ()),
+        }
+        self._map()
+
+    @property
+    def _meta_file(self) -> str:
+        return os.path.join(self.path, "meta.json")
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _row_bytes(self, name: str) -> int:
+        dtype, shape = self._columns[name]
+        return np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64))
+
+    def _truncate(self):
+        for name in self._columns:
+            file = self._file(name)
+            size = self.count * self._row_bytes(name)
+            if os.path.exists(file) and os.path.getsize(file) > size:
+                os.truncate(file, size)
+
+    def _map(self):
+        """重新建立内存映射（只读映射不会把文件读入内存）"""
+        for name, (dtype, shape) in self._columns.items():
+            if self.count == 0:
+                array = np.empty((0,) + shape, dtype=dtype)
+            else:
+                mode = "r+" if name == "deleted" else "r"
+                array = np.memmap(self._file(name), dtype=dtype, mode=mode, shape=(self.count,) + shape)
+            setattr(self, name, array)
+
+    def append(self, chunk_ids: List[int], document_ids: List[int], vectors: np.ndarray) -> int:
+        """追加向量，返回起始行号"""
+        start = self.count
+        self._truncate()
+        columns = {
+            "vectors": np.ascontiguousarray(vectors, dtype=np.float32),
+            "chunk_ids": np.asarray(chunk_ids, dtype=np.int64),
+            "document_ids": np.asarray(document_ids, dtype=np.int64),
+            "deleted": np.zeros(len(vectors), dtype=np.uint8),
+        }
+        for name, array in columns.items():
+            with open(self._file(name), "ab") as f:
+                f.write(array.tobytes())
+
+        self.count += len(vectors)
+        _write_json(self._meta_file, {"dimension": self.dimension, "count": self.count})
+        self._map()
+        return start
+
+    def mark_deleted(self, document_id: int) -> int:
+        """标记删除文档的所有行（墓碑）"""
+        if self.count == 0:
+            return 0
+        rows = np.flatnonzero((self.document_ids == document_id) & (self.deleted == 0))
+        if len(rows):
+            self.deleted[rows] = 1
+            self.deleted.flush()
+        return len(rows)
+
+    def mark_chunks_deleted(self, chunk_ids: List[int]) -> int:
+        """标记删除指定文档块的行（墓碑）"""
+        if self.count == 0 or not chunk_ids:
+            return 0
+        rows = np.flatnonzero(np.isin(self.chunk_ids, chunk_ids) & (self.deleted == 0))
+        if len(rows):
+            self.deleted[rows] = 1
+            self.deleted.flush()
+        return len(rows)
+
+    def live_chunk_ids(self, chunk_ids: List[int]) -> Set[int]:
+        """chunk_ids 中有未删除行的文档块ID"""
+        if self.count == 0 or not len(chunk_ids):
+            return set()
+        return set(np.intersect1d(self.chunk_ids[self.deleted == 0], chunk_ids).tolist())
+
+    def candidate_rows(self, document_ids: List[int] = None) -> np.ndarray:
+        """未删除且满足文档过滤条件的行号"""
+        mask = self.deleted == 0
+        if document_ids:
+            mask &= np.isin(self.document_ids, document_ids)
+        return np.flatnonzero(mask)
+
+    def exact_search(self, query: np.ndarray, top_k: int, rows: np.ndarray = None) -> List[Tuple[int, float]]:
+        """分块精确检索，返回 [(行号, 分数)]"""
+        if rows is None:
+            rows = self.candidate_rows()
+
+        best: List[Tuple[int, float]] = []
+        for start in range(0, len(rows), SCAN_BLOCK_ROWS):
+            block = rows[start:start + SCAN_BLOCK_ROWS]
+            scores = self.vectors[block] @ query
+            best = heapq.nlargest(top_k, best + _top_k(block, scores, top_k), key=lambda item: item[1])
+        return best
+
+
+class _GraphView:
+    """HNSW图的遍历（检索和建图共用）
+
+    limit 为已建图的节点数：邻接表中编号不小于 limit 的节点（正在建图或建图未提交）一律忽略
+    """
+
+    def __init__(self, vectors: np.ndarray, graph0: np.ndarray, upper: Dict[int, Dict[int, int]],
+                 upper_links: np.ndarray, limit: int):
+        # 内存映射数组转为普通数组视图（不复制），避免每次取下标时memmap子类的额外开销
+        self.vectors = np.asarray(vectors)
+        self.graph0 = np.asarray(graph0)
+        self.upper = upper
+        self.upper_links = np.asarray(upper_links)
+        self.limit = limit
+
+    def neighbors(self, nodes: np.ndarray, level: int) -> np.ndarray:
+        """多个节点在某层的全部邻居（展平，可能重复）"""
+        if level == 0:
+            links = self.graph0[nodes]
+        else:
+            layer = self.upper.get(level, {})
+            rows = [layer[n] for n in nodes.tolist() if n in layer]
+            if not rows:
+                return np.empty(0, dtype=np.int32)
+            links = self.upper_links[rows]
+        links = links.ravel()
+        return links[(links >= 0) & (links < self.limit)]
+
+    def greedy(self, query: np.ndarray, entry_point: int, top_level: int, bottom_level: int) -> int:
+        """从 top_level 逐层贪心下降到 bottom_level+1，返回最近的节点"""
+        best, best_score = entry_point, float(self.vectors[entry_point] @ query)
+        for level in range(top_level, bottom_level, -1):
+            improved = True
+            while improved:
+                improved = False
+                neighbors = self.neighbors(np.array([best]), level)
+                if len(neighbors):
+                    scores = self.vectors[neighbors] @ query
+                    i = int(np.argmax(scores))
+                    if scores[i] > best_score:
+                        best, best_score, improved = int(neighbors[i]), float(scores[i]), True
+        return best
+
+    def search_layer(self, query: np.ndarray, entry_points: np.ndarray, ef: int, level: int) -> Tuple[np.ndarray, np.ndarray]:
+        """单层beam search，返回 (节点, 相似度)，按相似度降序
+
+        每轮同时扩展最好的 EXPAND_WIDTH 个候选，一次取出它们的全部邻居计算相似度，
+        结果集和候选集用数组维护（避免逐个邻居的堆操作）
+        """
+        visited = np.zeros(self.limit, dtype=bool)
+        nodes = np.unique(entry_points)
+        visited[nodes] = True
+        scores = self.vectors[nodes] @ query
+        found_nodes, found_scores = nodes, scores
+        frontier_nodes, frontier_scores = nodes, scores
+
+        while len(frontier_nodes):
+            # 候选不可能进入结果集时停止
+            bound = found_scores.min() if len(found_nodes) >= ef else -np.inf
+            keep = frontier_scores >= bound
+            if not keep.all():
+                frontier_nodes, frontier_scores = frontier_nodes[keep], frontier_scores[keep]
+                if not len(frontier_nodes):
+                    break
+
+            if len(frontier_nodes) > EXPAND_WIDTH:
+                order = np.argpartition(-frontier_scores, EXPAND_WIDTH - 1)
+                expand = frontier_nodes[order[:EXPAND_WIDTH]]
+                rest = order[EXPAND_WIDTH:]
+                frontier_nodes, frontier_scores = frontier_nodes[rest], frontier_scores[rest]
+            else:
+                expand = frontier_nodes
+                frontier_nodes, frontier_scores = frontier_nodes[:0], frontier_scores[:0]
+
+            neighbors = np.unique(self.neighbors(expand, level))
+            neighbors = neighbors[~visited[neighbors]]
+            if not len(neighbors):
+                continue
+            visited[neighbors] = True
+            scores = self.vectors[neighbors] @ query
+            if len(found_nodes) >= ef:
+                better = scores > bound
+                neighbors, scores = neighbors[better], scores[better]
+                if not len(neighbors):
+                    continue
+
+            found_nodes = np.concatenate([found_nodes, neighbors])
+            found_scores = np.concatenate([found_scores, scores])
+            if len(found_nodes) > ef:
+                top = np.argpartition(-found_scores, ef - 1)[:ef]
+                found_nodes, found_scores = found_nodes[top], found_scores[top]
+            frontier_nodes = np.concatenate([frontier_nodes, neighbors])
+            frontier_scores = np.concatenate([frontier_scores, scores])
+
+        order = np.argsort(-found_scores)
+        return found_nodes[order], found_scores[order]
+
+
+class HNSWIndex:
+    """HNSW图索引
+
+    第0层邻接表为 (行数, 2M) 的int32内存映射文件（-1填充）；
+    上层节点很少（约 n/M），邻接表为 (行数, M) 的内存映射文件，upper_nodes.bin 记录每行对应的 (节点, 层)。
+    add 只追加向量，建图由 build 完成（不持有检索锁，检索照常进行）：
+    尚未建图的节点在检索时精确扫描，建图过程中已插入的节点立即可被检索到；
+    建图完成后只刷写修改过的页并追加新的上层节点，hnsw.json 中的计数作为提交点
+    """
+
+    def __init__(self, path: str, dimension: int, m: int = 16, ef_construction: int = 200, ef_search: int = 64,
+                 max_ef_search: int = 1024):
+        self.store = MmapVectorStore(path, dimension)
+        self.path = path
+        self.m = m
+        self.m0 = 2 * m
+        self.level_mult = 1 / math.log(max(m, 2))
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.max_ef_search = max(max_ef_search, ef_search)
+        # 保护追加/删除和图的入口状态（检索只在取快照时持有）
+        self._lock = threading.RLock()
+
+        meta = _read_json(self._meta_file)
+        self.entry_point: Optional[int] = meta.get("entry_point")
+        self.max_level: int = meta.get("max_level", -1)
+        self.graph_count: int = meta.get("graph_count", 0)
+        self.upper_rows: int = meta.get("upper_rows", 0)
+        self._graph0 = self._map_graph(self.graph_count)
+        self._upper, self._upper_links = self._load_upper()
+
+    @property
+    def _meta_file(self) -> str:
+        return os.path.join(self.path, "hnsw.json")
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _map_graph(self, rows: int) -> np.ndarray:
+        """映射第0层邻接表的前 rows 行（文件不足时以-1补齐）"""
+        file = self._file("graph0")
+        expected = rows * self.m0 * 4
+        size = os.path.getsize(file) if os.path.exists(file) else 0
+        if size < expected:
+            with open(file, "ab") as f:
+                f.write(np.full((expected - size) // 4, -1, dtype=np.int32).tobytes())
+        if rows == 0:
+            return np.empty((0, self.m0), dtype=np.int32)
+        return np.memmap(file, dtype=np.int32, mode="r+", shape=(rows, self.m0))
+
+    def _map_upper_links(self, capacity: int) -> np.ndarray:
+        """映射上层邻接表（容量按倍增扩展，超出 upper_rows 的行未提交）"""
+        file = self._file("upper_links")
+        expected = capacity * self.m * 4
+        size = os.path.getsize(file) if os.path.exists(file) else 0
+        if size < expected:
+            with open(file, "ab") as f:
+                f.write(np.full((expected - size) // 4, -1, dtype=np.int32).tobytes())
+        if capacity == 0:
+            return np.empty((0, self.m), dtype=np.int32)
+        return np.memmap(file, dtype=np.int32, mode="r+", shape=(capacity, self.m))
+
+    def _load_upper(self) -> Tuple[Dict[int, Dict[int, int]], np.ndarray]:
+        """上层节点 -> 邻接表行号（只加载已提交的行）"""
+        upper: Dict[int, Dict[int, int]] = {}
+        if self.upper_rows:
+            entries = np.fromfile(self._file("upper_nodes"), dtype=np.int32, count=self.upper_rows * 2)
+            for row, (node, level) in enumerate(entries.reshape(-1, 2).tolist()):
+                upper.setdefault(level, {})[node] = row
+        file = self._file("upper_links")
+        capacity = os.path.getsize(file) // (self.m * 4) if os.path.exists(file) else 0
+        return upper, self._map_upper_links(max(capacity, self.upper_rows))
+
+    def add(self, chunk_ids: List[int], document_ids: List[int], vectors) -> int:
+        """追加向量（不建图，由 build 插入图中）"""
+        vectors = normalize(vectors)
+        if len(vectors) == 0:
+            return 0
+        with self._lock:
+            self.store.append(chunk_ids, document_ids, vectors)
+        return len(vectors)
+
+    def delete_document(self, document_id: int) -> int:
+        # 删除的节点保留在图中用于导航，检索结果中过滤
+        with self._lock:
+            return self.store.mark_deleted(document_id)
+
+    def delete_chunks(self, chunk_ids: List[int]) -> int:
+        with self._lock:
+            return self.store.mark_chunks_deleted(chunk_ids)
+
+    def indexed_chunk_ids(self, chunk_ids: List[int]) -> Set[int]:
+        with self._lock:
+            return self.store.live_chunk_ids(chunk_ids)
+
+    def needs_build(self) -> bool:
+        return self.graph_count < self.store.count
+
+    def build(self) -> Dict:
+        """把尚未建图的节点插入图中并刷写到磁盘，返回待提交的元数据（由 install 提交）
+
+        同一索引同时只能有一个 build（由调用方保证）
+        """
+        with self._lock:
+            count = self.store.count
+            vectors = self.store.vectors
+        self._graph0 = self._map_graph(count)
+        view = _GraphView(vectors, self._graph0, self._upper, self._upper_links, self.graph_count)
+        committed_rows = self.upper_rows
+
+        for node in range(self.graph_count, count):
+            self._insert(view, node)
+            view.limit = node + 1
+
+        self._graph0.flush()
+        if len(self._upper_links):
+            self._upper_links.flush()
+        # 追加新的上层节点（截掉上次未提交的尾部）
+        with open(self._file("upper_nodes"), "ab") as f:
+            f.truncate(committed_rows * 8)
+            entries = [(node, level) for level, layer in self._upper.items()
+                       for node, row in layer.items() if row >= committed_rows]
+            entries.sort(key=lambda entry: self._upper[entry[1]][entry[0]])
+            f.write(np.asarray(entries, dtype=np.int32).reshape(-1, 2).tobytes())
+
+        return {
+            "entry_point": self.entry_point,
+            "max_level": self.max_level,
+            "graph_count": self.graph_count,
+            "upper_rows": self.upper_rows,
+            "m": self.m,
+        }
+
+    def install(self, meta: Dict):
+        """提交 build 的结果"""
+        _write_json(self._meta_file, meta)
+
+    def _upper_row(self, node: int, level: int) -> int:
+        """节点在某个上层的邻接表行号（没有时分配新行）"""
+        layer = self._upper.setdefault(level, {})
+        row = layer.get(node)
+        if row is None:
+            row = self.upper_rows
+            if row >= len(self._upper_links):
+                self._upper_links = self._map_upper_links(max(2 * len(self._upper_links), 1024))
+            # 可能是上次未提交的行，先清空
+            self._upper_links[row] = -1
+            self.upper_rows += 1
+            layer[node] = row
+        return row
+
+    def _insert(self, view: _GraphView, node: int):
+        query = np.asarray(view.vectors[node])
+        # 层数由节点编号确定：重新插入未提交的节点时层数不变，已提交节点残留的指向它的连接仍然有效
+        level = int(-math.log(1.0 - random.Random(node).random()) * self.level_mult)
+        for lc in range(1, level + 1):
+            self._upper_row(node, lc)
+        view.upper_links = np.asarray(self._upper_links)
+
+        if self.entry_point is not None:
+            entry_point = view.greedy(query, self.entry_point, self.max_level, level)
+            entry_points = np.array([entry_point])
+            for lc in range(min(level, self.max_level), -1, -1):
+                found, _ = view.search_layer(query, entry_points, self.ef_construction, lc)
+                self._link(view, node, lc, found[:self.m])
+                entry_points = found
+
+        with self._lock:
+            if self.entry_point is None or level > self.max_level:
+                self.entry_point, self.max_level = node, level
+            self.graph_count = node + 1
+
+    def _link(self, view: _GraphView, node: int, level: int, neighbors: np.ndarray):
+        """节点与邻居双向连接；邻居的邻接表已满时保留最相似的邻居（所有邻居一次性计算）"""
+        if level == 0:
+            matrix, capacity = self._graph0, self.m0
+            rows = neighbors
+            matrix[node] = -1
+            matrix[node, :len(neighbors)] = neighbors
+        else:
+            matrix, capacity = self._upper_links, self.m
+            rows = np.array([self._upper[level][int(n)] for n in neighbors], dtype=np.int64)
+            matrix[self._upper[level][node], :len(neighbors)] = neighbors
+        if not len(neighbors):
+            return
+
+        # 邻接表按有效邻居在前、-1在后的顺序存放
+        links = np.array(matrix[rows])
+        counts = (links >= 0).sum(axis=1)
+        free = counts < capacity
+        links[free, counts[free]] = node
+
+        full = ~free
+        if full.any():
+            candidates = np.concatenate([links[full], np.full((int(full.sum()), 1), node, dtype=np.int32)], axis=1)
+            scores = np.einsum("fcd,fd->fc", view.vectors[candidates], view.vectors[neighbors[full]])
+            keep = np.argsort(-scores, axis=1)[:, :capacity]
+            links[full] = np.take_along_axis(candidates, keep, axis=1)
+        matrix[rows] = links
+
+    def search(
+        self,
+        query_vector,
+        top_k: int = 5,
+        document_ids: List[int] = None,
+        ef_search: int = None,
+        nprobe: int = None
+    ) -> List[Tuple[int, float]]:
+        """近似检索，返回 [(chunk_id, score)]；ef_search越大召回越高、延迟越大"""
+        query = normalize(query_vector).reshape(-1)
+        with self._lock:
+            store = self.store
+            count, entry_point, max_level = store.count, self.entry_point, self.max_level
+            view = _GraphView(store.vectors, self._graph0, self._upper, self._upper_links, self.graph_count)
+        if count == 0 or top_k <= 0:
+            return []
+
+        if document_ids:
+            rows = store.candidate_rows(document_ids)
+            if len(rows) <= FILTER_EXACT_LIMIT:
+                hits = store.exact_search(query, top_k, rows)
+                return [(int(store.chunk_ids[r]), s) for r, s in hits]
+
+        hits = []
+        if entry_point is not None:
+            # 按请求覆盖的 ef_search 限制在 [1, max_ef_search]，避免单个请求遍历整张图
+            ef = max(min(max(ef_search or self.ef_search, 1), self.max_ef_search), top_k)
+            if document_ids:
+                # 过滤比例较低时放大候选集
+                ef = max(ef, top_k * 4)
+            entry_point = view.greedy(query, entry_point, max_level, 0)
+            found, scores = view.search_layer(query, np.array([entry_point]), ef, 0)
+
+            keep = store.deleted[found] == 0
+            if document_ids:
+                keep &= np.isin(store.document_ids[found], document_ids)
+            hits = list(zip(found[keep][:top_k].tolist(), scores[keep][:top_k].tolist()))
+
+        # 尚未建图的节点精确扫描
+        if view.limit < count:
+            pending = np.arange(view.limit, count)
+            keep = store.deleted[pending] == 0
+            if document_ids:
+                keep &= np.isin(store.document_ids[pending], document_ids)
+            hits = heapq.nlargest(top_k, hits + store.exact_search(query, top_k, pending[keep]), key=lambda item: item[1])
+
+        return [(int(store.chunk_ids[r]), s) for r, s in hits]
+
+
+class IVFFlatIndex:
+    """IVF-Flat索引
+
+    用k-means训练粗量化器（nlist个质心），每行向量归入最近的质心；
+    检索时只扫描与查询最相似的nprobe个簇。向量数不足训练阈值或训练（build）完成前精确检索
+    """
+
+    # 每个簇至少需要的训练样本数
+    MIN_POINTS_PER_CENTROID = 39
+    MAX_POINTS_PER_CENTROID = 256
+    KMEANS_ITERATIONS = 20
+
+    def __init__(self, path: str, dimension: int, nlist: int = 1024, nprobe: int = 16):
+        self.store = MmapVectorStore(path, dimension)
+        self.path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+
+        centroids_file = os.path.join(path, "centroids.npy")
+        self.centroids: Optional[np.ndarray] = np.load(centroids_file) if os.path.exists(centroids_file) else None
+        self.assigned = _read_json(os.path.join(path, "ivf.json")).get("assigned", 0)
+        self._lists: Optional[List[np.ndarray]] = None
+
+        if self.centroids is not None and self.assigned < self.store.count:
+            self._assign_pending()
+
+    @property
+    def _assign_file(self) -> str:
+        return os.path.join(self.path, "assignments.bin")
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def add(self, chunk_ids: List[int], document_ids: List[int], vectors) -> int:
+        """追加向量（已训练时同时分配簇；训练由 build 完成）"""
+        vectors = normalize(vectors)
+        if len(vectors) == 0:
+            return 0
+        with self._lock:
+            self.store.append(chunk_ids, document_ids, vectors)
+            if self.is_trained:
+                self._assign_pending()
+        return len(vectors)
+
+    def delete_document(self, document_id: int) -> int:
+        with self._lock:
+            return self.store.mark_deleted(document_id)
+
+    def delete_chunks(self, chunk_ids: List[int]) -> int:
+        with self._lock:
+            return self.store.mark_chunks_deleted(chunk_ids)
+
+    def indexed_chunk_ids(self, chunk_ids: List[int]) -> Set[int]:
+        with self._lock:
+            return self.store.live_chunk_ids(chunk_ids)
+
+    def needs_build(self) -> bool:
+        return not self.is_trained and self.store.count >= self.nlist * self.MIN_POINTS_PER_CENTROID
+
+    def build(self) -> Tuple[np.ndarray, int]:
+        """训练粗量化器（球面k-means）并为已有向量分配簇，写入临时文件（不持有检索锁，训练期间精确检索）
+
+        返回 (质心, 已分配的行数)，由 install 切换
+        """
+        with self._lock:
+            count = self.store.count
+            vectors = self.store.vectors
+        sample_size = min(count, self.nlist * self.MAX_POINTS_PER_CENTROID)
+        sample_rows = np.sort(np.random.default_rng(0).choice(count, sample_size, replace=False))
+        sample = np.asarray(vectors[sample_rows])
+
+        centroids = sample[np.random.default_rng(1).choice(len(sample), self.nlist, replace=False)]
+        for _ in range(self.KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=self.nlist)
+            # 空簇保留原质心
+            empty = counts == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize(sums)
+        centroids = centroids.astype(np.float32)
+
+        with open(self._assign_file + ".tmp", "wb") as f:
+            for start in range(0, count, SCAN_BLOCK_ROWS):
+                block = vectors[start:min(start + SCAN_BLOCK_ROWS, count)]
+                f.write(np.argmax(block @ centroids.T, axis=1).astype(np.int32).tobytes())
+        return centroids, count
+
+    def install(self, state: Tuple[np.ndarray, int]):
+        """切换到训练好的粗量化器，并为训练期间追加的向量分配簇"""
+        centroids, assigned = state
+        with self._lock:
+            os.replace(self._assign_file + ".tmp", self._assign_file)
+            tmp = os.path.join(self.path, "centroids.tmp.npy")
+            np.save(tmp, centroids)
+            os.replace(tmp, os.path.join(self.path, "centroids.npy"))
+            self.centroids = centroids
+            self.assigned = assigned
+            self._assign_pending()
+
+    def _assign_pending(self):
+        with open(self._assign_file, "r+b" if os.path.exists(self._assign_file) else "wb") as f:
+            f.truncate(self.assigned * 4)
+            f.seek(self.assigned * 4)
+            for start in range(self.assigned, self.store.count, SCAN_BLOCK_ROWS):
+                block = self.store.vectors[start:start + SCAN_BLOCK_ROWS]
+                labels = np.argmax(block @ self.centroids.T, axis=1).astype(np.int32)
+                f.write(labels.tobytes())
+
+        self.assigned = self.store.count
+        _write_json(os.path.join(self.path, "ivf.json"), {"assigned": self.assigned, "nlist": self.nlist})
+        self._lists = None
+
+    def _inverted_lists(self) -> List[np.ndarray]:
+        """由分配结果构建倒排表（只含行号，不读取向量）"""
+        if self._lists is None:
+            labels = np.fromfile(self._assign_file, dtype=np.int32, count=self.assigned)
+            order = np.argsort(labels, kind="stable")
+            bounds = np.searchsorted(labels[order], np.arange(self.nlist + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(self.nlist)]
+        return self._lists
+
+    def search(
+        self,
+        query_vector,
+        top_k: int = 5,
+        document_ids: List[int] = None,
+        ef_search: int = None,
+        nprobe: int = None
+    ) -> List[Tuple[int, float]]:
+        """近似检索，返回 [(chunk_id, score)]；nprobe越大召回越高、延迟越大"""
+        query = normalize(query_vector).reshape(-1)
+        with self._lock:
+            store = self.store
+            if store.count == 0 or top_k <= 0:
+                return []
+
+            rows = store.candidate_rows(document_ids) if document_ids or not self.is_trained else None
+            if rows is None or (self.is_trained and len(rows) > FILTER_EXACT_LIMIT):
+                probe = min(max(nprobe or self.nprobe, 1), self.nlist)
+                centroid_scores = self.centroids @ query
+                nearest = np.argpartition(-centroid_scores, probe - 1)[:probe]
+                lists = self._inverted_lists()
+                rows = np.sort(np.concatenate([lists[c] for c in nearest]))
+                keep = store.deleted[rows] == 0
+                if document_ids:
+                    keep &= np.isin(store.document_ids[rows], document_ids)
+                rows = rows[keep]
+
+            hits = store.exact_search(query, top_k, rows)
+            return [(int(store.chunk_ids[r]), s) for r, s in hits]
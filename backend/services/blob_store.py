@@ -0,0 +1,112 @@
+"""
+内容寻址的上传文件存储
+文件按SHA-256存放在 {UPLOAD_DIR}/blobs/ab/cd/<sha256>，相同内容（包括不同用户上传的）只存一份，
+解析结果缓存同样按哈希共享；访问控制仍由各用户自己的文档记录负责
+
+- 引用计数：创建文档记录时 +1，删除文档或被新版本替换时 -1（与文档记录在同一事务中更新）
+- 回收：计数降为0后删除文件和解析结果缓存。先把文件改名移走，再按条件删除计数为0的记录；
+  期间有新上传引用该文件（计数已增加）则把文件改回原名，与并发上传之间无需加锁
+"""
+
+import os
+import uuid
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects import postgresql, sqlite
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from models.blob import Blob
+from services.parsers import remove_artifacts
+
+
+class BlobStore:
+    """上传文件存储"""
+
+    def __init__(self, root: str = None):
+        self.root = root or os.path.join(settings.UPLOAD_DIR, "blobs")
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    async def acquire(self, db, sha256: str, size: int, temp_path: str) -> str:
+        """引用文件（调用方提交事务后须调用 finalize），返回文件路径
+
+        temp_path 为已接收的临时文件（须与存储目录在同一文件系统），文件尚不存在时以硬链接放入存储目录，
+        提交前文件即已就位，入库worker随时可以读取
+        """
+        path = self.path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(temp_path, path)
+            except FileExistsError:
+                pass
+
+        now = datetime.utcnow()
+        insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+        await db.execute(
+            insert(Blob)
+            .values(sha256=sha256, size=size, ref_count=1, created_at=now, updated_at=now)
+            .on_conflict_do_update(
+                index_elements=["sha256"],
+                set_={"ref_count": Blob.ref_count + 1, "updated_at": now}
+            )
+        )
+        return path
+
+    def finalize(self, sha256: str, temp_path: str):
+        """（引用已提交后）删除临时文件；文件恰好被并发回收时用临时文件补回"""
+        path = self.path(sha256)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+
+    async def release(self, db, sha256: str) -> bool:
+        """释放一个引用（在调用方事务中），返回是否已无引用（提交后调用 collect 回收）"""
+        result = await db.execute(
+            update(Blob)
+            .where(Blob.sha256 == sha256, Blob.ref_count > 0)
+            .values(ref_count=Blob.ref_count - 1, updated_at=datetime.utcnow())
+        )
+        if not result.rowcount:
+            return False
+        ref_count = (await db.execute(select(Blob.ref_count).where(Blob.sha256 == sha256))).scalar()
+        return ref_count == 0
+
+    async def collect(self, sha256: str) -> bool:
+        """回收无引用的文件，返回是否已删除"""
+        path = self.path(sha256)
+        graveyard = f"{path}.gc-{uuid.uuid4().hex}"
+        try:
+            os.rename(path, graveyard)
+        except FileNotFoundError:
+            graveyard = None
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                delete(Blob).where(Blob.sha256 == sha256, Blob.ref_count <= 0)
+            )
+            await db.commit()
+
+        if not result.rowcount:
+            # 回收期间被重新引用：放回原处（新上传已放入文件时丢弃移走的副本）
+            if graveyard:
+                if os.path.exists(path):
+                    os.remove(graveyard)
+                else:
+                    os.rename(graveyard, path)
+            return False
+
+        if graveyard:
+            os.remove(graveyard)
+        await asyncio.to_thread(remove_artifacts, sha256)
+        print(f"🗑️  已回收无引用的文件: {sha256[:12]}")
+        return True
+
+
+blob_store = BlobStore()
@@ -0,0 +1,349 @@
+"""
+两级缓存
+L1：进程内LRU（条目数/字节数上限 + 单条TTL + 命中统计）
+L2：Redis（ENABLE_REDIS开启时，多worker共享；批量读取 + 紧凑序列化 + pub/sub失效通知）
+按用户代数失效：用户文档变化时递增代数（O(1)），旧代数的键自然过期
+"""
+
+import sys
+import json
+import time
+import zlib
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+from core.config import settings
+
+
+def estimate_size(value: Any) -> int:
+    """粗略估算对象占用的字节数（递归统计容器内容）"""
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """有界LRU缓存
+
+    用户数据变化时只需递增该用户的代数（bump_generation），
+    旧代数的键不再被访问，随LRU/TTL自然淘汰，无需扫描全部键
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024, default_ttl: int = 300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, expire_seconds: Optional[int] = None):
+        ttl = self.default_ttl if expire_seconds is None else expire_seconds
+        expires_at = time.monotonic() + ttl if ttl else None
+        size = estimate_size(key) + estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def _remove(self, key: str):
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def generation(self, user_id: int) -> int:
+        return self._generations.get(user_id, 0)
+
+    def has_generation(self, user_id: int) -> bool:
+        return user_id in self._generations
+
+    def set_generation(self, user_id: int, generation: int):
+        """同步其他worker递增的代数（只前进不后退）"""
+        with self._lock:
+            self._generations[user_id] = max(self._generations.get(user_id, 0), generation)
+
+    def forget_generations(self):
+        """丢弃本地代数，下次使用时重新从Redis读取"""
+        with self._lock:
+            self._generations.clear()
+
+    def bump_generation(self, user_id: int) -> int:
+        """使该用户的所有缓存失效"""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            return self._generations[user_id]
+
+    def user_key(self, user_id: int, *parts: Any) -> str:
+        """带用户代数的缓存键"""
+        return ":".join([f"u{user_id}", f"g{self.generation(user_id)}", *map(str, parts)])
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# 超过该长度的序列化结果做zlib压缩
+COMPRESS_MIN_BYTES = 1024
+
+
+def serialize(value: Any) -> bytes:
+    """紧凑序列化：1字节格式标记 + JSON（较大时zlib压缩）"""
+    data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return b"z" + zlib.compress(data)
+    return b"j" + data
+
+
+def deserialize(raw: bytes) -> Any:
+    flag, body = raw[:1], raw[1:]
+    if flag == b"z":
+        body = zlib.decompress(body)
+    return json.loads(body)
+
+
+class TieredCache:
+    """两级缓存：L1进程内LRU + L2 Redis
+
+    - 读：先查L1，未命中再查L2（get_many 一次MGET批量读取），L2命中回填L1
+    - 写：同时写L1和L2（set_many 使用pipeline一次往返）
+    - 失效：代数保存在Redis中，递增后通过pub/sub通知其他worker更新本地代数
+    - 启用Redis但启动时无法导入或连接，直接报错（不静默退化，否则多进程部署的缓存不会失效）；
+      运行期间Redis操作失败时退化为仅L1，不影响请求
+
+    redis_client 可注入任意兼容 redis.asyncio 接口的客户端（如测试用的内存实现）
+    """
+
+    def __init__(self, l1: LRUCache, redis_client=None, prefix: str = "rag:"):
+        self.l1 = l1
+        self.redis = redis_client
+        self.prefix = prefix
+        self._listener: Optional[asyncio.Task] = None
+
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.l2_errors = 0
+
+    @property
+    def channel(self) -> str:
+        return f"{self.prefix}invalidate"
+
+    def _generation_key(self, user_id: int) -> str:
+        return f"{self.prefix}gen:{user_id}"
+
+    async def start(self):
+        """连接Redis并订阅失效通知（应用启动时调用）"""
+        if self.redis is None and settings.ENABLE_REDIS:
+            try:
+                import redis.asyncio as aioredis
+            except ImportError:
+                raise RuntimeError("ENABLE_REDIS=true 但未安装redis，请执行 pip install -r requirements.txt") from None
+
+            client = aioredis.from_url(settings.REDIS_URL)
+            try:
+                await client.ping()
+            except Exception as e:
+                await client.close()
+                raise RuntimeError(f"ENABLE_REDIS=true 但无法连接Redis（{settings.REDIS_URL}）: {e}") from e
+            self.redis = client
+
+        if self.redis is not None and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+            print("✅ Redis二级缓存已启用")
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+
+    async def _listen(self):
+        """订阅代数变更；断线重连后丢弃本地代数，避免错过通知导致读到旧数据"""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                self.l1.forget_generations()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = message["data"]
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    user_id, generation = data.split(":")
+                    self.l1.set_generation(int(user_id), int(generation))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._l2_failed(e)
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    def _l2_failed(self, error: Exception):
+        self.l2_errors += 1
+        print(f"⚠️  Redis缓存操作失败: {error}")
+
+    async def user_key(self, user_id: int, *parts: Any) -> str:
+        """带用户代数的缓存键（本地没有该用户代数时从Redis读取）"""
+        if self.redis is not None and not self.l1.has_generation(user_id):
+            try:
+                generation = int(await self.redis.get(self._generation_key(user_id)) or 0)
+            except Exception as e:
+                self._l2_failed(e)
+            else:
+                self.l1.set_generation(user_id, generation)
+        return self.l1.user_key(user_id, *parts)
+
+    async def bump_generation(self, user_id: int) -> int:
+        """使该用户的所有缓存失效（所有worker）"""
+        if self.redis is None:
+            return self.l1.bump_generation(user_id)
+
+        try:
+            generation = await self.redis.incr(self._generation_key(user_id))
+            await self.redis.publish(self.channel, f"{user_id}:{generation}")
+        except Exception as e:
+            self._l2_failed(e)
+            return self.l1.bump_generation(user_id)
+
+        self.l1.set_generation(user_id, generation)
+        return generation
+
+    async def get(self, key: str) -> Optional[Any]:
+        return (await self.get_many([key])).get(key)
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """批量读取，返回命中的 {key: value}"""
+        found, missing = {}, []
+        for key in keys:
+            value = self.l1.get(key)
+            if value is not None:
+                found[key] = value
+            else:
+                missing.append(key)
+
+        if not missing or self.redis is None:
+            return found
+
+        try:
+            raws = await self.redis.mget([self.prefix + key for key in missing])
+        except Exception as e:
+            self._l2_failed(e)
+            return found
+
+        for key, raw in zip(missing, raws):
+            if raw is None:
+                self.l2_misses += 1
+                continue
+            self.l2_hits += 1
+            value = deserialize(raw)
+            self.l1.set(key, value)
+            found[key] = value
+        return found
+
+    async def set(self, key: str, value: Any, expire_seconds: Optional[int] = None):
+        await self.set_many({key: value}, expire_seconds)
+
+    async def set_many(self, items: Dict[str, Any], expire_seconds: Optional[int] = None):
+        for key, value in items.items():
+            self.l1.set(key, value, expire_seconds)
+
+        if not items or self.redis is None:
+            return
+
+        ttl = self.l1.default_ttl if expire_seconds is None else expire_seconds
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.set(self.prefix + key, serialize(value), ex=ttl or None)
+                await pipe.execute()
+        except Exception as e:
+            self._l2_failed(e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.l1.stats(),
+            "l2": {
+                "enabled": self.redis is not None,
+                "hits": self.l2_hits,
+                "misses": self.l2_misses,
+                "errors": self.l2_errors,
+            }
+        }
+
+
+# 进程级共享缓存实例
+search_cache = TieredCache(
+    LRUCache(
+        max_entries=settings.CACHE_MAX_ENTRIES,
+        max_bytes=settings.CACHE_MAX_BYTES,
+        default_ttl=settings.CACHE_TTL_SECONDS
+    )
+)
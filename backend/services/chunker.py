@@ -0,0 +1,155 @@
+"""
+流式文本分块
+逐个消费解析出的文本块（页、段落、表格行），一次线性扫描按中英文句子边界切分，
+按 CHUNK_SIZE 装填并保留 CHUNK_OVERLAP 重叠，惰性产出文档块；内存占用只与块大小有关。
+块边界由内容决定，文档修改后未变化部分的块保持不变（增量索引据此复用）
+"""
+
+import re
+import zlib
+import hashlib
+from collections import deque
+from typing import Deque, Iterable, Iterator, NamedTuple, Optional, Tuple, Union
+
+# 句末：中文标点（可带后引号/括号）、英文标点（其后须为空白）、空行（段落边界）
+_SENTENCE_END = re.compile(r"[。！？；…]+[”’」』）)]*|[.!?;]+[\"'”’)\]]*(?=\s)|\n\s*\n")
+
+# 文本块：纯文本，或 (文本, 页码)
+Block = Union[str, Tuple[str, Optional[int]]]
+
+
+class Chunk(NamedTuple):
+    """文档块（分页文档记录起止页码，从1开始）"""
+    content: str
+    page_start: Optional[int]
+    page_end: Optional[int]
+
+
+def chunk_hash(content: str) -> str:
+    """文档块内容哈希（增量重建索引时判断块是否变化）"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def split_sentences(text: str) -> Iterator[str]:
+    """按句子边界切分，各句首尾相接即为原文"""
+    pos = 0
+    for match in _SENTENCE_END.finditer(text):
+        yield text[pos:match.end()]
+        pos = match.end()
+    if pos < len(text):
+        yield text[pos:]
+
+
+class TextChunker:
+    """按句子装填的流式分块器"""
+
+    def __init__(self, chunk_size: int, chunk_overlap: int = 0, min_chunk_size: int = 50):
+        self.chunk_size = chunk_size
+        # 重叠不超过块大小的一半，保证每块至少有一半新内容
+        self.chunk_overlap = max(min(chunk_overlap, chunk_size // 2), 0)
+        self.min_chunk_size = min_chunk_size
+
+    def chunk(self, blocks: Iterable[Block]) -> Iterator[Chunk]:
+        """惰性产出文档块；末尾过短的内容并入上一块
+
+        新内容达到块大小的一半后，在段落/行末尾或内容哈希命中的句子后切分（内容定义的切分点），
+        文档局部修改后其后的块边界很快与修改前重新对齐，未变化的块可在增量索引时复用
+        """
+        units: Deque[Tuple[str, Optional[int]]] = deque()
+        size = 0
+        carried = 0  # 当前块开头来自上一块的重叠句子数
+        carried_size = 0
+        fresh = False  # 当前块是否已有新内容
+        pending: Optional[Chunk] = None
+
+        for text, page in self._units(blocks):
+            if not text.strip():
+                # 空白只保留在块内部，不单独成块
+                if units:
+                    units.append((text, page))
+                    size += len(text)
+                continue
+
+            if fresh and size + len(text) > self.chunk_size:
+                if pending:
+                    yield pending
+                pending = self._make(units)
+                units, size = self._overlap(units)
+                fresh = False
+
+            if not fresh:
+                while units and size + len(text) > self.chunk_size:
+                    size -= len(units.popleft()[0])
+                carried = len(units)
+                carried_size = size
+
+            units.append((text, page))
+            size += len(text)
+            fresh = True
+
+            if size - carried_size >= self.chunk_size // 2 and self._is_cut_point(text):
+                if pending:
+                    yield pending
+                pending = self._make(units)
+                units, size = self._overlap(units)
+                fresh = False
+
+        if not fresh:
+            if pending:
+                yield pending
+            return
+
+        tail = list(units)[carried:]
+        tail_text = "".join(text for text, _ in tail).strip()
+        if pending and len(tail_text) < self.min_chunk_size:
+            yield Chunk(pending.content + "\n" + tail_text, pending.page_start, self._make(tail).page_end)
+            return
+        if pending:
+            yield pending
+        yield self._make(units)
+
+    def _units(self, blocks: Iterable[Block]) -> Iterator[Tuple[str, Optional[int]]]:
+        """把文本块切成不超过块大小的句子；超长句子按长度硬切"""
+        piece = max(self.chunk_size - self.chunk_overlap, 1)
+        for block in blocks:
+            text, page = (block, None) if isinstance(block, str) else block
+            if not text:
+                continue
+            if not text.endswith("\n"):
+                text += "\n"  # 文本块之间换行分隔
+            for sentence in split_sentences(text):
+                if len(sentence) <= self.chunk_size:
+                    yield sentence, page
+                else:
+                    for start in range(0, len(sentence), piece):
+                        yield sentence[start:start + piece], page
+
+    @staticmethod
+    def _is_cut_point(text: str) -> bool:
+        """段落/行的末尾，或内容哈希命中的句子（约一半），与句子在文档中的位置无关"""
+        return text.endswith("\n") or zlib.crc32(text.strip().encode("utf-8")) & 1 == 0
+
+    def _overlap(self, units: Deque[Tuple[str, Optional[int]]]) -> Tuple[Deque[Tuple[str, Optional[int]]], int]:
+        """上一块末尾不超过 chunk_overlap 字符的完整句子；末句过长时取其末尾字符"""
+        kept: Deque[Tuple[str, Optional[int]]] = deque()
+        size = 0
+        if not self.chunk_overlap:
+            return kept, size
+
+        for text, page in reversed(units):
+            if size + len(text) > self.chunk_overlap:
+                break
+            kept.appendleft((text, page))
+            size += len(text)
+
+        if not any(text.strip() for text, _ in kept):
+            text, page = next((text, page) for text, page in reversed(units) if text.strip())
+            tail = text.rstrip()[-self.chunk_overlap:]
+            kept = deque([(tail, page)])
+            size = len(tail)
+        return kept, size
+
+    @staticmethod
+    def _make(units: Deque[Tuple[str, Optional[int]]]) -> Chunk:
+        pages = [page for text, page in units if text.strip()]
+        return Chunk("".join(text for text, _ in units).strip(), pages[0], pages[-1])
@@ -0,0 +1,127 @@
+"""
+上下文构建
+按token预算装填检索来源与对话历史：去除重复/重叠文档块，来源按得分装填，历史从最新一轮向前装填
+"""
+
+from typing import List, Dict, Any, Tuple
+
+from core.config import settings
+from services.tokenizer import tokenize, estimate_tokens
+
+# 剩余预算低于该值时不再截断装填下一个来源
+MIN_PARTIAL_TOKENS = 64
+# 相邻文档块首尾重叠的最短长度（字符），更短的公共部分视为巧合
+MIN_OVERLAP_CHARS = 16
+
+
+def source_label(result: Dict[str, Any]) -> str:
+    """来源标注：文件名，分页文档附带页码"""
+    label = result.get("file_name", "未知")
+    start, end = result.get("page_start"), result.get("page_end")
+    if start:
+        label += f"（第{start}页）" if not end or end == start else f"（第{start}-{end}页）"
+    return label
+
+
+def _strip_overlap(previous: str, current: str) -> str:
+    """去掉 current 开头与 previous 结尾重叠的部分（分块重叠产生的重复文本）"""
+    limit = min(len(previous), len(current) // 2)
+    for size in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(current[:size]):
+            return current[size:].lstrip()
+    return current
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    """按估算token数截断文本"""
+    if estimate_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        # 预留省略号的1个token
+        if estimate_tokens(text[:mid]) <= budget - 1:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low].rstrip() + "……"
+
+
+class ContextBuilder:
+    """按token预算构建提示词上下文"""
+
+    def __init__(
+        self,
+        context_budget: int = None,
+        history_budget: int = None,
+        dedup_threshold: float = None
+    ):
+        self.context_budget = settings.CONTEXT_TOKEN_BUDGET if context_budget is None else context_budget
+        self.history_budget = settings.HISTORY_TOKEN_BUDGET if history_budget is None else history_budget
+        self.dedup_threshold = settings.CONTEXT_DEDUP_THRESHOLD if dedup_threshold is None else dedup_threshold
+
+    def pack_sources(self, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """按得分从高到低装填来源，返回 (入选来源, 占用token数)
+
+        - 与已入选来源词集合高度相似（Jaccard ≥ 阈值）或被其包含的文档块直接跳过
+        - 同一文档相邻块只保留不重叠的部分
+        - 预算不足时截断最后一个来源
+        """
+        selected: List[Dict[str, Any]] = []
+        token_sets: List[set] = []
+        by_position: Dict[Tuple[Any, Any], str] = {}
+        used = 0
+
+        for result in sorted(results, key=lambda r: r.get("score", 0.0), reverse=True):
+            content = result.get("content", "")
+            document_id, chunk_index = result.get("document_id"), result.get("chunk_index")
+            if chunk_index is not None:
+                previous = by_position.get((document_id, chunk_index - 1))
+                if previous:
+                    content = _strip_overlap(previous, content)
+
+            tokens = set(tokenize(content))
+            if not tokens or any(self._is_duplicate(tokens, other) for other in token_sets):
+                continue
+
+            header = f"[来源{len(selected) + 1}] {source_label(result)}\n"
+            cost = estimate_tokens(header) + estimate_tokens(content)
+            remaining = self.context_budget - used
+            if cost > remaining:
+                if remaining - estimate_tokens(header) < MIN_PARTIAL_TOKENS:
+                    break
+                content = _truncate_to_tokens(content, remaining - estimate_tokens(header))
+                cost = estimate_tokens(header) + estimate_tokens(content)
+
+            selected.append({**result, "content": content})
+            token_sets.append(tokens)
+            if chunk_index is not None:
+                by_position[(document_id, chunk_index)] = result.get("content", "")
+            used += cost
+            if used >= self.context_budget:
+                break
+
+        return selected, used
+
+    def _is_duplicate(self, tokens: set, other: set) -> bool:
+        common = len(tokens & other)
+        if common == 0:
+            return False
+        # 相似（Jaccard）或一方基本被另一方包含
+        jaccard = common / len(tokens | other)
+        containment = common / min(len(tokens), len(other))
+        return jaccard >= self.dedup_threshold or containment >= 0.95
+
+    def pack_history(self, history: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], int]:
+        """从最新一条消息向前装填历史，超出预算即停止（保持对话连续），返回 (消息, 占用token数)"""
+        packed: List[Dict[str, str]] = []
+        used = 0
+        for msg in reversed(history):
+            cost = estimate_tokens(msg.get("content", "")) + 4  # 角色等格式开销
+            if used + cost > self.history_budget:
+                break
+            packed.append(msg)
+            used += cost
+
+        packed.reverse()
+        return packed, used
@@ -0,0 +1,111 @@
+"""
+对话历史滚动摘要
+摘要之后的消息过多时，在后台把较早的消息与已有摘要合并写入 Conversation.context_summary，
+提示词只包含摘要 + 最近的消息原文，长度与对话轮数无关
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Set
+
+from sqlalchemy import select, update, func
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from models.conversation import Conversation, Message
+from services.rag_service import BaiduChat
+
+# 单条消息进入摘要提示词的最大字符数
+MESSAGE_EXCERPT_CHARS = 500
+
+_running: Set[int] = set()
+_tasks: Set[asyncio.Task] = set()
+
+
+def schedule_summary(conversation_id: int):
+    """后台压缩对话历史（同一对话同时只运行一个任务）"""
+    if conversation_id in _running:
+        return
+    _running.add(conversation_id)
+    task = asyncio.create_task(_run(conversation_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _run(conversation_id: int):
+    try:
+        await summarize_conversation(conversation_id)
+    except Exception as e:
+        print(f"⚠️  对话摘要生成失败（对话 {conversation_id}）: {e}")
+    finally:
+        _running.discard(conversation_id)
+
+
+async def summarize_conversation(conversation_id: int, llm: BaiduChat = None) -> bool:
+    """把摘要之后、最近 SUMMARY_KEEP_MESSAGES 条之前的消息合并进摘要"""
+    async with AsyncSessionLocal() as db:
+        conversation = await db.get(Conversation, conversation_id)
+        if not conversation:
+            return False
+
+        since = conversation.summary_message_id or 0
+        pending = await db.scalar(
+            select(func.count(Message.id)).where(
+                Message.conversation_id == conversation_id,
+                Message.id > since
+            )
+        )
+        fold_count = min(pending - settings.SUMMARY_KEEP_MESSAGES, settings.SUMMARY_BATCH_MESSAGES)
+        if fold_count <= 0:
+            return False
+
+        result = await db.execute(
+            select(Message).where(
+                Message.conversation_id == conversation_id,
+                Message.id > since
+            ).order_by(Message.id).limit(fold_count)
+        )
+        messages = result.scalars().all()
+
+        summary = await _generate_summary(llm or BaiduChat(), conversation.context_summary, messages)
+
+        # 乐观并发：摘要位置未被其他worker更新时才写入
+        position = Conversation.summary_message_id
+        result = await db.execute(
+            update(Conversation)
+            .where(
+                Conversation.id == conversation_id,
+                position == since if since else position.is_(None)
+            )
+            .values(
+                context_summary=summary[:settings.SUMMARY_MAX_CHARS],
+                summary_message_id=messages[-1].id,
+                updated_at=datetime.utcnow()
+            )
+        )
+        await db.commit()
+
+        if result.rowcount:
+            print(f"📝 对话 {conversation_id} 已压缩 {len(messages)} 条消息到摘要")
+        return bool(result.rowcount)
+
+
+async def _generate_summary(llm: BaiduChat, previous: str, messages) -> str:
+    """合并已有摘要与新增消息"""
+    roles = {"user": "用户", "assistant": "助手"}
+    dialogue = "\n".join(
+        f"{roles.get(msg.message_type, msg.message_type)}：{msg.content[:MESSAGE_EXCERPT_CHARS]}"
+        for msg in messages
+    )
+
+    prompt = f"""请把已有摘要与新增对话合并为一段新的对话摘要。
+要求：保留用户的关键问题、已得出的结论、用户偏好和待办事项，省略寒暄；不超过{settings.SUMMARY_MAX_CHARS}字；只输出摘要内容。
+
+**已有摘要：**
+{previous or "（无）"}
+
+**新增对话：**
+{dialogue}"""
+
+    summary = await llm.chat([{"role": "user", "content": prompt}], temperature=0.3)
+    return summary.strip()
@@ -0,0 +1,111 @@
+"""
+文档解析进程池
+PyMuPDF / openpyxl 等解析是CPU密集的同步调用，放到独立进程池中执行，不阻塞事件循环
+（各格式的解析器见 services/parsers.py）
+
+- 单个文件解析超时或被取消时，终止正在执行的子进程（回收整个进程池，其他在途任务自动重新提交）
+- 子进程处理 max_tasks_per_child 个任务后自动替换，控制解析库的内存泄漏
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+from core.config import settings
+
+
+class ParseError(Exception):
+    """文档解析失败"""
+
+
+class ParseTimeoutError(ParseError):
+    """文档解析超时"""
+
+
+class ParserPool:
+    """解析进程池（懒创建，spawn方式启动子进程）"""
+
+    def __init__(self, max_workers: int, max_tasks_per_child: int, timeout: float):
+        self.max_workers = max_workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._generation = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.recycles = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=self.max_tasks_per_child or None
+            )
+        return self._executor
+
+    async def run(self, func: Callable, *args, timeout: float = None):
+        """在子进程中执行解析函数，超时抛出 ParseTimeoutError"""
+        timeout = self.timeout if timeout is None else timeout
+
+        # 进程池被回收（其他任务超时）时，已提交的任务重新提交一次
+        for attempt in range(2):
+            generation = self._generation
+            future = None
+            try:
+                future = self._get_executor().submit(func, *args)
+                result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+                self.completed += 1
+                return result
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self._abort(future, generation)
+                raise ParseTimeoutError(f"文档解析超时（{timeout:g}s）") from None
+            except asyncio.CancelledError:
+                self._abort(future, generation)
+                raise
+            except BrokenProcessPool:
+                if generation == self._generation:
+                    # 子进程异常退出（如解析库崩溃、内存不足）
+                    self._recycle(generation)
+                if attempt:
+                    raise ParseError("解析进程异常退出") from None
+
+    def _abort(self, future, generation: int):
+        """放弃任务：尚未开始的直接取消，正在执行的终止子进程"""
+        if future is not None and not future.cancel():
+            self._recycle(generation)
+
+    def _recycle(self, generation: int):
+        """终止并替换进程池（ProcessPoolExecutor无法单独终止某个任务）"""
+        if generation != self._generation or self._executor is None:
+            return
+        executor, self._executor = self._executor, None
+        self._generation += 1
+        self.recycles += 1
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        print("♻️  解析进程池已回收（超时/取消/子进程异常）")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "recycles": self.recycles
+        }
+
+
+parser_pool = ParserPool(
+    max_workers=settings.PARSER_WORKERS,
+    max_tasks_per_child=settings.PARSER_MAX_TASKS_PER_CHILD,
+    timeout=settings.PARSER_TIMEOUT
+)
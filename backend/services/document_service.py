@@ -1,21 +1,33 @@
 """
 文档处理服务
-支持：PDF/DOCX/TXT/MD/XLSX解析 + 自动分块 + 向量索引
+支持：PDF/DOCX/TXT/MD/XLSX解析（见解析器注册表 services/parsers.py） + 自动分块 + 向量索引
 """
 
 import os
+import asyncio
 import hashlib
-import fitz  # PyMuPDF
-from docx import Document
-from openpyxl import load_workbook
-from typing import List, Dict, Any, Optional
+from itertools import islice
+from collections import defaultdict, deque
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, Deque
 from datetime import datetime
 import aiofiles
 import aiofiles.os as aios
 
 from models.document import Document
-from sqlalchemy import select
+from models.job import IngestionJob
+from sqlalchemy import select, delete, func, and_, or_
 from services.rag_service import RAGService
+from services.ingestion_queue import enqueue, PermanentIngestionError
+from services.chunker import TextChunker, Block, chunk_hash
+from services.document_parser import ParseError, ParseTimeoutError
+from services.parsers import resolve_format, parse_document, remove_artifacts
+from services.blob_store import blob_store
+
+
+# 每批索引的文档块数
+INDEX_BATCH_CHUNKS = 256
+# 文档摘要取自开头的字符数
+SUMMARY_PREVIEW_CHARS = 200
 
 
 class DocumentService:
@@ -27,6 +39,7 @@ class DocumentService:
         self.upload_dir = settings.UPLOAD_DIR
         self.chunk_size = settings.CHUNK_SIZE
         self.chunk_overlap = settings.CHUNK_OVERLAP
+        self.chunker = TextChunker(self.chunk_size, self.chunk_overlap)
 
     async def upload_document(
         self,
@@ -34,26 +47,62 @@ class DocumentService:
         file_path: str,
         filename: str,
         file_size: int,
-        mime_type: str
-    ) -> Document:
-        """上传文档"""
-        # 计算文件哈希
-        file_hash = await self._calculate_file_hash(file_path)
+        mime_type: str,
+        file_hash: str = None,
+        doc_key: str = None
+    ) -> Tuple[Document, Optional[IngestionJob]]:
+        """上传文档：创建文档记录（或已有文档的新版本）并入队，立即返回 (文档, 入库任务)
+
+        file_path 为已接收的临时文件，新文档/新版本的文件按内容哈希存放（跨用户共享），重复文档则删除该文件；
+        file_hash 为接收时计算的SHA256，未提供时读取文件计算；
+        doc_key 为文档逻辑标识（默认文件名），与已有文档相同时作为其新版本增量重建索引
+        """
+        if file_hash is None:
+            file_hash = await self._calculate_file_hash(file_path)
+        doc_key = doc_key or filename
 
         # 检查是否已存在
-        query = select(Document).where(
-            Document.user_id == user_id,
-            Document.file_hash == file_hash
-        )
-        result = await self.db.execute(query)
-        existing = result.scalar_one_or_none()
-
+        existing = await self.find_by_hash(user_id, file_hash)
         if existing:
-            return existing
+            await aios.remove(file_path)
+            return existing, await self.get_latest_job(existing.id)
+
+        # 按内容哈希存放（其他用户上传过相同文件时共享同一份文件和解析结果）
+        temp_path = file_path
+        file_path = await blob_store.acquire(self.db, file_hash, file_size, temp_path)
+        file_type = os.path.splitext(filename)[1][1:] or "txt"
+
+        # 同一逻辑文档的新版本：沿用文档记录，入库时只索引变化的块
+        current = await self._get_by_key(user_id, doc_key)
+        if current:
+            old_path, old_hash = current.file_path, current.file_hash
+            old_unused = await self._release_file(old_path, old_hash)
+            current.doc_key = doc_key
+            current.version = (current.version or 1) + 1
+            current.filename = filename
+            current.file_type = file_type
+            current.file_path = file_path
+            current.file_size = file_size
+            current.file_hash = file_hash
+            current.mime_type = mime_type
+            current.status = "processing"
+            current.error_message = None
+            current.updated_at = datetime.utcnow()
+
+            # 尚未开始处理的任务会读取新版本文件，无需再入队
+            job = await self.get_latest_job(current.id)
+            if job is None or job.status != "queued":
+                job = await enqueue(self.db, current)
+            await self.db.commit()
+            await self.db.refresh(current)
+            blob_store.finalize(file_hash, temp_path)
+
+            await self._discard_file(old_path, old_hash, old_unused)
+            print(f"🆕 文档新版本: {filename} v{current.version}")
+            return current, job
 
         # 创建文档记录
         # 从filename中提取文件名（不带扩展名）作为title
-        file_type = os.path.splitext(filename)[1][1:] or "txt"
         title = os.path.splitext(filename)[0] if os.path.splitext(filename)[0] else filename
 
         document = Document(
@@ -65,202 +114,188 @@ class DocumentService:
             file_path=file_path,
             mime_type=mime_type,
             file_hash=file_hash,
+            doc_key=doc_key,
             status="processing"
         )
 
         self.db.add(document)
+        await self.db.flush()
+
+        # 创建入库任务，由worker异步解析+索引
+        job = await enqueue(self.db, document)
         await self.db.commit()
         await self.db.refresh(document)
+        blob_store.finalize(file_hash, temp_path)
 
-        # 异步处理文档（解析+索引）
-        # 这里简化为同步处理
-        await self._process_document(document)
-
-        return document
+        return document, job
 
-    async def _process_document(self, document: Document):
-        """处理文档（解析+索引）"""
-        try:
-            # 1. 解析文档内容
-            text = await self._parse_document(document.file_path, document.mime_type)
-
-            if not text:
-                document.status = "error"
-                document.error_message = "文档内容为空"
-                await self.db.commit()
-                return
-
-            # 2. 更新文档信息
-            document.total_chars = len(text)
-            document.processed_at = datetime.utcnow()
-
-            # 3. 文本分块
-            chunks = self._chunk_text(text)
-
-            # 4. 索引到向量库
-            chunk_count = await self.rag_service.index_document(
-                document_id=document.id,
-                user_id=document.user_id,
-                file_name=document.filename,
-                chunks=chunks
+    async def find_by_hash(self, user_id: int, file_hash: str) -> Optional[Document]:
+        """查找用户内容相同的文档（上传前探测与上传去重）"""
+        result = await self.db.execute(
+            select(Document).where(
+                Document.user_id == user_id,
+                Document.file_hash == file_hash
             )
-
-            # 5. 更新状态
-            document.status = "indexed"
-            document.chunk_count = chunk_count
-
-            # 保存摘要
-            document.summary = self._generate_summary(text)
-
-            await self.db.commit()
-
-            print(f"✅ 文档处理成功: {document.filename} ({chunk_count} chunks)")
-
-        except Exception as e:
-            document.status = "error"
-            document.error_message = str(e)
-            await self.db.commit()
-            print(f"❌ 文档处理失败: {document.filename} - {e}")
-
-    async def _parse_document(self, file_path: str, mime_type: str) -> str:
-        """解析文档内容"""
-        ext = os.path.splitext(file_path)[1].lower()
-
-        if ext == ".pdf":
-            return await self._parse_pdf(file_path)
-        elif ext == ".docx":
-            return await self._parse_docx(file_path)
-        elif ext in [".txt", ".md"]:
-            return await self._parse_text_file(file_path)
-        elif ext in [".xlsx", ".xls"]:
-            return await self._parse_excel(file_path)
-        else:
-            return ""
-
-    async def _parse_pdf(self, file_path: str) -> str:
-        """解析PDF文档"""
-        text = ""
+        )
+        return result.scalars().first()
+
+    async def _get_by_key(self, user_id: int, doc_key: str) -> Optional[Document]:
+        """按逻辑标识查找文档（早期文档没有记录标识，按文件名匹配）"""
+        result = await self.db.execute(
+            select(Document)
+            .where(
+                Document.user_id == user_id,
+                or_(
+                    Document.doc_key == doc_key,
+                    and_(Document.doc_key.is_(None), Document.filename == doc_key)
+                )
+            )
+            .order_by(Document.id.desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    async def get_latest_job(self, document_id: int) -> Optional[IngestionJob]:
+        """获取文档最近一次的入库任务"""
+        result = await self.db.execute(
+            select(IngestionJob)
+            .where(IngestionJob.document_id == document_id)
+            .order_by(IngestionJob.id.desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    async def process_document(self, document: Document):
+        """处理文档（解析+索引），失败时抛出异常，由入库队列重试
+
+        增量索引：按内容哈希与文档现有的块比对，未变化的块沿用原有的倒排记录和向量（只更新序号/页码），
+        只为新增的块分词和计算向量，新版本中已不存在的块最后统一删除（向量索引标记墓碑）；
+        中途失败重试时比对结果自动收敛（没有向量的块视为新块），重建索引期间旧版本的块仍可检索。
+        文本块流式分块，每 INDEX_BATCH_CHUNKS 个文档块处理一次，内存占用与文档大小无关
+        """
+        # 1. 解析文档内容（PDF按页，Word按段落/表格行，Excel按行，文本文件逐行读取）
+        blocks = await self._parse_document(document)
+
+        total_chars = 0
+        preview = ""
+
+        def track(blocks: Iterable[Block]) -> Iterator[Block]:
+            nonlocal total_chars, preview
+            for block in blocks:
+                text = block if isinstance(block, str) else block[0]
+                total_chars += len(text)
+                if len(preview) <= SUMMARY_PREVIEW_CHARS:
+                    preview += text[:SUMMARY_PREVIEW_CHARS + 1 - len(preview)]
+                yield block
+
+        # 2. 现有的块按内容哈希分组（同一内容出现多次时依次复用）；
+        #    文档块已提交但向量未写入（上次在写入向量索引时失败）的块不能复用，先删除后作为新块重新索引
+        existing = await self.rag_service.get_document_chunks(document.id, document.user_id)
+        indexed = await self.rag_service.indexed_chunk_ids(document.user_id, [row.id for row in existing])
+        reusable: Dict[str, Deque] = defaultdict(deque)
+        for row in existing:
+            if row.id in indexed:
+                reusable[row.content_hash].append(row)
+        incomplete = [row.id for row in existing if row.id not in indexed]
+        if incomplete:
+            await self.rag_service.delete_chunks(document.user_id, incomplete)
+            print(f"🩹 {len(incomplete)} 个文档块缺少向量（上次索引中断），重新索引")
+
+        # 3. 流式分块并分批比对、索引（分页文档记录每块的起止页码）
+        chunks = self.chunker.chunk(track(blocks))
+        chunk_count = added = reused = 0
         try:
-            doc = fitz.open(file_path)
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-        except Exception as e:
-            print(f"PDF解析失败: {e}")
+            while True:
+                # 读取文件/分块在线程中执行，不阻塞事件循环
+                batch = await asyncio.to_thread(list, islice(chunks, INDEX_BATCH_CHUNKS))
+                if not batch:
+                    break
 
-        return text
+                new_chunks, new_indexes, new_hashes, moved = [], [], [], []
+                for index, chunk in enumerate(batch, chunk_count):
+                    digest = chunk_hash(chunk.content)
+                    candidates = reusable.get(digest)
+                    if not candidates:
+                        new_chunks.append(chunk)
+                        new_indexes.append(index)
+                        new_hashes.append(digest)
+                        continue
 
-    async def _parse_docx(self, file_path: str) -> str:
-        """解析Word文档"""
-        text = ""
-        try:
-            doc = Document(file_path)
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-        except Exception as e:
-            print(f"DOCX解析失败: {e}")
+                    row = candidates.popleft()
+                    position = (index, chunk.page_start, chunk.page_end, document.filename)
+                    if (row.chunk_index, row.page_start, row.page_end, row.file_name) != position:
+                        moved.append({
+                            "id": row.id,
+                            "chunk_index": index,
+                            "page_start": chunk.page_start,
+                            "page_end": chunk.page_end,
+                            "file_name": document.filename
+                        })
+                chunk_count += len(batch)
+                reused += len(batch) - len(new_chunks)
+
+                if moved:
+                    await self.rag_service.update_chunks(document.user_id, moved)
+                if new_chunks:
+                    added += await self.rag_service.index_document(
+                        document_id=document.id,
+                        user_id=document.user_id,
+                        file_name=document.filename,
+                        chunks=[chunk.content for chunk in new_chunks],
+                        pages=[(chunk.page_start, chunk.page_end) for chunk in new_chunks],
+                        chunk_indexes=new_indexes,
+                        content_hashes=new_hashes
+                    )
+        finally:
+            chunks.close()
+            blocks.close()
+
+        # 4. 删除新版本中已不存在的块
+        stale = [row.id for rows in reusable.values() for row in rows]
+        removed = await self.rag_service.delete_chunks(document.user_id, stale)
+        if reused or removed:
+            print(f"♻️  增量索引: 复用 {reused} 块，新增 {added} 块，删除 {removed} 块")
+
+        if chunk_count == 0:
+            raise PermanentIngestionError("文档内容为空")
+
+        # 3. 更新状态
+        document.total_chars = total_chars
+        document.processed_at = datetime.utcnow()
+        document.status = "indexed"
+        document.chunk_count = chunk_count
+        document.error_message = None
+
+        # 保存摘要
+        if not document.description:
+            document.description = self._generate_summary(preview)
 
-        return text
+        await self.db.commit()
 
-    async def _parse_text_file(self, file_path: str) -> str:
-        """解析文本文件（支持中文）"""
-        text = ""
-        try:
-            async with aiofiles.open(file_path, "r", encoding="utf-8") as f:
-                text = await f.read()
+        print(f"✅ 文档处理成功: {document.filename} ({chunk_count} chunks)")
 
-            # 如果编码错误，尝试gbk
-            if not text:
-                async with aiofiles.open(file_path, "r", encoding="gbk") as f:
-                    text = await f.read()
-        except Exception as e:
-            print(f"文本文件解析失败: {e}")
+    async def _parse_document(self, document: Document) -> Iterable[Block]:
+        """按上传时识别的格式解析文档，返回惰性产出的文本块
 
-        return text
+        PDF/Word/Excel在解析进程池中执行，结果按文件哈希缓存，重建索引时直接读取缓存
+        """
+        fmt = await asyncio.to_thread(
+            resolve_format, document.mime_type, document.file_path, document.filename
+        )
+        if fmt is None:
+            raise PermanentIngestionError("无法识别的文件格式")
 
-    async def _parse_excel(self, file_path: str) -> str:
-        """解析Excel文档"""
-        text = ""
         try:
-            wb = load_workbook(file_path, read_only=True)
-            for sheet_name in wb.sheetnames:
-                sheet = wb[sheet_name]
-                text += f"--- Sheet: {sheet_name} ---\n"
-                for row in sheet.iter_rows(values_only=True):
-                    row_text = " ".join([str(cell) if cell is not None else "" for cell in row])
-                    text += row_text + "\n"
+            return await parse_document(fmt, document.file_path, document.file_hash)
+        except ParseTimeoutError as e:
+            # 超时与文件本身有关，重试没有意义
+            raise PermanentIngestionError(str(e))
+        except ParseError:
+            raise
         except Exception as e:
-            print(f"Excel解析失败: {e}")
-
-        return text
-
-    def _chunk_text(self, text: str) -> List[str]:
-        """智能文本分块"""
-        chunks = []
-
-        # 按段落分割
-        paragraphs = text.split("\n\n")
-
-        current_chunk = ""
-        current_size = 0
-
-        for para in paragraphs:
-            para = para.strip()
-            if not para:
-                continue
-
-            para_size = len(para)
-
-            # 如果单独一个段落就超过chunk大小，按句子分割
-            if para_size > self.chunk_size:
-                # 保存当前chunk
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = ""
-                    current_size = 0
-
-                # 按句子分割
-                sentences = para.split("。")
-                for sent in sentences:
-                    sent = sent.strip()
-                    if not sent:
-                        continue
-
-                    if current_size + len(sent) > self.chunk_size:
-                        if current_chunk:
-                            chunks.append(current_chunk.strip())
-                        current_chunk = sent + "。"
-                        current_size = len(current_chunk)
-                    else:
-                        current_chunk += sent + "。"
-                        current_size += len(sent)
-            else:
-                # 段落可以加入当前chunk
-                if current_size + para_size > self.chunk_size:
-                    # 保存当前chunk
-                    if current_chunk:
-                        chunks.append(current_chunk.strip())
-                    current_chunk = para
-                    current_size = para_size
-                else:
-                    current_chunk += "\n" + para + "\n"
-                    current_size += para_size
-
-        # 保存最后一个chunk
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-
-        # 确保每个chunk不过小（除了最后一个）
-        min_chunk_size = 50
-        final_chunks = []
-        for i, chunk in enumerate(chunks):
-            if len(chunk) < min_chunk_size and i > 0:
-                # 合并到前一个chunk
-                final_chunks[-1] += "\n" + chunk
-            else:
-                final_chunks.append(chunk)
-
-        return final_chunks
+            error = str(e) or e.__class__.__name__
+            print(f"{fmt.name.upper()}解析失败: {error}")
+            raise PermanentIngestionError(f"文档解析失败: {error}")
 
     def _generate_summary(self, text: str, max_length: int = 200) -> str:
         """生成文档摘要"""
@@ -312,23 +347,65 @@ class DocumentService:
         if not document:
             return False
 
-        # 删除向量库中的数据
-        await self.rag_service.milvus.delete_by_document(document_id)
+        # 删除索引中的数据
+        await self.rag_service.delete_document(document_id, user_id)
 
-        # 删除文件
-        if os.path.exists(document.file_path):
-            os.remove(document.file_path)
-
-        # 删除记录
+        # 删除入库任务和记录，释放文件引用
+        unused = await self._release_file(document.file_path, document.file_hash)
+        await self.db.execute(delete(IngestionJob).where(IngestionJob.document_id == document_id))
         await self.db.delete(document)
         await self.db.commit()
 
+        # 最后一个引用删除后回收文件
+        await self._discard_file(document.file_path, document.file_hash, unused)
+
         return True
 
+    async def reindex_documents(self, user_id: int, document_ids: List[int] = None) -> List[IngestionJob]:
+        """重新入库用户的文档（如调整分块参数后），返回入库任务
+
+        读取解析结果缓存，不重新解析；未变化的块沿用原有索引；已排队的文档不重复入队
+        """
+        query = select(Document).where(Document.user_id == user_id)
+        if document_ids is not None:
+            query = query.where(Document.id.in_(document_ids))
+        documents = (await self.db.execute(query.order_by(Document.id))).scalars().all()
+
+        jobs = []
+        for document in documents:
+            job = await self.get_latest_job(document.id)
+            if job is None or job.status != "queued":
+                job = await enqueue(self.db, document)
+            document.status = "processing"
+            document.error_message = None
+            jobs.append(job)
+        await self.db.commit()
+        return jobs
+
+    async def _release_file(self, file_path: str, file_hash: str) -> bool:
+        """（在当前事务中）释放文档对文件的引用，返回文件是否已无引用"""
+        if file_path != blob_store.path(file_hash):
+            return False
+        return await blob_store.release(self.db, file_hash)
+
+    async def _discard_file(self, file_path: str, file_hash: str, unused: bool):
+        """（事务提交后）回收无引用的文件及其解析结果缓存"""
+        if file_path == blob_store.path(file_hash):
+            if unused:
+                await blob_store.collect(file_hash)
+            return
+
+        # 早期按 uuid_文件名 存放、每个文档独占的文件
+        if os.path.exists(file_path):
+            await aios.remove(file_path)
+        result = await self.db.execute(
+            select(func.count(Document.id)).where(Document.file_hash == file_hash)
+        )
+        if file_hash and not result.scalar():
+            await asyncio.to_thread(remove_artifacts, file_hash)
+
     async def get_document_stats(self, user_id: int) -> Dict:
         """获取用户文档统计"""
-        from sqlalchemy import func
-
         query = select(
             func.count(Document.id).label("total"),
             func.sum(Document.chunk_count).label("total_chunks"),
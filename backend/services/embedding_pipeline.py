@@ -0,0 +1,143 @@
+"""
+向量生成流水线
+支持：内容寻址向量缓存 + 按接口上限分批 + 有界并发 + 失败重试（指数退避）
+"""
+
+import asyncio
+import hashlib
+import random
+from typing import List, Dict, Iterable
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from core.config import settings
+from models.embedding import EmbeddingCacheEntry
+
+# SQLite单条语句的参数个数有限，IN查询分批执行
+_LOOKUP_BATCH = 500
+
+# 进程内所有流水线共享的并发上限（每个请求/入库任务各自创建流水线，并发数按进程而不是按任务计算）
+embedding_limiter = asyncio.Semaphore(settings.EMBEDDING_CONCURRENCY)
+
+
+def embedding_cache_key(model: str, text: str) -> str:
+    """缓存键：sha256(模型 + 文本)"""
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """持久化向量缓存（数据库表 embedding_cache）"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), _LOOKUP_BATCH):
+            result = await self.db.execute(
+                select(EmbeddingCacheEntry.key, EmbeddingCacheEntry.vector)
+                .where(EmbeddingCacheEntry.key.in_(keys[start:start + _LOOKUP_BATCH]))
+            )
+            for key, vector in result.all():
+                found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+
+    async def set_many(self, model: str, vectors: Dict[str, List[float]]):
+        """写入调用方的事务（不提交）：与随后插入的文档块一起提交，向量生成失败时随事务回滚"""
+        if not vectors:
+            return
+
+        rows = [
+            {
+                "key": key,
+                "model": model,
+                "dimension": len(vector),
+                "vector": np.asarray(vector, dtype=np.float32).tobytes()
+            }
+            for key, vector in vectors.items()
+        ]
+
+        # 并发写入同一键时忽略冲突
+        dialect = self.db.bind.dialect.name
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        await self.db.execute(insert(EmbeddingCacheEntry).on_conflict_do_nothing(), rows)
+
+
+class EmbeddingPipeline:
+    """向量生成流水线
+
+    1. 按 sha256(模型 + 文本) 查缓存，命中的文本不再调用接口
+    2. 未命中的文本去重后按 batch_size 分批
+    3. 各批次在信号量（默认进程内共享）限制下并发调用，失败按指数退避重试
+    4. 新生成的向量写回缓存
+    """
+
+    def __init__(
+        self,
+        provider,
+        cache: EmbeddingCache,
+        batch_size: int = None,
+        concurrency: int = None,
+        max_retries: int = None,
+        backoff: float = None
+    ):
+        self.provider = provider
+        self.cache = cache
+        self.batch_size = batch_size or provider.batch_size
+        self.max_retries = settings.EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.EMBEDDING_RETRY_BACKOFF if backoff is None else backoff
+        # 未指定 concurrency 时与其他流水线共享进程级的并发上限
+        self._semaphore = asyncio.Semaphore(concurrency) if concurrency else embedding_limiter
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """批量生成向量（与输入顺序一致）"""
+        if not texts:
+            return []
+
+        model = self.provider.engine
+        keys = [embedding_cache_key(model, text) for text in texts]
+        vectors = await self.cache.get_many(set(keys))
+
+        # 未命中的文本（去重）
+        pending: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                pending.setdefault(key, text)
+
+        if pending:
+            pending_keys = list(pending)
+            batches = [
+                pending_keys[start:start + self.batch_size]
+                for start in range(0, len(pending_keys), self.batch_size)
+            ]
+            results = await asyncio.gather(
+                *[self._embed_batch([pending[key] for key in batch]) for batch in batches]
+            )
+
+            fresh = {}
+            for batch, batch_vectors in zip(batches, results):
+                fresh.update(zip(batch, batch_vectors))
+            await self.cache.set_many(model, fresh)
+            vectors.update(fresh)
+
+        print(f"🧮 向量生成: {len(texts)} 条文本，缓存命中 {len(texts) - len(pending)}，新生成 {len(pending)}")
+        return [vectors[key] for key in keys]
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """单批次调用（有界并发 + 指数退避重试）"""
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    return await self.provider.embed_batch(texts)
+                except ValueError:
+                    # 维度不匹配等配置错误，重试无意义
+                    raise
+                except Exception as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self.backoff * (2 ** attempt) * (1 + random.random())
+                    print(f"⚠️  Embedding调用失败（第{attempt + 1}次），{delay:.1f}s后重试: {e}")
+                    await asyncio.sleep(delay)
@@ -0,0 +1,44 @@
+"""
+检索结果融合
+支持：倒数排名融合（RRF）、加权分数归一化融合
+"""
+
+from typing import List, Dict, Tuple
+
+# 每路检索结果为按分数降序的 [(chunk_id, score)]
+RankedList = List[Tuple[int, float]]
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: Dict[str, RankedList],
+    k: int = 60,
+    weights: Dict[str, float] = None
+) -> RankedList:
+    """倒数排名融合：score = Σ weight / (k + rank)，只依赖名次，不受各路分数尺度影响"""
+    fused: Dict[int, float] = {}
+    for name, hits in ranked_lists.items():
+        weight = (weights or {}).get(name, 1.0)
+        for rank, (chunk_id, _) in enumerate(hits, 1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + weight / (k + rank)
+
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def weighted_score_fusion(
+    ranked_lists: Dict[str, RankedList],
+    weights: Dict[str, float] = None
+) -> RankedList:
+    """加权分数融合：各路分数先做min-max归一化到[0, 1]，再按权重求和"""
+    fused: Dict[int, float] = {}
+    for name, hits in ranked_lists.items():
+        if not hits:
+            continue
+        weight = (weights or {}).get(name, 1.0)
+        scores = [score for _, score in hits]
+        low, high = min(scores), max(scores)
+        span = high - low
+        for chunk_id, score in hits:
+            normalized = (score - low) / span if span > 0 else 1.0
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + weight * normalized
+
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,325 @@
+"""
+文档入库队列（数据库实现）
+上传接口只入队并立即返回，由worker（独立进程 python -m workers.ingest 或API内置）领取处理
+
+- 领取：条件UPDATE（比较并设置），多个worker并发领取同一任务时只有一个成功，SQLite/PostgreSQL通用
+- 租约：处理期间定期续约；worker崩溃后租约过期，任务被其他worker重新领取
+- 重试：失败后按指数退避重新排队，超过最大次数进入死信（dead），文档标记为error
+"""
+
+import os
+import socket
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import select, update, and_, or_, exists
+from sqlalchemy.orm import aliased
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from models.job import IngestionJob
+from models.document import Document
+
+
+class PermanentIngestionError(Exception):
+    """不可重试的入库错误（如文档内容为空），直接进入死信"""
+
+
+def require_shared_cache(cache):
+    """入库worker与API分开部署时检查缓存配置
+
+    worker索引文档后须经Redis通知API进程递增用户代数，否则API进程会在缓存过期前返回旧的检索结果
+    """
+    if cache.redis is None:
+        raise RuntimeError(
+            "入库worker与API分开部署（INGEST_EMBEDDED_WORKER=false）需要启用Redis（ENABLE_REDIS=true），"
+            "否则API进程的检索缓存不会随入库失效"
+        )
+
+
+_Running = aliased(IngestionJob)
+
+
+def _claimable(now: datetime):
+    """可领取：排队中且已到可领取时间，或处理中但租约已过期；
+    同一文档的其他任务正在处理时（如处理中上传了新版本）等待其结束"""
+    return and_(
+        IngestionJob.attempts < IngestionJob.max_attempts,
+        or_(
+            and_(IngestionJob.status == "queued", IngestionJob.available_at <= now),
+            and_(IngestionJob.status == "running", IngestionJob.lease_expires_at < now)
+        ),
+        ~exists().where(
+            _Running.document_id == IngestionJob.document_id,
+            _Running.id != IngestionJob.id,
+            _Running.status == "running",
+            _Running.lease_expires_at >= now
+        )
+    )
+
+
+async def enqueue(db, document: Document) -> IngestionJob:
+    """为文档创建入库任务（调用方负责提交事务）"""
+    job = IngestionJob(
+        document_id=document.id,
+        user_id=document.user_id,
+        max_attempts=settings.INGEST_MAX_ATTEMPTS
+    )
+    db.add(job)
+    await db.flush()
+    return job
+
+
+class IngestionQueue:
+    """入库任务队列"""
+
+    def __init__(self, worker_id: str = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = settings.INGEST_LEASE_SECONDS
+
+    async def claim(self, limit: int) -> List[int]:
+        """领取最多 limit 个任务，返回任务ID"""
+        now = datetime.utcnow()
+        claimed = []
+        async with AsyncSessionLocal() as db:
+            await self._bury_exhausted(db, now)
+
+            # 多取一些候选，与其他worker争抢失败时继续尝试后面的任务
+            result = await db.execute(
+                select(IngestionJob.id).where(_claimable(now)).order_by(IngestionJob.id).limit(limit * 4)
+            )
+            for job_id in result.scalars().all():
+                if len(claimed) >= limit:
+                    break
+                # 条件仍成立才领取，并发的其他worker会更新0行
+                claim = await db.execute(
+                    update(IngestionJob)
+                    .where(IngestionJob.id == job_id, _claimable(now))
+                    .values(
+                        status="running",
+                        attempts=IngestionJob.attempts + 1,
+                        lease_owner=self.worker_id,
+                        lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                        updated_at=now
+                    )
+                )
+                if claim.rowcount:
+                    claimed.append(job_id)
+            await db.commit()
+        return claimed
+
+    async def _bury_exhausted(self, db, now: datetime):
+        """租约过期且重试次数耗尽的任务（worker多次在处理中崩溃）直接进入死信"""
+        result = await db.execute(
+            select(IngestionJob).where(
+                IngestionJob.status == "running",
+                IngestionJob.lease_expires_at < now,
+                IngestionJob.attempts >= IngestionJob.max_attempts
+            )
+        )
+        for job in result.scalars().all():
+            await self._dead_letter(db, job, job.last_error or "处理超时（worker租约过期）")
+
+    async def heartbeat(self, job_id: int) -> bool:
+        """续约，返回是否仍持有该任务"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(IngestionJob)
+                .where(
+                    IngestionJob.id == job_id,
+                    IngestionJob.status == "running",
+                    IngestionJob.lease_owner == self.worker_id
+                )
+                .values(lease_expires_at=now + timedelta(seconds=self.lease_seconds), updated_at=now)
+            )
+            await db.commit()
+            return bool(result.rowcount)
+
+    async def complete(self, job_id: int):
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(IngestionJob)
+                .where(IngestionJob.id == job_id, IngestionJob.lease_owner == self.worker_id)
+                .values(status="succeeded", lease_owner=None, lease_expires_at=None,
+                        last_error=None, finished_at=now, updated_at=now)
+            )
+            await db.commit()
+
+    async def fail(self, job_id: int, error: str, retry: bool = True) -> str:
+        """记录失败：可重试且未超过最大次数时退避后重新排队，否则进入死信；返回任务新状态"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            job = await db.get(IngestionJob, job_id)
+            if job is None or job.lease_owner != self.worker_id:
+                return job.status if job else "missing"
+
+            if not retry or job.attempts >= job.max_attempts:
+                await self._dead_letter(db, job, error)
+                return "dead"
+
+            delay = settings.INGEST_RETRY_BACKOFF * (2 ** (job.attempts - 1))
+            job.status = "queued"
+            job.available_at = now + timedelta(seconds=delay)
+            job.lease_owner = None
+            job.lease_expires_at = None
+            job.last_error = error[:1000]
+            job.updated_at = now
+            await db.commit()
+            print(f"🔁 入库任务 {job_id} 第{job.attempts}次失败，{delay:.0f}s后重试: {error}")
+            return "queued"
+
+    async def _dead_letter(self, db, job: IngestionJob, error: str):
+        now = datetime.utcnow()
+        job.status = "dead"
+        job.lease_owner = None
+        job.lease_expires_at = None
+        job.last_error = error[:1000]
+        job.finished_at = now
+        job.updated_at = now
+
+        document = await db.get(Document, job.document_id)
+        if document:
+            document.status = "error"
+            document.error_message = error[:1000]
+        await db.commit()
+        print(f"☠️  入库任务 {job.id} 重试耗尽，进入死信: {error}")
+
+    async def retry_dead(self, job_id: int) -> bool:
+        """重新投递死信任务（重置重试次数）"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            job = await db.get(IngestionJob, job_id)
+            if job is None or job.status != "dead":
+                return False
+            job.status = "queued"
+            job.attempts = 0
+            job.available_at = now
+            job.finished_at = None
+            job.updated_at = now
+            document = await db.get(Document, job.document_id)
+            if document:
+                document.status = "processing"
+                document.error_message = None
+            await db.commit()
+            return True
+
+
+class IngestionWorker:
+    """入库worker：轮询领取任务，有界并发处理，处理期间定期续约"""
+
+    def __init__(self, concurrency: int = None, poll_interval: float = None, queue: IngestionQueue = None):
+        self.queue = queue or IngestionQueue()
+        self.concurrency = concurrency or settings.INGEST_CONCURRENCY
+        self.poll_interval = settings.INGEST_POLL_INTERVAL if poll_interval is None else poll_interval
+        self._active: set = set()
+        self._stopping = asyncio.Event()
+        self.processed = 0
+        self.failed = 0
+
+    async def run(self):
+        """持续处理直到 stop() 被调用"""
+        print(f"🛠️  入库worker启动: {self.queue.worker_id}（并发 {self.concurrency}）")
+        while not self._stopping.is_set():
+            try:
+                claimed = await self.run_once()
+            except Exception as e:
+                print(f"⚠️  领取入库任务失败: {e}")
+                claimed = 0
+            if not claimed:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+        # 等待进行中的任务结束（未结束的任务租约过期后由其他worker接手）
+        if self._active:
+            await asyncio.wait(self._active, timeout=settings.INGEST_LEASE_SECONDS)
+        print(f"👋 入库worker已停止: {self.queue.worker_id}")
+
+    async def run_once(self) -> int:
+        """按空闲并发数领取任务并启动处理，返回领取数"""
+        free = self.concurrency - len(self._active)
+        if free <= 0:
+            await asyncio.wait(self._active, return_when=asyncio.FIRST_COMPLETED)
+            return 0
+
+        job_ids = await self.queue.claim(free)
+        for job_id in job_ids:
+            task = asyncio.create_task(self._process(job_id))
+            self._active.add(task)
+            task.add_done_callback(self._active.discard)
+        return len(job_ids)
+
+    async def drain(self):
+        """处理完当前所有可领取的任务后返回（用于测试和一次性执行）"""
+        while await self.run_once() or self._active:
+            if self._active:
+                await asyncio.wait(self._active, return_when=asyncio.FIRST_COMPLETED)
+
+    def stop(self):
+        self._stopping.set()
+
+    async def _process(self, job_id: int):
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            await process_job(job_id)
+        except PermanentIngestionError as e:
+            self.failed += 1
+            await self.queue.fail(job_id, str(e), retry=False)
+        except Exception as e:
+            self.failed += 1
+            await self.queue.fail(job_id, str(e) or e.__class__.__name__)
+        else:
+            self.processed += 1
+            await self.queue.complete(job_id)
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job_id: int):
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                await self.queue.heartbeat(job_id)
+            except Exception as e:
+                print(f"⚠️  入库任务 {job_id} 续约失败: {e}")
+
+
+async def process_job(job_id: int):
+    """执行一个入库任务：解析、分块、索引（失败时抛出异常，由队列决定重试或死信）"""
+    from services.rag_service import RAGService
+    from services.document_service import DocumentService
+
+    async with AsyncSessionLocal() as db:
+        job = await db.get(IngestionJob, job_id)
+        document = await db.get(Document, job.document_id) if job else None
+        if document is None:
+            # 文档已被删除，任务无需处理
+            return
+
+        service = DocumentService(db, RAGService(db))
+        await service.process_document(document)
+
+
+async def get_job_status(db, job_id: int, user_id: int) -> Optional[dict]:
+    """查询任务状态（含文档处理结果）"""
+    job = await db.get(IngestionJob, job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    document = await db.get(Document, job.document_id)
+    return {
+        "job_id": job.id,
+        "document_id": job.document_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "last_error": job.last_error,
+        "available_at": job.available_at.isoformat(),
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "document_status": document.status if document else None,
+        "chunk_count": document.chunk_count if document else 0
+    }
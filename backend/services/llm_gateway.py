@@ -0,0 +1,266 @@
+"""
+大模型调用网关
+支持：并发上限 + 带截止时间的等待队列 + AIMD自适应并发（限流/延迟信号）+ 熔断器 + 运行指标
+"""
+
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+from core.config import settings
+
+# 千帆限流错误码：请求数/日请求数/QPS/RPM/TPM超限
+RATE_LIMIT_ERROR_CODES = {4, 17, 18, 336501, 336502}
+
+# 两次乘性减小之间的最短间隔（秒），避免同一批失败把并发压到最低
+DECREASE_INTERVAL = 1.0
+
+
+class LLMError(Exception):
+    """大模型调用失败"""
+
+
+class RateLimitedError(LLMError):
+    """被服务端限流（HTTP 429 或限流错误码）"""
+
+
+class ProviderUnavailable(LLMError):
+    """网关拒绝请求（熔断中 / 排队已满 / 排队超时），无需等待即可失败"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """熔断器：连续失败达到阈值后打开，冷却后半开放行一个试探请求"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def before_call(self):
+        if self.state == "open":
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0:
+                raise ProviderUnavailable("大模型服务暂时不可用（熔断中）", retry_after=remaining)
+            self.state = "half_open"
+
+        if self.state == "half_open":
+            if self._probing:
+                raise ProviderUnavailable("大模型服务恢复探测中", retry_after=1.0)
+            self._probing = True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                print(f"⚠️  大模型熔断器打开（连续失败 {self.failures} 次），{self.cooldown:.0f}s后重试")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """试探请求未产生结论（如调用方取消）时，允许下一个请求试探"""
+        self._probing = False
+
+
+class Lease:
+    """一次调用占用的并发名额（流式调用可标记首个token时间作为延迟信号）"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.first_token_at: Optional[float] = None
+
+    def mark_first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    @property
+    def latency(self) -> float:
+        return (self.first_token_at or time.monotonic()) - self.started
+
+
+class LLMGateway:
+    """大模型调用准入控制
+
+    - 同时在途请求数不超过当前并发上限 limit，超出的请求排队，超过截止时间或队列已满时直接拒绝
+    - limit 按AIMD调整：成功且延迟低于目标时加性增大（每轮约+1），限流/超时/延迟过高时乘性减小
+    - 服务端连续故障时熔断，熔断期间请求立即失败，不再占用连接等待超时
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        max_queue: int = 100,
+        queue_timeout: float = 10.0,
+        latency_target: float = 15.0,
+        decrease_factor: float = 0.5,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 30.0
+    ):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = max(min(min_concurrency, max_concurrency), 1)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self._last_decrease = 0.0
+
+        self.completed = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.rejected = 0
+        self.avg_latency = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        """占用一个并发名额执行调用：async with gateway.slot() as lease: ..."""
+        self.breaker.before_call()
+        await self._acquire()
+        lease = Lease()
+        try:
+            yield lease
+        except (asyncio.CancelledError, GeneratorExit):
+            self.breaker.release_probe()
+            raise
+        except Exception as e:
+            self._on_failure(e)
+            raise
+        else:
+            self._on_success(lease.latency)
+        finally:
+            self._release()
+
+    async def _acquire(self):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            self.breaker.release_probe()
+            raise ProviderUnavailable("大模型请求排队已满，请稍后重试")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # 名额已分配但调用方放弃，归还名额
+                self._release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            self.breaker.release_probe()
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise ProviderUnavailable(f"大模型请求排队超时（{self.queue_timeout:.0f}s）") from None
+            raise
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _on_success(self, latency: float):
+        self.completed += 1
+        self.avg_latency = latency if self.completed == 1 else 0.9 * self.avg_latency + 0.1 * latency
+        self.breaker.record_success()
+
+        if latency > self.latency_target:
+            self._decrease()
+        else:
+            # 加性增大：每完成约 limit 个请求，上限+1
+            self.limit = min(self.limit + 1 / self.limit, float(self.max_concurrency))
+            self._wake()
+
+    def _on_failure(self, error: Exception):
+        if is_rate_limited(error):
+            self.rate_limited += 1
+            self.breaker.release_probe()
+            self._decrease()
+            return
+
+        self.failed += 1
+        if is_provider_failure(error):
+            self.breaker.record_failure()
+            self._decrease()
+        else:
+            # 参数错误等请求本身的问题，不代表服务不健康
+            self.breaker.release_probe()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_INTERVAL:
+            return
+        self._last_decrease = now
+        self.limit = max(self.limit * self.decrease_factor, float(self.min_concurrency))
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "breaker": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+            "rejected": self.rejected,
+            "avg_latency": round(self.avg_latency, 3)
+        }
+
+
+def is_rate_limited(error: Exception) -> bool:
+    if isinstance(error, RateLimitedError):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429
+
+
+def is_provider_failure(error: Exception) -> bool:
+    """超时、连接失败、5xx 视为服务端故障（计入熔断）"""
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code >= 500
+
+
+chat_gateway = LLMGateway(
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    min_concurrency=settings.LLM_MIN_CONCURRENCY,
+    max_queue=settings.LLM_MAX_QUEUE,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+    latency_target=settings.LLM_LATENCY_TARGET,
+    decrease_factor=settings.LLM_DECREASE_FACTOR,
+    breaker_threshold=settings.LLM_BREAKER_THRESHOLD,
+    breaker_cooldown=settings.LLM_BREAKER_COOLDOWN
+)
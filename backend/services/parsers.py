@@ -1,73 +1,409 @@
 """
-文档解析器
-支持PDF、Word、Excel、纯文本
+文档解析器注册表
+按文件内容（魔数/ZIP目录）识别格式，每种格式注册一个流式解析器：逐项产出文本块（页、段落、表格行）
+
+- 新格式只需用 @register_format 注册一个生成器函数，无需修改入库流程
+- PDF/Word/Excel 在解析进程池中执行，文本块逐条写入gzip文件，主进程再逐条读取，
+  两端内存占用都与文档大小无关；大PDF按页范围拆分并行解析
+- 解析结果按文件哈希和解析器版本缓存，重建索引（如调整分块参数）时跳过解析
+- 文本文件直接在主进程逐行读取
 """
 
-from typing import List
 import os
+import gzip
+import json
+import codecs
+import shutil
+import asyncio
+import zlib
+import zipfile
+import tempfile
+from typing import Callable, Iterable, Iterator, List, Optional
+from xml.etree import ElementTree
 
+from core.config import settings
+from services.chunker import Block
+from services.document_parser import parser_pool, ParseError
 
-async def parse_pdf(file_path: str) -> str:
-    """解析PDF文档"""
-    import pypdf
+# 识别格式读取的文件头字节数
+SNIFF_BYTES = 8 * 1024
+# 文本文件编码探测读取的字节数
+TEXT_SNIFF_BYTES = 64 * 1024
+# 解析结果缓存文件的后缀和gzip压缩级别（兼顾速度与压缩率）
+ARTIFACT_SUFFIX = ".jsonl.gz"
+ARTIFACT_COMPRESS_LEVEL = 6
 
-    text = ""
-    with open(file_path, 'rb') as file:
-        pdf_reader = pypdf.PdfReader(file)
 
-        # 提取所有页面文本
-        for page in pdf_reader.pages:
-            extracted = page.extract_text()
-            if extracted:
-                text += extracted + "\n"
+class DocumentFormat:
+    """已注册的文档格式"""
 
-    return text.strip()
+    def __init__(
+        self,
+        name: str,
+        mime_type: str,
+        extensions: List[str],
+        parse: Callable[..., Iterator[Block]],
+        sniff: Callable[[bytes, str, str], bool],
+        isolated: bool = True,
+        page_count: Callable[[str], int] = None,
+        version: int = 1
+    ):
+        self.name = name
+        self.mime_type = mime_type
+        self.extensions = extensions
+        # parse(file_path) 产出文本块；分页格式为 parse(file_path, start, end)，产出 (文本, 页码)
+        self.parse = parse
+        # sniff(文件头, 文件路径, 扩展名) 判断文件是否属于该格式
+        self.sniff = sniff
+        # 是否在解析进程池中执行（解析库CPU密集或可能崩溃）
+        self.isolated = isolated
+        # 分页格式的页数函数，页数较多时按页范围并行解析
+        self.page_count = page_count
+        # 解析器版本，输出变化时递增，使已缓存的解析结果失效
+        self.version = version
 
 
-async def parse_docx(file_path: str) -> str:
-    """解析Word文档"""
-    from docx import Document
+_FORMATS: List[DocumentFormat] = []
 
-    doc = Document(file_path)
-    text = ""
 
-    # 提取段落文本
-    for paragraph in doc.paragraphs:
-        if paragraph.text.strip():
-            text += paragraph.text + "\n"
+def register_format(
+    name: str,
+    mime_type: str,
+    extensions: List[str],
+    sniff: Callable[[bytes, str, str], bool],
+    isolated: bool = True,
+    page_count: Callable[[str], int] = None,
+    version: int = 1
+):
+    """注册解析器（装饰器）；后注册的格式优先识别，可覆盖内置格式
 
-    # 提取表格文本
-    for table in doc.tables:
-        for row in table.rows:
-            row_text = " | ".join([cell.text for cell in row.cells])
-            if row_text.strip():
-                text += row_text + "\n"
+    解析函数须是模块级函数（在解析子进程中按模块路径导入执行）
+    """
+    def decorator(parse: Callable[..., Iterator[Block]]):
+        _FORMATS.append(DocumentFormat(name, mime_type, extensions, parse, sniff, isolated, page_count, version))
+        return parse
+    return decorator
 
-    return text.strip()
 
+def detect_format(file_path: str, filename: str = None) -> Optional[DocumentFormat]:
+    """按文件内容识别格式，无法识别返回None（filename 用于区分同类内容，如 .md 与 .txt）"""
+    ext = os.path.splitext(filename or file_path)[1].lower()[1:]
+    with open(file_path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    for fmt in reversed(_FORMATS):
+        if fmt.sniff(head, file_path, ext):
+            return fmt
+    return None
 
-async def parse_text(file_path: str) -> str:
-    """解析纯文本文件"""
-    with open(file_path, 'r', encoding='utf-8') as file:
-        text = file.read()
 
-    return text.strip()
+def resolve_format(mime_type: str, file_path: str, filename: str = None) -> Optional[DocumentFormat]:
+    """按上传时识别的内容类型查找解析器；未记录识别结果的旧文档重新识别"""
+    for fmt in reversed(_FORMATS):
+        if fmt.mime_type == mime_type:
+            return fmt
+    return detect_format(file_path, filename)
 
 
-async def parse_excel(file_path: str) -> str:
-    """解析Excel文件"""
-    from openpyxl import load_workbook
+async def parse_document(fmt: DocumentFormat, file_path: str, file_hash: str = None) -> Iterable[Block]:
+    """解析文档，返回惰性读取的文本块（只能迭代一次，用完后调用 close() 释放临时文件）
+
+    进程池解析的格式按 (file_hash, 格式, 解析器版本) 缓存解析结果（gzip压缩），
+    调整分块参数后重建索引直接读取缓存，不再重新解析
+    """
+    if not fmt.isolated:
+        return fmt.parse(file_path)
+
+    artifact = artifact_path(file_hash, fmt) if file_hash and settings.PARSE_ARTIFACT_CACHE else None
+    if artifact and os.path.exists(artifact):
+        return BlockReader([artifact], artifact=True)
+
+    spool_dir = os.path.dirname(artifact) if artifact else settings.UPLOAD_DIR
+    if fmt.page_count is None:
+        spools = [await _spool(spool_dir, fmt.parse, file_path)]
+    else:
+        spools = await _spool_pages(spool_dir, fmt, file_path)
+
+    if artifact is None:
+        return BlockReader(spools)
+    await asyncio.to_thread(_commit_artifact, spools, artifact)
+    return BlockReader([artifact], artifact=True)
+
+
+def artifact_path(file_hash: str, fmt: DocumentFormat) -> str:
+    """解析结果缓存路径（按哈希前两位分目录）"""
+    return os.path.join(
+        settings.PARSE_ARTIFACT_DIR, file_hash[:2], f"{file_hash}.{fmt.name}-v{fmt.version}{ARTIFACT_SUFFIX}"
+    )
+
+
+def remove_artifacts(file_hash: str) -> int:
+    """删除文件的所有解析结果缓存（各格式/解析器版本）"""
+    if not file_hash:
+        return 0
+    directory = os.path.join(settings.PARSE_ARTIFACT_DIR, file_hash[:2])
+    if not os.path.isdir(directory):
+        return 0
+    paths = [
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith(file_hash + ".") and name.endswith(ARTIFACT_SUFFIX)
+    ]
+    _remove(paths)
+    return len(paths)
+
+
+# ---------- 解析进程池与临时文件 ----------
+
+def spool_blocks(parse: Callable[..., Iterator[Block]], spool_path: str, *args) -> int:
+    """（子进程）执行解析器，文本块逐条写入gzip临时文件（每行一个JSON），返回块数"""
+    count = 0
+    with gzip.open(spool_path, "wt", encoding="utf-8", compresslevel=ARTIFACT_COMPRESS_LEVEL) as f:
+        for block in parse(*args):
+            f.write(json.dumps(block, ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def _new_spool(directory: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=".parse-", suffix=".part", dir=directory)
+    os.close(fd)
+    return path
+
+
+def _remove(paths: List[str]):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _commit_artifact(spools: List[str], artifact: str):
+    """临时文件合并为缓存文件（多个gzip成员首尾相接仍是合法的gzip文件），原子替换"""
+    if len(spools) > 1:
+        merged = _new_spool(os.path.dirname(artifact))
+        try:
+            with open(merged, "wb") as out:
+                for spool_path in spools:
+                    with open(spool_path, "rb") as f:
+                        shutil.copyfileobj(f, out)
+        except BaseException:
+            _remove([merged])
+            raise
+        finally:
+            _remove(spools)
+        spools = [merged]
+    os.replace(spools[0], artifact)
+
+
+async def _spool(directory: str, parse: Callable[..., Iterator[Block]], file_path: str, *args) -> str:
+    spool_path = _new_spool(directory)
+    try:
+        await parser_pool.run(spool_blocks, parse, spool_path, file_path, *args)
+    except BaseException:
+        _remove([spool_path])
+        raise
+    return spool_path
+
+
+async def _spool_pages(directory: str, fmt: DocumentFormat, file_path: str) -> List[str]:
+    """分页格式：页数较多时拆成若干页范围（每段不超过 PDF_PAGES_PER_TASK 页，且至少拆成进程数个）
+    并行解析，任一段失败时取消其余段"""
+    page_count = await parser_pool.run(fmt.page_count, file_path)
+    pages_per_task = settings.PDF_PAGES_PER_TASK
+    if page_count <= pages_per_task:
+        return [await _spool(directory, fmt.parse, file_path, 0, page_count)]
+
+    step = min(pages_per_task, -(-page_count // parser_pool.max_workers))
+    try:
+        async with asyncio.TaskGroup() as group:
+            tasks = [
+                group.create_task(_spool(directory, fmt.parse, file_path, start, start + step))
+                for start in range(0, page_count, step)
+            ]
+    except ExceptionGroup as e:
+        _remove([task.result() for task in tasks if task.done() and not task.cancelled() and not task.exception()])
+        raise e.exceptions[0]
+    return [task.result() for task in tasks]
+
+
+class BlockReader:
+    """流式读取gzip文件中的文本块
+
+    临时文件在 close() 时删除；缓存文件保留，读取出错（文件损坏）时删除，重试时重新解析
+    """
+
+    def __init__(self, paths: List[str], artifact: bool = False):
+        self.paths = paths
+        self.artifact = artifact
 
-    wb = load_workbook(file_path)
-    text = ""
+    def __iter__(self) -> Iterator[Block]:
+        try:
+            for path in self.paths:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        block = json.loads(line)
+                        yield block if isinstance(block, str) else tuple(block)
+        except (OSError, EOFError, ValueError, zlib.error) as e:
+            if not self.artifact:
+                raise
+            _remove(self.paths)
+            raise ParseError(f"解析缓存损坏，已删除: {e}") from e
 
-    for sheet_name in wb.sheetnames:
-        sheet = wb[sheet_name]
-        text += f"工作表: {sheet_name}\n"
+    def close(self):
+        if not self.artifact:
+            _remove(self.paths)
 
-        for row in sheet.iter_rows(values_only=True):
-            row_text = " | ".join([str(cell) if cell is not None else "" for cell in row])
-            if row_text.strip():
-                text += row_text + "\n"
 
-    return text.strip()
+# ---------- 格式识别 ----------
+
+def _is_text(head: bytes) -> bool:
+    """不含NUL字节视为文本（UTF-8/GBK等）"""
+    return b"\x00" not in head
+
+
+def _zip_contains(member: str) -> Callable[[bytes, str, str], bool]:
+    """OOXML文档（ZIP包）按包内的主文档部件区分Word/Excel"""
+    def sniff(head: bytes, file_path: str, ext: str) -> bool:
+        if not head.startswith(b"PK\x03\x04"):
+            return False
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                return member in archive.namelist()
+        except zipfile.BadZipFile:
+            return False
+    return sniff
+
+
+# ---------- 内置解析器（先注册文本，二进制格式优先识别） ----------
+
+@register_format(
+    "text", "text/plain", ["txt"],
+    sniff=lambda head, file_path, ext: _is_text(head),
+    isolated=False
+)
+def parse_text(file_path: str) -> Iterator[str]:
+    """逐行读取文本文件（支持中文：按文件开头判断UTF-8，否则按GBK解码）"""
+    with open(file_path, "rb") as f:
+        head = f.read(TEXT_SNIFF_BYTES)
+    try:
+        # 截断处可能落在多字节字符中间，忽略末尾的不完整字符
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "gbk"
+
+    with open(file_path, "r", encoding=encoding, errors="replace") as f:
+        yield from f
+
+
+register_format(
+    "markdown", "text/markdown", ["md"],
+    sniff=lambda head, file_path, ext: ext == "md" and _is_text(head),
+    isolated=False
+)(parse_text)
+
+
+def pdf_page_count(file_path: str) -> int:
+    """PDF页数"""
+    import fitz  # PyMuPDF
+
+    with fitz.open(file_path) as doc:
+        return doc.page_count
+
+
+@register_format(
+    "pdf", "application/pdf", ["pdf"],
+    sniff=lambda head, file_path, ext: b"%PDF-" in head[:1024],
+    page_count=pdf_page_count
+)
+def parse_pdf(file_path: str, start: int, end: int) -> Iterator[tuple]:
+    """解析PDF第 [start, end) 页（从0开始），每页产出 (文本, 页码)，页码从1开始"""
+    import fitz  # PyMuPDF
+
+    with fitz.open(file_path) as doc:
+        for number in range(start, min(end, doc.page_count)):
+            yield doc[number].get_text(), number + 1
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+
+
+@register_format(
+    "docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", ["docx"],
+    sniff=_zip_contains("word/document.xml")
+)
+def parse_docx(file_path: str) -> Iterator[str]:
+    """流式解析Word正文（不构建整个文档树）：按文档顺序每个段落一项，表格每行一项（单元格以 | 分隔）"""
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as xml:
+        body = None
+        paragraphs: List[List[str]] = []  # 文本框中的段落嵌套在外层段落内
+        table_depth = 0
+        fallback_depth = 0  # 兼容性备用内容与主内容重复，跳过
+        cell: List[str] = []
+        row: List[str] = []
+
+        for event, element in ElementTree.iterparse(xml, events=("start", "end")):
+            tag = element.tag
+            if tag == _MC_FALLBACK:
+                fallback_depth += 1 if event == "start" else -1
+                continue
+            if fallback_depth:
+                continue
+
+            if event == "start":
+                if tag == _W + "body":
+                    body = element
+                elif tag == _W + "p":
+                    paragraphs.append([])
+                elif tag == _W + "tbl":
+                    table_depth += 1
+                continue
+
+            if tag == _W + "t" and paragraphs:
+                paragraphs[-1].append(element.text or "")
+            elif tag == _W + "tab" and paragraphs:
+                paragraphs[-1].append("\t")
+            elif tag in (_W + "br", _W + "cr") and paragraphs:
+                paragraphs[-1].append("\n")
+            elif tag == _W + "p":
+                text = "".join(paragraphs.pop())
+                if table_depth:
+                    cell.append(text)
+                elif text.strip():
+                    yield text
+            elif tag == _W + "tc" and table_depth == 1:
+                row.append(" ".join(text.strip() for text in cell if text.strip()))
+                cell = []
+            elif tag == _W + "tr" and table_depth == 1:
+                if any(row):
+                    yield " | ".join(row)
+                row = []
+            elif tag == _W + "tbl":
+                table_depth -= 1
+
+            # 顶层段落/表格处理完后释放已解析的元素
+            if body is not None and not table_depth and not paragraphs and tag in (_W + "p", _W + "tbl"):
+                body.clear()
+
+
+@register_format(
+    "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ["xlsx"],
+    sniff=_zip_contains("xl/workbook.xml")
+)
+def parse_excel(file_path: str) -> Iterator[str]:
+    """流式解析Excel（只读模式逐行读取），每个工作表标题/每个非空行一项（单元格以 | 分隔）"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in wb.worksheets:
+            yield f"--- Sheet: {sheet.title} ---"
+            for row in sheet.iter_rows(values_only=True):
+                cells = ["" if cell is None else str(cell) for cell in row]
+                while cells and not cells[-1]:
+                    cells.pop()
+                if cells:
+                    yield " | ".join(cells)
+    finally:
+        wb.close()
@@ -0,0 +1,304 @@
+"""
+向量量化
+支持：int8标量量化（4倍压缩）、乘积量化PQ（768维/96子空间约32倍压缩）
+压缩码常驻内存用于粗排，原始float32向量保存在磁盘（内存映射）用于精排
+"""
+
+import os
+import copy
+import json
+import threading
+from typing import List, Tuple, Optional, Set
+
+import numpy as np
+
+from services.ann_index import MmapVectorStore, FILTER_EXACT_LIMIT
+from services.vector_index import normalize
+
+# 压缩码分块扫描的行数（控制解码时的临时内存）
+CODE_BLOCK_ROWS = 8192
+
+
+class ScalarQuantizer:
+    """int8标量量化：每个维度一个缩放系数"""
+
+    name = "int8"
+    min_train_size = 1000
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.code_size = dimension
+        self.code_dtype = np.int8
+        self.scale: Optional[np.ndarray] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.scale is not None
+
+    def train(self, sample: np.ndarray):
+        self.scale = (np.maximum(np.abs(sample).max(axis=0), 1e-6) / 127).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def prepare(self, query: np.ndarray) -> np.ndarray:
+        # 把缩放系数并入查询向量，扫描时只需一次矩阵乘
+        return (query * self.scale).astype(np.float32)
+
+    def scan(self, codes: np.ndarray, state: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) @ state
+
+    def save(self, path: str):
+        np.savez(path, scale=self.scale)
+
+    def load(self, path: str):
+        with np.load(path) as data:
+            self.scale = data["scale"]
+
+
+class ProductQuantizer:
+    """乘积量化：向量切分为m个子空间，每个子空间用256个质心编码为1字节"""
+
+    name = "pq"
+    ksub = 256
+    kmeans_iterations = 15
+
+    def __init__(self, dimension: int, m: int):
+        if dimension % m != 0:
+            raise ValueError(f"PQ子空间数 PQ_M={m} 必须整除向量维度 {dimension}")
+        self.dimension = dimension
+        self.m = m
+        self.dsub = dimension // m
+        self.code_size = m
+        self.code_dtype = np.uint8
+        self.min_train_size = self.ksub * 39
+        self.centroids: Optional[np.ndarray] = None  # (m, 256, dsub)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, sample: np.ndarray):
+        rng = np.random.default_rng(0)
+        sample = sample.reshape(len(sample), self.m, self.dsub)
+        centroids = np.empty((self.m, self.ksub, self.dsub), dtype=np.float32)
+        for j in range(self.m):
+            sub = sample[:, j, :]
+            cent = sub[rng.choice(len(sub), self.ksub, replace=False)].copy()
+            for _ in range(self.kmeans_iterations):
+                labels = self._nearest(sub, cent)
+                sums = np.zeros_like(cent)
+                np.add.at(sums, labels, sub)
+                counts = np.bincount(labels, minlength=self.ksub)
+                filled = counts > 0
+                cent[filled] = sums[filled] / counts[filled, None]
+            centroids[j] = cent
+        self.centroids = centroids
+
+    @staticmethod
+    def _nearest(sub: np.ndarray, cent: np.ndarray) -> np.ndarray:
+        # argmin ||x-c||² = argmax (2x·c - ||c||²)
+        return np.argmax(2 * sub @ cent.T - (cent * cent).sum(axis=1), axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = vectors.reshape(len(vectors), self.m, self.dsub)
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = self._nearest(vectors[:, j, :], self.centroids[j])
+        return codes
+
+    def prepare(self, query: np.ndarray) -> np.ndarray:
+        # 查表法（ADC）：每个子空间预先算好查询与256个质心的内积
+        return np.einsum("jkd,jd->jk", self.centroids, query.reshape(self.m, self.dsub))
+
+    def scan(self, codes: np.ndarray, state: np.ndarray) -> np.ndarray:
+        return state[np.arange(self.m), codes].sum(axis=1, dtype=np.float32)
+
+    def save(self, path: str):
+        np.savez(path, centroids=self.centroids)
+
+    def load(self, path: str):
+        with np.load(path) as data:
+            self.centroids = data["centroids"]
+
+
+class QuantizedFlatIndex:
+    """压缩码暴力扫描 + 原始向量精排的flat索引
+
+    向量数不足训练阈值或训练（build）完成前，直接在内存映射的原始向量上精确检索
+    """
+
+    def __init__(self, path: str, dimension: int, quantizer, rerank_factor: int = 8):
+        self.store = MmapVectorStore(path, dimension)
+        self.path = path
+        self.quantizer = quantizer
+        self.rerank_factor = max(rerank_factor, 1)
+        self._lock = threading.RLock()
+
+        self.encoded = 0
+        self._codes = np.empty((0, quantizer.code_size), dtype=quantizer.code_dtype)
+        if os.path.exists(self._quantizer_file):
+            quantizer.load(self._quantizer_file)
+            self.encoded = self._read_meta().get("encoded", 0)
+            self._load_codes()
+            if self.encoded < self.store.count:
+                self._encode_pending()
+
+    @property
+    def _quantizer_file(self) -> str:
+        return os.path.join(self.path, "quantizer.npz")
+
+    @property
+    def _codes_file(self) -> str:
+        return os.path.join(self.path, "codes.bin")
+
+    @property
+    def _meta_file(self) -> str:
+        return os.path.join(self.path, "quant.json")
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._codes[:self.encoded]
+
+    def _read_meta(self) -> dict:
+        if not os.path.exists(self._meta_file):
+            return {}
+        with open(self._meta_file) as f:
+            return json.load(f)
+
+    def _load_codes(self):
+        q = self.quantizer
+        codes = np.fromfile(self._codes_file, dtype=q.code_dtype, count=self.encoded * q.code_size)
+        self._codes = codes.reshape(self.encoded, q.code_size)
+
+    def _reserve(self, capacity: int):
+        """按倍增策略扩容压缩码缓冲区"""
+        if capacity <= len(self._codes):
+            return
+        new_capacity = max(capacity, 2 * len(self._codes), 1024)
+        codes = np.empty((new_capacity, self.quantizer.code_size), dtype=self.quantizer.code_dtype)
+        codes[:self.encoded] = self.codes
+        self._codes = codes
+
+    def add(self, chunk_ids: List[int], document_ids: List[int], vectors) -> int:
+        """追加向量（已训练时同时编码；训练由 build 完成）"""
+        vectors = normalize(vectors)
+        if len(vectors) == 0:
+            return 0
+        with self._lock:
+            self.store.append(chunk_ids, document_ids, vectors)
+            if self.quantizer.is_trained:
+                self._encode_pending()
+        return len(vectors)
+
+    def delete_document(self, document_id: int) -> int:
+        with self._lock:
+            return self.store.mark_deleted(document_id)
+
+    def delete_chunks(self, chunk_ids: List[int]) -> int:
+        with self._lock:
+            return self.store.mark_chunks_deleted(chunk_ids)
+
+    def indexed_chunk_ids(self, chunk_ids: List[int]) -> Set[int]:
+        with self._lock:
+            return self.store.live_chunk_ids(chunk_ids)
+
+    def needs_build(self) -> bool:
+        return not self.quantizer.is_trained and self.store.count >= self.quantizer.min_train_size
+
+    def build(self):
+        """在量化器副本上训练并编码已有向量，写入临时文件（不持有检索锁，训练期间精确检索）
+
+        返回 (训练好的量化器, 压缩码)，由 install 切换
+        """
+        with self._lock:
+            count = self.store.count
+            vectors = self.store.vectors
+        quantizer = copy.copy(self.quantizer)
+        sample_size = min(count, max(quantizer.min_train_size, 65536))
+        rows = np.sort(np.random.default_rng(0).choice(count, sample_size, replace=False))
+        quantizer.train(np.asarray(vectors[rows]))
+
+        codes = np.empty((count, quantizer.code_size), dtype=quantizer.code_dtype)
+        with open(self._codes_file + ".tmp", "wb") as f:
+            for start in range(0, count, CODE_BLOCK_ROWS):
+                end = min(start + CODE_BLOCK_ROWS, count)
+                codes[start:end] = quantizer.encode(np.asarray(vectors[start:end]))
+                f.write(codes[start:end].tobytes())
+        return quantizer, codes
+
+    def install(self, state):
+        """切换到训练好的量化器，并编码训练期间追加的向量"""
+        quantizer, codes = state
+        with self._lock:
+            os.replace(self._codes_file + ".tmp", self._codes_file)
+            tmp = os.path.join(self.path, "quantizer.tmp.npz")
+            quantizer.save(tmp)
+            os.replace(tmp, self._quantizer_file)
+            self.quantizer = quantizer
+            self._codes = codes
+            self.encoded = len(codes)
+            self._encode_pending()
+
+    def _encode_pending(self):
+        count = self.store.count
+        self._reserve(count)
+        with open(self._codes_file, "r+b" if os.path.exists(self._codes_file) else "wb") as f:
+            row_bytes = self.quantizer.code_size * np.dtype(self.quantizer.code_dtype).itemsize
+            f.truncate(self.encoded * row_bytes)
+            f.seek(self.encoded * row_bytes)
+            for start in range(self.encoded, count, CODE_BLOCK_ROWS):
+                end = min(start + CODE_BLOCK_ROWS, count)
+                codes = self.quantizer.encode(np.asarray(self.store.vectors[start:end]))
+                self._codes[start:end] = codes
+                f.write(codes.tobytes())
+
+        self.encoded = count
+        tmp = self._meta_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"encoded": self.encoded, "quantizer": self.quantizer.name}, f)
+        os.replace(tmp, self._meta_file)
+
+    def search(
+        self,
+        query_vector,
+        top_k: int = 5,
+        document_ids: List[int] = None,
+        ef_search: int = None,
+        nprobe: int = None
+    ) -> List[Tuple[int, float]]:
+        """压缩码粗排取 top_k*rerank_factor 个候选，再用原始向量精排"""
+        query = normalize(query_vector).reshape(-1)
+        with self._lock:
+            store = self.store
+            if store.count == 0 or top_k <= 0:
+                return []
+
+            if not self.quantizer.is_trained:
+                hits = store.exact_search(query, top_k, store.candidate_rows(document_ids))
+                return [(int(store.chunk_ids[r]), s) for r, s in hits]
+
+            mask = store.deleted == 0
+            if document_ids:
+                mask &= np.isin(store.document_ids, document_ids)
+                if mask.sum() <= FILTER_EXACT_LIMIT:
+                    hits = store.exact_search(query, top_k, np.flatnonzero(mask))
+                    return [(int(store.chunk_ids[r]), s) for r, s in hits]
+
+            # 分块扫描压缩码（连续切片，无需gather）
+            state = self.quantizer.prepare(query)
+            approx = np.empty(self.encoded, dtype=np.float32)
+            for start in range(0, self.encoded, CODE_BLOCK_ROWS):
+                end = min(start + CODE_BLOCK_ROWS, self.encoded)
+                approx[start:end] = self.quantizer.scan(self._codes[start:end], state)
+            approx[~mask] = -np.inf
+
+            live = int(mask.sum())
+            if live == 0:
+                return []
+            shortlist_size = min(top_k * self.rerank_factor, live)
+            shortlist = np.argpartition(-approx, shortlist_size - 1)[:shortlist_size]
+
+            # 只从磁盘读取候选行的原始向量精排
+            hits = store.exact_search(query, top_k, np.sort(shortlist))
+            return [(int(store.chunk_ids[r]), s) for r, s in hits]
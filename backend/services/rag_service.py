@@ -3,81 +3,144 @@ RAG核心服务（简化版）
 集成：百度千帆API + 关键词搜索 + 内存缓存 + 长期记忆
 """
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple, Set
 from datetime import datetime, timedelta
-import requests
+import asyncio
 import json
 import time
 import re
-from collections import defaultdict
+import math
+import heapq
+import hashlib
+import numpy as np
+from collections import defaultdict, Counter
+from sqlalchemy import select, insert, update, delete, func
 
 from core.config import settings
+from core.database import AsyncSessionLocal
+from core.http import get_http_client, request_timeout
+from models.chunk import DocumentChunk, ChunkPosting, KeywordIndexStats
+from services.tokenizer import tokenize, estimate_tokens
+from services.vector_index import get_vector_index
+from services.fusion import reciprocal_rank_fusion, weighted_score_fusion
+from services.embedding_pipeline import EmbeddingPipeline, EmbeddingCache
+from services.cache import search_cache
+from services.context_builder import ContextBuilder, source_label
+from services.chunker import chunk_hash
+from services.token_manager import qianfan_token
+from services.llm_gateway import chat_gateway, LLMError, RateLimitedError, RATE_LIMIT_ERROR_CODES
+
+# 按ID批量删除时每条语句的ID数（SQLite单条语句的参数个数有上限）
+ID_BATCH_SIZE = 500
 
 
 class BaiduAuth:
-    """百度千帆OAuth 2.0认证"""
-
-    _access_token = None
-    _token_expires_at = 0
+    """百度千帆OAuth 2.0认证（令牌由 AccessTokenManager 统一管理）"""
 
     @classmethod
-    def get_access_token(cls) -> str:
-        """获取访问令牌（自动刷新）"""
-        now = int(time.time())
-
-        # 如果令牌还有效，直接返回
-        if cls._access_token and now < cls._token_expires_at - 60:
-            return cls._access_token
-
-        # 获取新令牌
-        url = settings.BAIYUN_AUTH_URL
-        params = {
-            "grant_type": "client_credentials",
-            "client_id": settings.BAIYUN_ACCESS_KEY,
-            "client_secret": settings.BAIYUN_SECRET_KEY
-        }
+    async def get_access_token(cls) -> str:
+        """获取访问令牌（单飞刷新，到期前后台刷新）"""
+        return await qianfan_token.get_token()
 
-        try:
-            response = requests.post(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
 
-            cls._access_token = data.get("access_token")
-            expires_in = data.get("expires_in", 2592000)
-            cls._token_expires_at = now + expires_in
+class BaiduEmbedding:
+    """百度千帆嵌入模型"""
 
-            print(f"✅ 百度千帆Access Token刷新成功")
-            return cls._access_token
+    # 千帆Embedding接口单次最多16条文本
+    MAX_BATCH_SIZE = 16
 
-        except Exception as e:
-            print(f"❌ 百度千帆认证失败: {e}")
-            raise
+    def __init__(self):
+        self.api_url = settings.EMBEDDING_API_BASE
+        self.engine = settings.EMBEDDING_MODEL
+        self.dimension = settings.MILVUS_DIMENSION
+        self.batch_size = min(settings.EMBEDDING_BATCH_SIZE, self.MAX_BATCH_SIZE)
 
+    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """批量生成文档向量（顺序分批；大批量请使用EmbeddingPipeline）"""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(await self.embed_batch(texts[start:start + self.batch_size]))
+        return vectors
 
-class BaiduEmbedding:
-    """百度千帆嵌入模型（暂时禁用，使用占位）"""
+    async def embed_query(self, text: str) -> List[float]:
+        """生成查询向量"""
+        return (await self.embed_batch([text]))[0]
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """单次接口调用（不超过batch_size条）"""
+        access_token = await BaiduAuth.get_access_token()
+        url = f"{self.api_url}?access_token={access_token}"
+
+        response = await get_http_client().post(
+            url, json={"input": texts}, timeout=request_timeout(settings.EMBEDDING_TIMEOUT)
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        if "error_code" in data:
+            raise RuntimeError(f"Embedding API错误: {data.get('error_msg', '未知错误')}")
+
+        items = sorted(data.get("data", []), key=lambda item: item.get("index", 0))
+        vectors = [item["embedding"] for item in items]
+
+        if len(vectors) != len(texts):
+            raise RuntimeError(f"Embedding API返回数量不匹配: {len(vectors)}/{len(texts)}")
+        if vectors and len(vectors[0]) != self.dimension:
+            raise ValueError(
+                f"Embedding维度 {len(vectors[0])} 与 MILVUS_DIMENSION={self.dimension} 不一致"
+            )
+
+        return vectors
+
+
+class HashingEmbedding:
+    """本地哈希嵌入（特征哈希，确定性、无需网络，用于离线环境和测试）
+
+    每个词元哈希到一个维度并带±1符号，词频累加后L2归一化
+    """
 
     def __init__(self):
-        self.api_url = settings.EMBEDDING_API_BASE
-        self.engine = settings.EMBEDDING_MODEL
+        self.engine = "hashing-v1"
         self.dimension = settings.MILVUS_DIMENSION
+        self.batch_size = settings.EMBEDDING_BATCH_SIZE
 
     async def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """批量生成文档向量（暂未实现，返回零向量）"""
-        # 简化版：不使用向量搜索
-        return [[0.0] * self.dimension] * len(texts)
+        return [self._embed(text) for text in texts]
 
     async def embed_query(self, text: str) -> List[float]:
-        """生成查询向量（暂未实现，返回零向量）"""
-        return [0.0] * self.dimension
+        return self._embed(text)
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in tokenize(text):
+            digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dimension] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+
+def create_embedding():
+    """按 EMBEDDING_PROVIDER 创建嵌入模型"""
+    if settings.EMBEDDING_PROVIDER == "hashing":
+        return HashingEmbedding()
+    return BaiduEmbedding()
 
 
 class BaiduChat:
-    """百度千帆对话模型（Coding Plan Lite）"""
+    """百度千帆对话模型（Coding Plan Lite）
+
+    所有调用经过 chat_gateway 准入控制；失败时抛出异常，由接口层返回错误，不作为回复内容
+    """
 
     def __init__(self):
         self.api_url = f"{settings.BAIYUN_API_BASE}/chat/{settings.CHAT_MODEL}"
         self.model = settings.CHAT_MODEL
+        self.gateway = chat_gateway
 
     async def chat(
         self,
@@ -86,79 +149,300 @@ class BaiduChat:
         max_tokens: int = 2000
     ) -> str:
         """对话生成"""
-        try:
-            access_token = BaiduAuth.get_access_token()
+        async with self.gateway.slot():
+            access_token = await BaiduAuth.get_access_token()
 
             headers = {
                 "Content-Type": "application/json"
             }
 
-            payload = {
-                "messages": messages,
-                "temperature": temperature,
-                "top_p": 0.8,
-                "penalty_score": 1.0,
-                "disable_search": False,
-                "enable_citation": False
-            }
+            payload = self._payload(messages, temperature)
 
             url = f"{self.api_url}?access_token={access_token}"
 
-            response = requests.post(url, headers=headers, json=payload, timeout=60)
+            response = await get_http_client().post(
+                url, headers=headers, json=payload, timeout=request_timeout(settings.CHAT_TIMEOUT)
+            )
             response.raise_for_status()
 
             data = response.json()
+            self._check_error(data)
 
-            if "error_code" in data:
-                error_msg = data.get("error_msg", "未知错误")
-                print(f"❌ Chat API错误: {error_msg}")
-                return f"抱歉，AI回复生成失败：{error_msg}"
-
-            result = data.get("result", "")
-            return result
+            return data.get("result", "")
 
-        except Exception as e:
-            print(f"❌ Chat API调用失败: {e}")
-            return f"抱歉，AI回复生成失败：{str(e)}"
+    async def stream_chat(
+        self,
+        messages: List[Dict],
+        temperature: float = 0.7
+    ) -> AsyncIterator[str]:
+        """流式对话生成（stream=true），逐段返回增量文本；失败时抛出异常"""
+        async with self.gateway.slot() as lease:
+            access_token = await BaiduAuth.get_access_token()
+            url = f"{self.api_url}?access_token={access_token}"
+            payload = {**self._payload(messages, temperature), "stream": True}
+
+            async with get_http_client().stream(
+                "POST", url, json=payload, timeout=request_timeout(settings.CHAT_TIMEOUT)
+            ) as response:
+                response.raise_for_status()
+
+                # 出错时接口直接返回JSON而不是事件流
+                if response.headers.get("content-type", "").startswith("application/json"):
+                    self._check_error(json.loads(await response.aread()))
+
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = json.loads(line[5:])
+                    self._check_error(data)
+                    if data.get("result"):
+                        # 首个token的时间作为网关的延迟信号
+                        lease.mark_first_token()
+                        yield data["result"]
+                    if data.get("is_end"):
+                        break
+
+    @staticmethod
+    def _check_error(data: Dict):
+        """接口返回错误码时抛出异常（限流错误单独区分，供网关调整并发）"""
+        if "error_code" not in data:
+            return
+        error_msg = data.get("error_msg", "未知错误")
+        print(f"❌ Chat API错误: {error_msg}")
+        if data["error_code"] in RATE_LIMIT_ERROR_CODES:
+            raise RateLimitedError(f"Chat API限流: {error_msg}")
+        raise LLMError(f"Chat API错误: {error_msg}")
+
+    @staticmethod
+    def _payload(messages: List[Dict], temperature: float) -> Dict[str, Any]:
+        return {
+            "messages": messages,
+            "temperature": temperature,
+            "top_p": 0.8,
+            "penalty_score": 1.0,
+            "disable_search": False,
+            "enable_citation": False
+        }
 
 
-class SimpleMemoryCache:
-    """简单的内存缓存"""
+class KeywordSearchService:
+    """关键词搜索服务（BM25倒排索引，替代Milvus）"""
 
-    def __init__(self):
-        self.cache = {}
+    def __init__(self, db):
+        self.db = db
+        self.cache = search_cache
+        self.k1 = settings.BM25_K1
+        self.b = settings.BM25_B
 
-    def get(self, key):
-        return self.cache.get(key)
+    async def insert_chunks(
+        self,
+        chunks: List[Dict[str, Any]]
+    ) -> List[int]:
+        """存储文档块到数据库并写入倒排索引
 
-    def set(self, key, value, expire_seconds=None):
-        self.cache[key] = value
+        chunks中每项包含 user_id/document_id/file_name/content/chunk_index（可选 page_start/page_end/content_hash），
+        返回新建文档块的ID列表（与输入顺序一致）
+        """
+        if not chunks:
+            return []
+
+        rows = []
+        term_freqs = []
+        for idx, chunk in enumerate(chunks):
+            tf = Counter(tokenize(chunk["content"]))
+            term_freqs.append(tf)
+            rows.append(DocumentChunk(
+                user_id=chunk["user_id"],
+                document_id=chunk["document_id"],
+                chunk_index=chunk.get("chunk_index", idx),
+                page_start=chunk.get("page_start"),
+                page_end=chunk.get("page_end"),
+                file_name=chunk["file_name"],
+                content=chunk["content"],
+                content_hash=chunk.get("content_hash") or chunk_hash(chunk["content"]),
+                length=sum(tf.values())
+            ))
+
+        self.db.add_all(rows)
+        await self.db.flush()
+
+        # 批量写入倒排链
+        postings = [
+            {
+                "user_id": row.user_id,
+                "term": term,
+                "chunk_id": row.id,
+                "document_id": row.document_id,
+                "tf": freq,
+                "doc_len": row.length
+            }
+            for row, tf in zip(rows, term_freqs)
+            for term, freq in tf.items()
+        ]
+        if postings:
+            await self.db.execute(insert(ChunkPosting), postings)
 
-    def delete(self, key):
-        self.cache.pop(key, None)
+        # 更新BM25全局统计
+        per_user = defaultdict(lambda: [0, 0])
+        for row in rows:
+            per_user[row.user_id][0] += 1
+            per_user[row.user_id][1] += row.length
+        for user_id, (count, length) in per_user.items():
+            await self._update_stats(user_id, count, length)
 
-    def clear_pattern(self, pattern):
-        keys_to_delete = [k for k in self.cache.keys() if pattern in k]
-        for k in keys_to_delete:
-            del self.cache[k]
+        await self.db.commit()
+        for user_id in per_user:
+            await self.cache.bump_generation(user_id)
+
+        print(f"✅ 存储 {len(rows)} 个文档块到数据库（{len(postings)} 条倒排记录）")
+        return [row.id for row in rows]
+
+    async def delete_document(self, document_id: int, user_id: int) -> int:
+        """删除文档的所有文档块及倒排记录"""
+        result = await self.db.execute(
+            select(func.count(DocumentChunk.id), func.sum(DocumentChunk.length)).where(
+                DocumentChunk.document_id == document_id,
+                DocumentChunk.user_id == user_id
+            )
+        )
+        count, length = result.one()
+        if not count:
+            return 0
 
+        await self.db.execute(
+            delete(ChunkPosting).where(
+                ChunkPosting.user_id == user_id,
+                ChunkPosting.document_id == document_id
+            )
+        )
+        await self.db.execute(
+            delete(DocumentChunk).where(
+                DocumentChunk.document_id == document_id,
+                DocumentChunk.user_id == user_id
+            )
+        )
+        await self._update_stats(user_id, -count, -(length or 0))
+        await self.db.commit()
+        await self.cache.bump_generation(user_id)
 
-class KeywordSearchService:
-    """关键词搜索服务（替代Milvus）"""
+        return count
 
-    def __init__(self, db):
-        self.db = db
-        self.cache = SimpleMemoryCache()
+    async def delete_chunks(self, user_id: int, chunk_ids: List[int]) -> int:
+        """删除指定的文档块及其倒排记录（文档新版本中已不存在的块）"""
+        removed = 0
+        for start in range(0, len(chunk_ids), ID_BATCH_SIZE):
+            batch = chunk_ids[start:start + ID_BATCH_SIZE]
+            result = await self.db.execute(
+                select(func.count(DocumentChunk.id), func.sum(DocumentChunk.length)).where(
+                    DocumentChunk.user_id == user_id,
+                    DocumentChunk.id.in_(batch)
+                )
+            )
+            count, length = result.one()
+            if not count:
+                continue
+
+            await self.db.execute(
+                delete(ChunkPosting).where(
+                    ChunkPosting.user_id == user_id,
+                    ChunkPosting.chunk_id.in_(batch)
+                )
+            )
+            await self.db.execute(
+                delete(DocumentChunk).where(
+                    DocumentChunk.user_id == user_id,
+                    DocumentChunk.id.in_(batch)
+                )
+            )
+            await self._update_stats(user_id, -count, -(length or 0))
+            removed += count
 
-    async def insert_chunks(
-        self,
-        chunks: List[Dict[str, Any]]
-    ) -> int:
-        """存储文档块到数据库"""
-        # 文档块已经存储在PostgreSQL/MongoDB中
-        # 这里只是记录插入成功
-        print(f"✅ 存储 {len(chunks)} 个文档块到数据库")
-        return len(chunks)
+        await self.db.commit()
+        if removed:
+            await self.cache.bump_generation(user_id)
+        return removed
+
+    async def update_chunks(self, user_id: int, updates: List[Dict[str, Any]]):
+        """更新未变化文档块的位置信息（序号/页码/文件名），倒排记录不变
+
+        updates中每项包含 id 以及要更新的列
+        """
+        if not updates:
+            return
+        await self.db.execute(update(DocumentChunk), updates)
+        await self.db.commit()
+        await self.cache.bump_generation(user_id)
+
+    async def get_document_chunks(self, document_id: int, user_id: int) -> List[Any]:
+        """文档现有块的清单（不含内容）：id/content_hash/chunk_index/page_start/page_end/file_name"""
+        result = await self.db.execute(
+            select(
+                DocumentChunk.id,
+                DocumentChunk.content_hash,
+                DocumentChunk.chunk_index,
+                DocumentChunk.page_start,
+                DocumentChunk.page_end,
+                DocumentChunk.file_name
+            )
+            .where(DocumentChunk.document_id == document_id, DocumentChunk.user_id == user_id)
+            .order_by(DocumentChunk.chunk_index)
+        )
+        return result.all()
+
+    async def _load_statistics(self, user_id: int, keywords: List[str]) -> tuple:
+        """读取BM25统计：(文档块数, 总长度, {词: 文档频率})
+
+        统计量与各词的文档频率随用户代数缓存，一次批量读取；只对未命中的部分查库
+        """
+        stats_key = await self.cache.user_key(user_id, "bm25_stats")
+        term_keys = {term: await self.cache.user_key(user_id, "df", term) for term in keywords}
+        cached = await self.cache.get_many([stats_key, *term_keys.values()])
+        fresh = {}
+
+        stats = cached.get(stats_key)
+        if stats is None:
+            row = await self.db.get(KeywordIndexStats, user_id)
+            stats = [row.chunk_count, row.total_length] if row else [0, 0]
+            fresh[stats_key] = stats
+
+        doc_freqs = {term: cached[key] for term, key in term_keys.items() if key in cached}
+        missing = [term for term in keywords if term not in doc_freqs]
+        if missing and stats[0] > 0:
+            # 文档频率按整个用户分区统计，不受文档过滤影响
+            result = await self.db.execute(
+                select(ChunkPosting.term, func.count())
+                .where(ChunkPosting.user_id == user_id, ChunkPosting.term.in_(missing))
+                .group_by(ChunkPosting.term)
+            )
+            counted = dict(result.all())
+            for term in missing:
+                doc_freqs[term] = counted.get(term, 0)
+                fresh[term_keys[term]] = doc_freqs[term]
+
+        if fresh:
+            await self.cache.set_many(fresh)
+
+        total, total_length = stats
+        return total, total_length, {term: df for term, df in doc_freqs.items() if df > 0}
+
+    async def _update_stats(self, user_id: int, chunk_delta: int, length_delta: int):
+        """增量更新用户的文档块数与总长度"""
+        result = await self.db.execute(
+            update(KeywordIndexStats)
+            .where(KeywordIndexStats.user_id == user_id)
+            .values(
+                chunk_count=KeywordIndexStats.chunk_count + chunk_delta,
+                total_length=KeywordIndexStats.total_length + length_delta,
+                updated_at=datetime.utcnow()
+            )
+        )
+        if result.rowcount == 0:
+            self.db.add(KeywordIndexStats(
+                user_id=user_id,
+                chunk_count=max(chunk_delta, 0),
+                total_length=max(length_delta, 0)
+            ))
+            await self.db.flush()
 
     async def search(
         self,
@@ -167,27 +451,22 @@ class KeywordSearchService:
         top_k: int = 5,
         document_ids: List[int] = None
     ) -> List[Dict[str, Any]]:
-        """关键词搜索"""
+        """关键词搜索（BM25）"""
         # 提取查询中的关键词
         keywords = self._extract_keywords(query)
         print(f"🔍 关键词: {keywords}")
 
-        # 从数据库中搜索包含关键词的文档块
+        if not keywords:
+            return []
+
+        # 从倒排索引中检索并打分
         results = await self._search_in_database(keywords, user_id, document_ids, top_k)
 
         return results
 
     def _extract_keywords(self, text: str) -> List[str]:
-        """提取关键词"""
-        # 简单分词（中文+英文）
-        # 移除标点符号
-        text = re.sub(r'[^\w\s]', '', text)
-        # 按空格和中文分割
-        words = re.findall(r'[\w]+|[\u4e00-\u9fff]+', text)
-        # 过滤停用词（简化版）
-        stop_words = {'的', '了', '是', '在', '有', '和', '我', '你', '他', '这', '那', '什么', '怎么', '如何'}
-        keywords = [w for w in words if len(w) > 1 and w not in stop_words]
-        return keywords
+        """提取关键词（去重，保持顺序）"""
+        return list(dict.fromkeys(tokenize(text)))
 
     async def _search_in_database(
         self,
@@ -196,13 +475,67 @@ class KeywordSearchService:
         document_ids: List[int],
         top_k: int
     ) -> List[Dict[str, Any]]:
-        """在数据库中搜索"""
-        # 这里简化实现：直接返回空列表
-        # 实际应该查询数据库中的文档块
-        # 从models.document中查询文档，然后匹配内容
+        """在倒排索引中搜索，按BM25打分返回top_k"""
+        total, total_length, doc_freqs = await self._load_statistics(user_id, keywords)
+        if total <= 0 or not doc_freqs:
+            return []
 
-        print(f"⚠️  关键词搜索未完全实现，返回空结果")
-        return []
+        avg_len = (total_length / total) or 1.0
+
+        idf = {
+            term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for term, df in doc_freqs.items()
+        }
+
+        postings_query = select(
+            ChunkPosting.term,
+            ChunkPosting.chunk_id,
+            ChunkPosting.tf,
+            ChunkPosting.doc_len
+        ).where(
+            ChunkPosting.user_id == user_id,
+            ChunkPosting.term.in_(list(doc_freqs))
+        )
+        if document_ids:
+            postings_query = postings_query.where(ChunkPosting.document_id.in_(document_ids))
+
+        k1, b = self.k1, self.b
+        scores = defaultdict(float)
+        for term, chunk_id, tf, doc_len in (await self.db.execute(postings_query)).all():
+            norm = k1 * (1 - b + b * doc_len / avg_len)
+            scores[chunk_id] += idf[term] * tf * (k1 + 1) / (tf + norm)
+
+        top = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        if not top:
+            return []
+
+        # 只回表读取top_k个文档块内容
+        return await self.fetch_chunks(top)
+
+    async def fetch_chunks(self, scored_ids: List[tuple]) -> List[Dict[str, Any]]:
+        """按 [(chunk_id, score)] 顺序读取文档块内容"""
+        if not scored_ids:
+            return []
+
+        chunk_result = await self.db.execute(
+            select(DocumentChunk).where(DocumentChunk.id.in_([chunk_id for chunk_id, _ in scored_ids]))
+        )
+        chunks = {chunk.id: chunk for chunk in chunk_result.scalars().all()}
+
+        return [
+            {
+                "chunk_id": chunk_id,
+                "document_id": chunks[chunk_id].document_id,
+                "chunk_index": chunks[chunk_id].chunk_index,
+                "page_start": chunks[chunk_id].page_start,
+                "page_end": chunks[chunk_id].page_end,
+                "file_name": chunks[chunk_id].file_name,
+                "content": chunks[chunk_id].content,
+                "score": score
+            }
+            for chunk_id, score in scored_ids
+            if chunk_id in chunks
+        ]
 
 
 class RAGService:
@@ -210,70 +543,249 @@ class RAGService:
 
     def __init__(self, db):
         self.db = db
-        self.embedding = BaiduEmbedding()
-        self.chat = BaiduChat()
+        self.embedding = create_embedding()
+        self.embedding_pipeline = EmbeddingPipeline(self.embedding, EmbeddingCache(db))
+        self.llm = BaiduChat()
         self.search_service = KeywordSearchService(db) if not settings.ENABLE_MILVUS else None
-        self.cache = SimpleMemoryCache()
+        self.cache = search_cache
+        self.context_builder = ContextBuilder()
+        # 检索模式：keyword（BM25）/ vector（本地向量索引）/ hybrid（两路并发+融合）
+        self.retrieval_mode = settings.RETRIEVAL_MODE
+        self.use_local_vector = not settings.ENABLE_MILVUS and self.retrieval_mode in ("vector", "hybrid")
 
     async def index_document(
         self,
         document_id: int,
         user_id: int,
         file_name: str,
-        chunks: List[str]
+        chunks: List[str],
+        pages: List[Tuple[int, int]] = None,
+        chunk_indexes: List[int] = None,
+        content_hashes: List[str] = None
     ) -> int:
-        """索引文档"""
+        """索引文档块
+
+        pages 为分页文档每个块的起止页码；chunk_indexes 为各块在文档内的序号（默认从0连续编号）；
+        content_hashes 为各块内容哈希（未提供时计算）
+        """
         if not chunks:
             return 0
 
         print(f"📄 开始索引文档: {file_name} ({len(chunks)} 个chunks)")
 
-        # 简化版：只记录chunk数量，不生成向量
         chunk_data = [
             {
-                "chunk_id": int(hash(f"{document_id}_{idx}") % (10 ** 9)),
                 "user_id": user_id,
                 "document_id": document_id,
+                "chunk_index": chunk_indexes[idx] if chunk_indexes else idx,
+                "page_start": pages[idx][0] if pages else None,
+                "page_end": pages[idx][1] if pages else None,
                 "file_name": file_name,
-                "content": chunk
+                "content": chunk,
+                "content_hash": content_hashes[idx] if content_hashes else None
             }
             for idx, chunk in enumerate(chunks)
         ]
 
-        # 插入到搜索服务
-        count = await self.search_service.insert_chunks(chunk_data)
+        # 先生成向量：新向量写入缓存表后与文档块在同一事务中提交，生成失败时不留下任何文档块
+        vectors = await self.embedding_pipeline.embed(chunks) if self.use_local_vector else None
+
+        # 写入文档块表和倒排索引
+        chunk_ids = await self.search_service.insert_chunks(chunk_data)
+
+        # 写入本地向量索引
+        if self.use_local_vector:
+            index = get_vector_index(user_id)
+            await asyncio.to_thread(index.add, chunk_ids, [document_id] * len(chunk_ids), vectors)
 
         # 清除缓存
-        self._clear_search_cache(user_id)
+        await self._clear_search_cache(user_id)
+
+        return len(chunk_ids)
 
+    async def delete_document(self, document_id: int, user_id: int) -> int:
+        """从索引中删除文档"""
+        count = await self.search_service.delete_document(document_id, user_id)
+        if self.use_local_vector:
+            await asyncio.to_thread(get_vector_index(user_id).delete_document, document_id)
+        await self._clear_search_cache(user_id)
         return count
 
+    async def delete_chunks(self, user_id: int, chunk_ids: List[int]) -> int:
+        """从索引中删除指定文档块（关键词索引直接删除，向量索引标记墓碑）"""
+        if not chunk_ids:
+            return 0
+        count = await self.search_service.delete_chunks(user_id, chunk_ids)
+        if self.use_local_vector:
+            await asyncio.to_thread(get_vector_index(user_id).delete_chunks, chunk_ids)
+        await self._clear_search_cache(user_id)
+        return count
+
+    async def update_chunks(self, user_id: int, updates: List[Dict[str, Any]]):
+        """更新未变化文档块的位置信息（无需重新分词和计算向量）"""
+        await self.search_service.update_chunks(user_id, updates)
+        await self._clear_search_cache(user_id)
+
+    async def get_document_chunks(self, document_id: int, user_id: int) -> List[Any]:
+        return await self.search_service.get_document_chunks(document_id, user_id)
+
+    async def indexed_chunk_ids(self, user_id: int, chunk_ids: List[int]) -> Set[int]:
+        """chunk_ids 中索引完整的文档块（未启用本地向量索引时即全部；否则须已写入向量）"""
+        if not self.use_local_vector or not chunk_ids:
+            return set(chunk_ids)
+        return await asyncio.to_thread(get_vector_index(user_id).indexed_chunk_ids, chunk_ids)
+
     async def search(
         self,
         query: str,
         user_id: int,
         top_k: int = 5,
         document_ids: List[int] = None,
-        use_cache: bool = False
+        use_cache: bool = False,
+        ef_search: int = None,
+        nprobe: int = None
     ) -> List[Dict[str, Any]]:
-        """关键词检索"""
-        # 检查缓存
-        cache_key = f"search:{user_id}:{hash(query)}:{top_k}"
+        """文档检索（BM25关键词 / 本地向量 / 混合检索）
+
+        ef_search / nprobe 为ANN索引的单次查询召回/延迟参数，未指定时使用配置默认值
+        """
+        # 检查缓存（键包含用户代数，文档变化后旧结果自动失效）
+        params = json.dumps(
+            [self.retrieval_mode, query, top_k, sorted(document_ids or []), ef_search, nprobe],
+            ensure_ascii=False
+        )
+        cache_key = await self.cache.user_key(user_id, "search", hashlib.sha1(params.encode("utf-8")).hexdigest())
         if use_cache:
-            cached = self.cache.get(cache_key)
-            if cached:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
                 return cached
 
-        # 关键词搜索
-        results = await self.search_service.search(query, user_id, top_k, document_ids)
+        if self.use_local_vector and self.retrieval_mode == "hybrid":
+            # 混合检索
+            results = await self.hybrid_search(
+                query, user_id, top_k, document_ids, ef_search=ef_search, nprobe=nprobe
+            )
+        elif self.use_local_vector:
+            # 语义检索
+            results = await self.vector_search(
+                query, user_id, top_k, document_ids, ef_search=ef_search, nprobe=nprobe
+            )
+        else:
+            # 关键词搜索
+            results = await self.search_service.search(query, user_id, top_k, document_ids)
 
         # 缓存结果
         if use_cache:
-            self.cache.set(cache_key, results)
+            await self.cache.set(cache_key, results)
 
         print(f"🔍 搜索结果: 找到 {len(results)} 个匹配")
         return results
 
+    async def vector_search(
+        self,
+        query: str,
+        user_id: int,
+        top_k: int = 5,
+        document_ids: List[int] = None,
+        ef_search: int = None,
+        nprobe: int = None
+    ) -> List[Dict[str, Any]]:
+        """本地向量索引检索"""
+        hits = await self._vector_hits(query, user_id, top_k, document_ids, ef_search, nprobe)
+        return await self.search_service.fetch_chunks(hits)
+
+    async def _vector_hits(
+        self,
+        query: str,
+        user_id: int,
+        top_k: int,
+        document_ids: List[int],
+        ef_search: int = None,
+        nprobe: int = None
+    ) -> List[tuple]:
+        """向量检索，只返回 [(chunk_id, score)]，不访问数据库"""
+        query_vector = await self.embedding.embed_query(query)
+        hits = await asyncio.to_thread(
+            get_vector_index(user_id).search,
+            query_vector, top_k, document_ids, ef_search=ef_search, nprobe=nprobe
+        )
+        return [(chunk_id, score) for chunk_id, score in hits if score >= settings.SIMILARITY_THRESHOLD]
+
+    async def _keyword_hits(
+        self,
+        query: str,
+        user_id: int,
+        top_k: int,
+        document_ids: List[int]
+    ) -> List[Dict[str, Any]]:
+        """关键词检索（独立数据库会话，超时取消不影响请求会话）"""
+        async with AsyncSessionLocal() as session:
+            return await KeywordSearchService(session).search(query, user_id, top_k, document_ids)
+
+    async def hybrid_search(
+        self,
+        query: str,
+        user_id: int,
+        top_k: int = 5,
+        document_ids: List[int] = None,
+        ef_search: int = None,
+        nprobe: int = None
+    ) -> List[Dict[str, Any]]:
+        """混合检索：BM25与向量检索并发执行，结果按RRF或加权分数融合
+
+        每路检索有独立超时，超时或失败的一路按空结果处理，不会拖住整个对话
+        """
+        candidates = top_k * settings.HYBRID_CANDIDATE_FACTOR
+
+        keyword_results, vector_hits = await asyncio.gather(
+            self._with_timeout(
+                "关键词检索",
+                self._keyword_hits(query, user_id, candidates, document_ids),
+                settings.KEYWORD_SEARCH_TIMEOUT
+            ),
+            self._with_timeout(
+                "向量检索",
+                self._vector_hits(query, user_id, candidates, document_ids, ef_search, nprobe),
+                settings.VECTOR_SEARCH_TIMEOUT
+            )
+        )
+
+        ranked_lists = {
+            "keyword": [(r["chunk_id"], r["score"]) for r in keyword_results],
+            "vector": vector_hits
+        }
+        weights = {
+            "keyword": 1.0 - settings.HYBRID_VECTOR_WEIGHT,
+            "vector": settings.HYBRID_VECTOR_WEIGHT
+        }
+        if settings.FUSION_METHOD == "weighted":
+            fused = weighted_score_fusion(ranked_lists, weights)
+        else:
+            fused = reciprocal_rank_fusion(ranked_lists, k=settings.RRF_K, weights=weights)
+        fused = fused[:top_k]
+
+        # 关键词结果已带内容，只需回表读取仅由向量检索命中的文档块
+        known = {r["chunk_id"]: r for r in keyword_results}
+        missing = [(chunk_id, score) for chunk_id, score in fused if chunk_id not in known]
+        known.update({r["chunk_id"]: r for r in await self.search_service.fetch_chunks(missing)})
+
+        return [
+            {**known[chunk_id], "score": score}
+            for chunk_id, score in fused
+            if chunk_id in known
+        ]
+
+    @staticmethod
+    async def _with_timeout(name: str, coro, timeout: float) -> list:
+        """执行单路检索，超时或异常时返回空结果"""
+        try:
+            return await asyncio.wait_for(coro, timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️  {name}超时（{timeout}s），忽略该路结果")
+        except Exception as e:
+            print(f"⚠️  {name}失败: {e}")
+        return []
+
     async def chat(
         self,
         query: str,
@@ -281,18 +793,56 @@ class RAGService:
         conversation_history: List[Dict],
         user_prompt: str = "",
         document_ids: List[int] = None,
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        ef_search: int = None,
+        nprobe: int = None,
+        conversation_summary: str = None
     ) -> Dict[str, Any]:
         """RAG对话"""
+        prepared = await self.prepare_chat(
+            query, user_id, conversation_history, user_prompt, document_ids, ef_search, nprobe,
+            conversation_summary=conversation_summary
+        )
+
+        # 生成回复
+        print(f"💬 开始生成回复...")
+        response = await self.llm.chat(prepared["messages"], temperature)
+        print(f"✅ 回复生成完成")
+
+        return {
+            "response": response,
+            "sources": prepared["sources"],
+            "context": prepared["context"],
+            "usage": prepared["usage"]
+        }
+
+    async def prepare_chat(
+        self,
+        query: str,
+        user_id: int,
+        conversation_history: List[Dict],
+        user_prompt: str = "",
+        document_ids: List[int] = None,
+        ef_search: int = None,
+        nprobe: int = None,
+        conversation_summary: str = None
+    ) -> Dict[str, Any]:
+        """检索并构建对话消息（普通对话与流式对话共用），返回 messages / sources / context / usage
+
+        conversation_summary 为更早对话的滚动摘要，与最近的历史消息一起进入提示词
+        """
         # 1. 检索相关文档
-        search_results = await self.search(query, user_id, document_ids=document_ids)
+        search_results = await self.search(
+            query, user_id, document_ids=document_ids, use_cache=True, ef_search=ef_search, nprobe=nprobe
+        )
 
-        # 2. 构建上下文
+        # 2. 构建上下文（去重 + 按token预算装填）
+        search_results, context_tokens = self.context_builder.pack_sources(search_results)
         context = ""
         if search_results:
             context += "**以下是从文档中检索到的相关信息：**\n\n"
             for idx, result in enumerate(search_results, 1):
-                context += f"[来源{idx}] {result['file_name']}\n"
+                context += f"[来源{idx}] {source_label(result)}\n"
                 context += f"{result['content']}\n\n"
         else:
             context = "（文档检索未找到相关信息，基于我的知识库回答）"
@@ -301,6 +851,12 @@ class RAGService:
         if user_prompt:
             context += f"\n**用户补充说明：**\n{user_prompt}\n"
 
+        # 更早对话的摘要
+        summary_tokens = 0
+        if conversation_summary:
+            context += f"\n**更早的对话摘要：**\n{conversation_summary}\n"
+            summary_tokens = estimate_tokens(conversation_summary)
+
         # 4. 构建消息历史
         system_prompt = f"""你是一个专业的企业知识助手，擅长回答问题。
 
@@ -317,8 +873,9 @@ class RAGService:
 
         messages = [{"role": "system", "content": system_prompt}]
 
-        # 添加历史对话（最近10轮）
-        for msg in conversation_history[-10:]:
+        # 添加历史对话（从最新一轮向前，按token预算装填）
+        history, history_tokens = self.context_builder.pack_history(conversation_history)
+        for msg in history:
             messages.append({
                 "role": msg.get("role", "user"),
                 "content": msg.get("content", "")
@@ -327,26 +884,30 @@ class RAGService:
         # 添加当前问题
         messages.append({"role": "user", "content": query})
 
-        # 5. 生成回复
-        print(f"💬 开始生成回复...")
-        response = await self.chat.chat(messages, temperature)
-        print(f"✅ 回复生成完成")
-
         return {
-            "response": response,
+            "messages": messages,
             "sources": [
                 {
+                    "document_id": r.get("document_id"),
                     "file_name": r.get("file_name", "未知"),
+                    "page_start": r.get("page_start"),
+                    "page_end": r.get("page_end"),
                     "content": r.get("content", ""),
-                    "score": 1.0
+                    "score": round(r.get("score", 0.0), 4)
                 } for r in search_results
             ],
-            "context": context
+            "context": context,
+            "usage": {
+                "context_tokens": context_tokens,
+                "history_tokens": history_tokens,
+                "history_messages": len(history),
+                "summary_tokens": summary_tokens
+            }
         }
 
-    def _clear_search_cache(self, user_id: int):
-        """清除搜索缓存"""
-        self.cache.clear_pattern(f"search:{user_id}:")
+    async def _clear_search_cache(self, user_id: int):
+        """清除搜索缓存（递增用户代数，O(1)，通知所有worker）"""
+        await self.cache.bump_generation(user_id)
 
 
 class MemoryService:
@@ -0,0 +1,199 @@
+"""
+百度千帆Access Token管理
+支持：单飞刷新（并发请求只触发一次OAuth调用）+ 到期前后台刷新 + 多worker共享（Redis或本地文件）
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+from typing import Optional
+
+from core.config import settings
+from core.http import get_http_client, request_timeout
+from services.cache import search_cache
+
+# 令牌剩余有效期低于该值时视为失效，必须同步刷新
+EXPIRY_MARGIN = 60
+# 后台刷新失败后的重试间隔（秒）
+RETRY_INTERVAL = 30
+
+
+class AccessTokenManager:
+    """OAuth令牌管理器
+
+    - 令牌有效时直接返回；进入提前刷新窗口后在后台刷新，请求不等待
+    - 并发刷新合并为一个任务（单飞），所有调用方等待同一结果
+    - 刷新结果写入共享存储（ENABLE_REDIS时为Redis，否则为本地文件），
+      其他worker启动或刷新前先读取共享令牌，避免重复调用OAuth接口
+    """
+
+    def __init__(self, auth_url: str, client_id: str, client_secret: str, refresh_ahead: int, cache_file: str):
+        self.auth_url = auth_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_ahead = refresh_ahead
+        self.cache_file = cache_file
+        # 共享存储按凭据区分，更换API Key后不会读到旧令牌
+        self.fingerprint = hashlib.sha1(client_id.encode("utf-8")).hexdigest()[:16]
+
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+        self._refresher: Optional[asyncio.Task] = None
+
+        self.refresh_count = 0
+
+    @property
+    def redis_key(self) -> str:
+        return f"rag:qianfan_token:{self.fingerprint}"
+
+    def _is_valid(self) -> bool:
+        return bool(self._token) and time.time() < self._expires_at - EXPIRY_MARGIN
+
+    async def get_token(self) -> str:
+        """获取访问令牌"""
+        if not self._is_valid():
+            await self._load_shared()
+
+        if self._is_valid():
+            if time.time() >= self._refresh_at and self._inflight is None:
+                self._start_refresh()
+            return self._token
+
+        return await self.refresh()
+
+    async def refresh(self) -> str:
+        """刷新令牌（单飞：已有刷新任务时等待该任务）"""
+        return await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._inflight is None:
+            self._inflight = asyncio.create_task(self._fetch())
+            self._inflight.add_done_callback(self._on_refresh_done)
+        return self._inflight
+
+    def _on_refresh_done(self, task: asyncio.Task):
+        self._inflight = None
+        if not task.cancelled() and task.exception() is not None:
+            print(f"❌ 百度千帆认证失败: {task.exception()}")
+
+    async def _fetch(self) -> str:
+        # 其他worker可能已经刷新过
+        await self._load_shared()
+        if self._is_valid() and time.time() < self._refresh_at:
+            return self._token
+
+        params = {
+            "grant_type": "client_credentials",
+            "client_id": self.client_id,
+            "client_secret": self.client_secret
+        }
+        response = await get_http_client().post(
+            self.auth_url, params=params, timeout=request_timeout(settings.AUTH_TIMEOUT)
+        )
+        response.raise_for_status()
+        data = response.json()
+        if not data.get("access_token"):
+            raise RuntimeError(data.get("error_description") or data.get("error") or "未返回access_token")
+
+        now = time.time()
+        expires_in = data.get("expires_in", 2592000)
+        self._token = data["access_token"]
+        self._expires_at = now + expires_in
+        # 有效期较短时在一半时刻刷新
+        self._refresh_at = now + max(expires_in - self.refresh_ahead, expires_in / 2)
+        self.refresh_count += 1
+
+        await self._save_shared()
+        print(f"✅ 百度千帆Access Token刷新成功")
+        return self._token
+
+    def _adopt(self, state: Optional[dict]):
+        if not state or state.get("fingerprint") != self.fingerprint:
+            return
+        if state.get("expires_at", 0) > self._expires_at:
+            self._token = state["access_token"]
+            self._expires_at = state["expires_at"]
+            self._refresh_at = state["refresh_at"]
+
+    def _state(self) -> dict:
+        return {
+            "fingerprint": self.fingerprint,
+            "access_token": self._token,
+            "expires_at": self._expires_at,
+            "refresh_at": self._refresh_at
+        }
+
+    async def _load_shared(self):
+        try:
+            if search_cache.redis is not None:
+                raw = await search_cache.redis.get(self.redis_key)
+                self._adopt(json.loads(raw) if raw else None)
+            elif os.path.exists(self.cache_file):
+                with open(self.cache_file) as f:
+                    self._adopt(json.load(f))
+        except Exception as e:
+            print(f"⚠️  读取共享Access Token失败: {e}")
+
+    async def _save_shared(self):
+        try:
+            if search_cache.redis is not None:
+                ttl = max(int(self._expires_at - time.time()), 1)
+                await search_cache.redis.set(self.redis_key, json.dumps(self._state()), ex=ttl)
+            else:
+                # 先写临时文件再替换，其他worker不会读到半个文件
+                tmp = f"{self.cache_file}.{os.getpid()}.tmp"
+                with open(tmp, "w") as f:
+                    json.dump(self._state(), f)
+                os.chmod(tmp, 0o600)
+                os.replace(tmp, self.cache_file)
+        except Exception as e:
+            print(f"⚠️  保存共享Access Token失败: {e}")
+
+    async def start(self):
+        """启动后台刷新（应用启动时调用；未配置凭据时不启动）"""
+        if self.client_id and self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        for task in (self._refresher, self._inflight):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._refresher = None
+
+    async def _refresh_loop(self):
+        """在提前刷新时刻到达时刷新令牌，保证请求路径上不出现OAuth调用"""
+        while True:
+            try:
+                if not self._is_valid():
+                    await self._load_shared()
+                if not self._is_valid() or time.time() >= self._refresh_at:
+                    await self.refresh()
+                await asyncio.sleep(max(self._refresh_at - time.time(), 1))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await asyncio.sleep(RETRY_INTERVAL)
+
+    def stats(self) -> dict:
+        return {
+            "valid": self._is_valid(),
+            "expires_in": max(int(self._expires_at - time.time()), 0),
+            "refresh_count": self.refresh_count
+        }
+
+
+qianfan_token = AccessTokenManager(
+    auth_url=settings.BAIYUN_AUTH_URL,
+    client_id=settings.BAIYUN_ACCESS_KEY,
+    client_secret=settings.BAIYUN_SECRET_KEY,
+    refresh_ahead=settings.BAIYUN_TOKEN_REFRESH_AHEAD,
+    cache_file=settings.BAIYUN_TOKEN_CACHE_FILE
+)
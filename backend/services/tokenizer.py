@@ -0,0 +1,52 @@
+"""
+文本分词工具
+中英文混合：英文/数字按词切分，中文按相邻二字（bigram）切分
+"""
+
+import re
+import math
+from typing import List
+
+# 英文单词/数字 或 连续中文
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]+")
+
+# 中文字符及全角标点（估算token数时约1字1个token）
+_WIDE_CHAR_RE = re.compile(r"[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]")
+
+# 停用词（简化版）
+STOP_WORDS = {
+    '的', '了', '是', '在', '有', '和', '我', '你', '他', '这', '那',
+    '什么', '怎么', '如何', '我们', '你们', '他们', '一个', '可以',
+    'the', 'a', 'an', 'of', 'to', 'in', 'and', 'or', 'is', 'are', 'for', 'on'
+}
+
+# 过长的词（如哈希值、base64片段）不进入索引
+MAX_TOKEN_LENGTH = 64
+
+
+def _is_cjk(char: str) -> bool:
+    return '\u4e00' <= char <= '\u9fff'
+
+
+def tokenize(text: str) -> List[str]:
+    """分词（保留重复词，用于统计词频）"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        word = match.group()
+        if _is_cjk(word[0]):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        elif len(word) <= MAX_TOKEN_LENGTH:
+            tokens.append(word)
+
+    return [t for t in tokens if t not in STOP_WORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    """估算大模型token数：中文及全角标点约1字1个token，其余字符约4个1个token"""
+    if not text:
+        return 0
+    wide = len(_WIDE_CHAR_RE.findall(text))
+    return wide + math.ceil((len(text) - wide) / 4)
@@ -0,0 +1,254 @@
+"""
+断点续传上传（tus风格）
+创建会话 → 按偏移量分段追加（PATCH）→ 中断后查询已接收的偏移量继续 → 完成后进入普通上传流程
+
+- 追加的数据直接写入临时文件并增量计算SHA-256，完成时无需重新读取整个文件
+- 哈希中间状态只缓存在进程内存中；会话的数据由其他进程接收过（或服务重启）时，读取已接收部分重新计算
+- 同一会话同时只允许一个追加/完成请求（数据库中的短租约），偏移量不符时由客户端查询偏移量后重试
+- 请求中断时保留已写入的数据，下次从已接收的偏移量继续
+"""
+
+import os
+import uuid
+import asyncio
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple
+
+import aiofiles
+from sqlalchemy import select, update, delete, or_
+
+from core.config import settings
+from core.upload import ReceivedFile
+from models.upload import UploadSession
+
+# 单个追加/完成请求的租约时长（秒），客户端每段大小应远小于该时长内可传输的数据量
+LEASE_SECONDS = 600
+# 进程内缓存的哈希中间状态数（超出时淘汰最久未用的，再次追加时重新计算）
+MAX_CACHED_HASHERS = 256
+# 每次创建会话时顺带清理的过期会话数
+PURGE_BATCH_SIZE = 100
+HASH_READ_SIZE = 1024 * 1024
+
+# upload_id -> (已计算的字节数, 哈希对象)
+_hashers: "OrderedDict[str, Tuple[int, object]]" = OrderedDict()
+
+
+class UploadConflictError(Exception):
+    """偏移量与已接收的数据不符、会话正被其他请求写入或文件尚未上传完整"""
+
+    def __init__(self, message: str, offset: int):
+        super().__init__(message)
+        self.offset = offset
+
+
+class UploadTooLargeError(Exception):
+    """追加的数据超出创建会话时声明的文件大小"""
+
+
+def _cache_hasher(upload_id: str, offset: int, hasher):
+    _hashers[upload_id] = (offset, hasher)
+    _hashers.move_to_end(upload_id)
+    while len(_hashers) > MAX_CACHED_HASHERS:
+        _hashers.popitem(last=False)
+
+
+def _hash_prefix(path: str, length: int):
+    """计算文件前 length 字节的哈希，返回 (哈希对象, 实际读取的字节数)（文件不足 length 时小于 length）"""
+    hasher = hashlib.sha256()
+    hashed = 0
+    try:
+        with open(path, "rb") as f:
+            while hashed < length:
+                data = f.read(min(HASH_READ_SIZE, length - hashed))
+                if not data:
+                    break
+                hasher.update(data)
+                hashed += len(data)
+    except FileNotFoundError:
+        pass
+    return hasher, hashed
+
+
+class UploadSessionService:
+    """上传会话管理"""
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def temp_path(upload_id: str) -> str:
+        # 与文件存储在同一目录树下（完成后以硬链接放入存储目录）
+        return os.path.join(settings.UPLOAD_DIR, f".resumable-{upload_id}.part")
+
+    async def create(self, user_id: int, filename: str, size: int, doc_key: str = None) -> UploadSession:
+        """创建上传会话（同时清理过期的会话）"""
+        await self.purge_expired()
+
+        now = datetime.utcnow()
+        session = UploadSession(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            filename=filename,
+            doc_key=doc_key,
+            size=size,
+            expires_at=now + timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+        )
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        async with aiofiles.open(self.temp_path(session.id), "wb"):
+            pass
+
+        self.db.add(session)
+        await self.db.commit()
+        await self.db.refresh(session)
+        return session
+
+    async def get(self, upload_id: str, user_id: int) -> Optional[UploadSession]:
+        """获取用户未过期的上传会话"""
+        result = await self.db.execute(
+            select(UploadSession).where(
+                UploadSession.id == upload_id,
+                UploadSession.user_id == user_id,
+                UploadSession.expires_at > datetime.utcnow()
+            )
+        )
+        return result.scalar_one_or_none()
+
+    async def append(self, session: UploadSession, offset: int, stream: AsyncIterator[bytes]) -> int:
+        """从 offset 起追加数据（须等于已接收的字节数），返回新的偏移量
+
+        数据超出声明的大小时抛出 UploadTooLargeError，超出前的部分仍然保留
+        """
+        upload_id, size = session.id, session.size
+        lease = await self._claim(upload_id, offset)
+        path = self.temp_path(upload_id)
+        written = 0
+        hasher = None
+        try:
+            hasher = await self._hasher(upload_id, path, offset, lease)
+
+            # 截掉上次中断时可能残留的未确认数据
+            async with aiofiles.open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                await f.seek(offset)
+                await f.truncate()
+                async for chunk in stream:
+                    if offset + written + len(chunk) > size:
+                        raise UploadTooLargeError(f"数据超出声明的文件大小（{size} 字节）")
+                    await f.write(chunk)
+                    hasher.update(chunk)
+                    written += len(chunk)
+        finally:
+            if hasher is not None and await self._release(upload_id, lease, offset + written):
+                _cache_hasher(upload_id, offset + written, hasher)
+
+        return offset + written
+
+    async def complete(self, session: UploadSession, ingest: Callable[[ReceivedFile], Awaitable]):
+        """文件接收完整后交给 ingest（普通上传流程）处理，成功后删除会话，返回 ingest 的结果
+
+        ingest 失败时保留会话和已接收的文件，客户端可以重试完成或取消上传
+        """
+        upload_id, size = session.id, session.size
+        if session.offset != size:
+            raise UploadConflictError(f"文件尚未上传完整（已接收 {session.offset} / {size} 字节）", session.offset)
+
+        lease = await self._claim(upload_id, size)
+        try:
+            hasher = await self._hasher(upload_id, self.temp_path(upload_id), size, lease)
+            upload = ReceivedFile(
+                path=self.temp_path(upload_id),
+                filename=session.filename,
+                content_type="application/octet-stream",
+                size=size,
+                sha256=hasher.hexdigest(),
+                fields={"doc_key": session.doc_key} if session.doc_key else {}
+            )
+            result = await ingest(upload)
+        except BaseException:
+            await self._release(upload_id, lease, size)
+            raise
+
+        _hashers.pop(upload_id, None)
+        await self.db.execute(delete(UploadSession).where(UploadSession.id == upload_id))
+        await self.db.commit()
+        return result
+
+    async def abort(self, session: UploadSession):
+        """取消上传：删除会话和已接收的数据"""
+        await self._remove([session.id])
+
+    async def purge_expired(self) -> int:
+        """清理过期的会话（客户端放弃的上传）"""
+        result = await self.db.execute(
+            select(UploadSession.id)
+            .where(UploadSession.expires_at <= datetime.utcnow())
+            .limit(PURGE_BATCH_SIZE)
+        )
+        upload_ids = result.scalars().all()
+        if upload_ids:
+            await self._remove(upload_ids)
+            print(f"🧹 已清理过期的上传会话: {len(upload_ids)} 个")
+        return len(upload_ids)
+
+    async def _remove(self, upload_ids):
+        await self.db.execute(delete(UploadSession).where(UploadSession.id.in_(upload_ids)))
+        await self.db.commit()
+        for upload_id in upload_ids:
+            _hashers.pop(upload_id, None)
+            path = self.temp_path(upload_id)
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def _claim(self, upload_id: str, offset: int) -> datetime:
+        """独占会话（偏移量相符且没有其他请求在写入），返回租约到期时间（释放时作为凭证）"""
+        now = datetime.utcnow()
+        lease = now + timedelta(seconds=LEASE_SECONDS)
+        result = await self.db.execute(
+            update(UploadSession)
+            .where(
+                UploadSession.id == upload_id,
+                UploadSession.offset == offset,
+                or_(UploadSession.lease_expires_at.is_(None), UploadSession.lease_expires_at < now)
+            )
+            .values(lease_expires_at=lease, updated_at=now)
+        )
+        await self.db.commit()
+        if not result.rowcount:
+            current = (await self.db.execute(
+                select(UploadSession.offset).where(UploadSession.id == upload_id)
+            )).scalar()
+            raise UploadConflictError("偏移量与已接收的数据不符或上传正在进行中，请查询偏移量后重试", current or 0)
+        return lease
+
+    async def _release(self, upload_id: str, lease: datetime, offset: int) -> bool:
+        """记录偏移量并释放会话，返回租约是否仍然有效（已过期被其他请求接管时不覆盖其结果）"""
+        now = datetime.utcnow()
+        result = await self.db.execute(
+            update(UploadSession)
+            .where(UploadSession.id == upload_id, UploadSession.lease_expires_at == lease)
+            .values(
+                offset=offset,
+                lease_expires_at=None,
+                updated_at=now,
+                expires_at=now + timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+            )
+        )
+        await self.db.commit()
+        return bool(result.rowcount)
+
+    async def _hasher(self, upload_id: str, path: str, offset: int, lease: datetime):
+        """取得前 offset 字节的哈希中间状态（进程内没有时读取文件重新计算）
+
+        已接收的数据丢失（临时文件被删除或截断）时退回到实际长度，抛出 UploadConflictError
+        """
+        cached = _hashers.pop(upload_id, None)
+        if cached and cached[0] == offset and os.path.exists(path) and os.path.getsize(path) >= offset:
+            return cached[1]
+
+        hasher, hashed = await asyncio.to_thread(_hash_prefix, path, offset)
+        if hashed < offset:
+            await self._release(upload_id, lease, hashed)
+            _cache_hasher(upload_id, hashed, hasher)
+            raise UploadConflictError(f"部分已接收的数据丢失，请从偏移量 {hashed} 继续上传", hashed)
+        return hasher
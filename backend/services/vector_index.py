@@ -0,0 +1,504 @@
+"""
+本地向量索引（NumPy）
+ENABLE_MILVUS关闭时提供单机语义检索：每个用户一个L2归一化的float32矩阵
+"""
+
+import os
+import json
+import uuid
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Tuple, Set
+
+try:
+    import fcntl
+except ImportError:  # Windows：不支持跨进程文件锁，仅支持单进程读写
+    fcntl = None
+
+import numpy as np
+
+from core.config import settings
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行L2归一化（零向量保持为零）"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class LocalVectorIndex:
+    """单个用户的向量索引
+
+    向量按行存放在一块连续的float32缓冲区中（容量倍增），
+    行号通过 chunk_ids / document_ids 映射回文档块
+
+    持久化为定长记录的裸二进制文件（每列一个文件），写入量与本次变化的行数成正比：
+    - 添加：追加到文件末尾，flat.json 中的 count 是已提交的行数（崩溃遗留的尾部数据在下次追加前截掉）
+    - 删除：只在 deleted 列原地写墓碑，检索时跳过
+    - 压缩：墓碑超过一半时把存活的行写成新一代文件，替换 flat.json 后删除旧文件（摊还O(1)）
+    """
+
+    # 行数少于该值时不压缩
+    COMPACT_MIN_ROWS = 1024
+
+    def __init__(self, user_id: int, dimension: int, index_dir: str):
+        self.user_id = user_id
+        self.dimension = dimension
+        self.path = os.path.join(index_dir, f"user_{user_id}")
+        self.rows = 0  # 含已删除的行
+        self.deleted_count = 0
+        self.generation = 0
+        self._vectors = np.empty((0, dimension), dtype=np.float32)
+        self._chunk_ids = np.empty(0, dtype=np.int64)
+        self._document_ids = np.empty(0, dtype=np.int64)
+        self._deleted = np.empty(0, dtype=np.uint8)
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def has_data(path: str) -> bool:
+        """目录中是否有flat索引（含旧版 .npy 格式）"""
+        return any(os.path.exists(os.path.join(path, name)) for name in ("flat.json", "vectors.npy"))
+
+    @property
+    def size(self) -> int:
+        """存活的向量数"""
+        return self.rows - self.deleted_count
+
+    @property
+    def _live(self):
+        return slice(None, self.rows) if not self.deleted_count else self._deleted[:self.rows] == 0
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:self.rows][self._live]
+
+    @property
+    def chunk_ids(self) -> np.ndarray:
+        return self._chunk_ids[:self.rows][self._live]
+
+    @property
+    def document_ids(self) -> np.ndarray:
+        return self._document_ids[:self.rows][self._live]
+
+    def add(self, chunk_ids: List[int], document_ids: List[int], vectors) -> int:
+        """添加向量（自动归一化）"""
+        vectors = normalize(vectors)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimension:
+            raise ValueError(f"向量维度不匹配: 期望 {self.dimension}, 实际 {vectors.shape[-1]}")
+
+        count = len(vectors)
+        if count == 0:
+            return 0
+
+        with self._lock:
+            self._reserve(self.rows + count)
+            start, end = self.rows, self.rows + count
+            self._vectors[start:end] = vectors
+            self._chunk_ids[start:end] = chunk_ids
+            self._document_ids[start:end] = document_ids
+            self._deleted[start:end] = 0
+            self._append(start, end)
+
+        return count
+
+    def delete_document(self, document_id: int) -> int:
+        """删除文档的所有向量"""
+        with self._lock:
+            return self._mark_deleted(self._document_ids[:self.rows] == document_id)
+
+    def delete_chunks(self, chunk_ids: List[int]) -> int:
+        """删除指定文档块的向量"""
+        if not len(chunk_ids):
+            return 0
+        with self._lock:
+            return self._mark_deleted(np.isin(self._chunk_ids[:self.rows], chunk_ids))
+
+    def needs_build(self) -> bool:
+        # flat索引追加即可检索，没有构建步骤
+        return False
+
+    def indexed_chunk_ids(self, chunk_ids: List[int]) -> Set[int]:
+        """chunk_ids 中已有向量（未删除）的文档块ID"""
+        with self._lock:
+            return set(np.intersect1d(self.chunk_ids, chunk_ids).tolist())
+
+    def search(
+        self,
+        query_vector,
+        top_k: int = 5,
+        document_ids: List[int] = None,
+        ef_search: int = None,
+        nprobe: int = None
+    ) -> List[Tuple[int, float]]:
+        """余弦相似度精确检索，返回 [(chunk_id, score)]（ef_search/nprobe仅对ANN索引有效）"""
+        query = normalize(query_vector).reshape(-1)
+        if query.shape[0] != self.dimension:
+            raise ValueError(f"查询向量维度不匹配: 期望 {self.dimension}, 实际 {query.shape[0]}")
+
+        with self._lock:
+            vectors, chunk_ids = self._vectors[:self.rows], self._chunk_ids[:self.rows]
+            if document_ids:
+                mask = np.isin(self._document_ids[:self.rows], document_ids)
+                if self.deleted_count:
+                    mask &= self._deleted[:self.rows] == 0
+                rows = np.flatnonzero(mask)
+                vectors, chunk_ids = vectors[rows], chunk_ids[rows]
+
+            if len(chunk_ids) == 0 or self.size == 0 or top_k <= 0:
+                return []
+
+            # 一次矩阵-向量乘得到全部相似度，argpartition取top_k（已删除的行不参与排序）
+            scores = vectors @ query
+            live = len(scores)
+            if self.deleted_count and not document_ids:
+                scores[self._deleted[:self.rows] != 0] = -np.inf
+                live = self.size
+            k = min(top_k, live)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            return [(int(chunk_ids[i]), float(scores[i])) for i in top]
+
+    def _reserve(self, capacity: int):
+        """按倍增策略扩容，保持缓冲区连续"""
+        if capacity <= len(self._chunk_ids):
+            return
+
+        new_capacity = max(capacity, 2 * len(self._chunk_ids), 1024)
+        vectors = np.empty((new_capacity, self.dimension), dtype=np.float32)
+        chunk_ids = np.empty(new_capacity, dtype=np.int64)
+        document_ids = np.empty(new_capacity, dtype=np.int64)
+        deleted = np.empty(new_capacity, dtype=np.uint8)
+        vectors[:self.rows] = self._vectors[:self.rows]
+        chunk_ids[:self.rows] = self._chunk_ids[:self.rows]
+        document_ids[:self.rows] = self._document_ids[:self.rows]
+        deleted[:self.rows] = self._deleted[:self.rows]
+        self._vectors, self._chunk_ids, self._document_ids, self._deleted = vectors, chunk_ids, document_ids, deleted
+
+    def _mark_deleted(self, mask: np.ndarray) -> int:
+        """（持有锁时调用）为匹配且未删除的行写墓碑，返回删除的行数"""
+        if self.deleted_count:
+            mask &= self._deleted[:self.rows] == 0
+        rows = np.flatnonzero(mask)
+        if not len(rows):
+            return 0
+
+        self._deleted[rows] = 1
+        self.deleted_count += len(rows)
+        if self.deleted_count * 2 > self.rows and self.rows >= self.COMPACT_MIN_ROWS:
+            self._compact()
+        else:
+            deleted = np.memmap(self._file("deleted"), dtype=np.uint8, mode="r+", shape=(self.rows,))
+            deleted[rows] = 1
+            deleted.flush()
+            del deleted
+        return len(rows)
+
+    # ---------- 持久化 ----------
+
+    def _columns(self, start: int, end: int) -> Dict[str, np.ndarray]:
+        return {
+            "vectors": self._vectors[start:end],
+            "chunk_ids": self._chunk_ids[start:end],
+            "document_ids": self._document_ids[start:end],
+            "deleted": self._deleted[start:end],
+        }
+
+    @property
+    def _meta_file(self) -> str:
+        return os.path.join(self.path, "flat.json")
+
+    def _file(self, name: str, generation: int = None) -> str:
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.path, f"{name}.{generation}.bin")
+
+    def _write_meta(self):
+        tmp = self._meta_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"dimension": self.dimension, "count": self.rows, "generation": self.generation}, f)
+        os.replace(tmp, self._meta_file)
+
+    def _append(self, start: int, end: int):
+        """追加行（先截掉上次崩溃时未提交的尾部数据），最后更新已提交的行数"""
+        os.makedirs(self.path, exist_ok=True)
+        for name, array in self._columns(start, end).items():
+            row_bytes = array.itemsize * int(np.prod(array.shape[1:], dtype=np.int64))
+            with open(self._file(name), "ab") as f:
+                f.truncate(start * row_bytes)
+                f.write(np.ascontiguousarray(array).tobytes())
+        self.rows = end
+        self._write_meta()
+
+    def _compact(self):
+        """把存活的行写成新一代文件，替换 flat.json 后删除旧文件（中途崩溃时旧文件仍然完整有效）"""
+        live = self._deleted[:self.rows] == 0
+        count = int(live.sum())
+        old_generation = self.generation
+        self.generation += 1
+
+        os.makedirs(self.path, exist_ok=True)
+        compacted = {name: np.ascontiguousarray(array[live]) for name, array in self._columns(0, self.rows).items()}
+        for name, array in compacted.items():
+            with open(self._file(name), "wb") as f:
+                f.write(array.tobytes())
+
+        self._vectors[:count] = compacted["vectors"]
+        self._chunk_ids[:count] = compacted["chunk_ids"]
+        self._document_ids[:count] = compacted["document_ids"]
+        self._deleted[:count] = 0
+        self.rows, self.deleted_count = count, 0
+        self._write_meta()
+
+        for name in compacted:
+            old = self._file(name, old_generation)
+            if os.path.exists(old):
+                os.remove(old)
+
+    def _load(self):
+        """从磁盘加载索引（旧版 .npy 格式转换为追加写入格式）"""
+        if not os.path.exists(self._meta_file):
+            if os.path.exists(os.path.join(self.path, "vectors.npy")):
+                self._load_legacy()
+            return
+
+        with open(self._meta_file) as f:
+            meta = json.load(f)
+        if meta["dimension"] != self.dimension:
+            raise ValueError(
+                f"向量索引维度 {meta['dimension']} 与配置 MILVUS_DIMENSION={self.dimension} 不一致"
+            )
+
+        self.generation = meta.get("generation", 0)
+        count = meta["count"]
+        self._reserve(count)
+        for name, array in self._columns(0, count).items():
+            array[...] = np.fromfile(
+                self._file(name), dtype=array.dtype, count=array.size
+            ).reshape(array.shape)
+        self.rows = count
+        self.deleted_count = int(np.count_nonzero(self._deleted[:count]))
+
+    def _load_legacy(self):
+        legacy = {name: os.path.join(self.path, f"{name}.npy") for name in ("vectors", "chunk_ids", "document_ids")}
+        vectors = np.load(legacy["vectors"])
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(
+                f"向量索引维度 {vectors.shape[1]} 与配置 MILVUS_DIMENSION={self.dimension} 不一致"
+            )
+
+        count = len(vectors)
+        self._reserve(count)
+        self._vectors[:count] = vectors
+        self._chunk_ids[:count] = np.load(legacy["chunk_ids"])
+        self._document_ids[:count] = np.load(legacy["document_ids"])
+        self._deleted[:count] = 0
+        self._append(0, count)
+        for file in legacy.values():
+            os.remove(file)
+
+
+_indexes: Dict[int, "SharedVectorIndex"] = {}
+_indexes_lock = threading.Lock()
+
+
+def _create_index(user_id: int):
+    """按 VECTOR_INDEX_TYPE / VECTOR_QUANTIZATION 创建索引"""
+    index_type = settings.VECTOR_INDEX_TYPE
+    quantization = settings.VECTOR_QUANTIZATION
+    dimension = settings.MILVUS_DIMENSION
+    if index_type == "flat" and quantization == "none":
+        return LocalVectorIndex(user_id, dimension, settings.VECTOR_INDEX_DIR)
+
+    from services.ann_index import HNSWIndex, IVFFlatIndex
+    from services.quantization import QuantizedFlatIndex, ScalarQuantizer, ProductQuantizer
+
+    user_dir = os.path.join(settings.VECTOR_INDEX_DIR, f"user_{user_id}")
+    if index_type == "flat":
+        if quantization == "int8":
+            quantizer = ScalarQuantizer(dimension)
+        elif quantization == "pq":
+            quantizer = ProductQuantizer(dimension, settings.PQ_M)
+        else:
+            raise ValueError(f"不支持的向量量化方式: {quantization}")
+        index = QuantizedFlatIndex(
+            os.path.join(user_dir, quantization),
+            dimension,
+            quantizer,
+            rerank_factor=settings.RERANK_FACTOR
+        )
+    elif index_type == "hnsw":
+        index = HNSWIndex(
+            os.path.join(user_dir, "hnsw"),
+            dimension,
+            m=settings.HNSW_M,
+            ef_construction=settings.HNSW_EF_CONSTRUCTION,
+            ef_search=settings.HNSW_EF_SEARCH,
+            max_ef_search=settings.HNSW_MAX_EF_SEARCH
+        )
+    elif index_type == "ivf":
+        index = IVFFlatIndex(
+            os.path.join(user_dir, "ivf"),
+            dimension,
+            nlist=settings.IVF_NLIST,
+            nprobe=settings.IVF_NPROBE
+        )
+    else:
+        raise ValueError(f"不支持的向量索引类型: {index_type}")
+
+    # 首次切换索引类型时，从已有的flat索引导入
+    if index.store.count == 0 and LocalVectorIndex.has_data(user_dir):
+        flat = LocalVectorIndex(user_id, dimension, settings.VECTOR_INDEX_DIR)
+        if flat.size:
+            print(f"📦 从flat索引导入 {flat.size} 个向量（用户 {user_id}）")
+            index.add(flat.chunk_ids, flat.document_ids, flat.vectors)
+
+    return index
+
+
+class SharedVectorIndex:
+    """多进程共享的向量索引
+
+    API进程与入库worker进程各自持有索引对象，共享同一目录下的文件：
+    写操作持有排他文件锁并更新版本号，读操作持有共享锁；
+    发现版本号与本进程加载时不同，说明其他进程修改过索引，在排他锁下重新加载。
+    耗时的建图/训练（build）不持有读写锁，由单独的构建锁保证同时只有一个构建，完成后在排他锁下提交
+    """
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.path = os.path.join(settings.VECTOR_INDEX_DIR, f"user_{user_id}")
+        os.makedirs(self.path, exist_ok=True)
+        self._lock_file = os.path.join(self.path, ".lock")
+        self._build_lock_file = os.path.join(self.path, ".build.lock")
+        self._build_lock = threading.Lock()
+        self._version_file = os.path.join(self.path, "VERSION")
+
+        with self._file_lock(exclusive=True):
+            self._version = self._read_version()
+            self.index = _create_index(user_id)
+
+        # 上次构建中断或刚从flat索引导入：后台补建（完成前未建图的向量精确检索）
+        if self.index.needs_build():
+            threading.Thread(target=self._build_in_background, name=f"vector-build-{user_id}", daemon=True).start()
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool, lock_file: str = None):
+        """每次加锁单独打开文件，同一进程的不同线程之间同样互斥"""
+        if fcntl is None:
+            yield
+            return
+        with open(lock_file or self._lock_file, "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _read_version(self) -> str:
+        try:
+            with open(self._version_file) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return ""
+
+    def _write_version(self):
+        self._version = uuid.uuid4().hex
+        tmp = self._version_file + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self._version)
+        os.replace(tmp, self._version_file)
+
+    def _refresh(self):
+        """（持有排他锁时调用）其他进程修改过索引则重新加载"""
+        version = self._read_version()
+        if version != self._version:
+            self.index = _create_index(self.user_id)
+            self._version = version
+
+    def add(self, chunk_ids: List[int], document_ids: List[int], vectors) -> int:
+        """追加向量后执行构建（构建期间检索照常进行）"""
+        with self._file_lock(exclusive=True):
+            self._refresh()
+            count = self.index.add(chunk_ids, document_ids, vectors)
+            self._write_version()
+        self.build()
+        return count
+
+    def build(self):
+        """执行索引的建图/训练（不持有读写锁），完成后在排他锁下提交"""
+        with self._build_lock, self._file_lock(exclusive=True, lock_file=self._build_lock_file):
+            with self._file_lock(exclusive=True):
+                self._refresh()
+                index = self.index
+            if not index.needs_build():
+                return
+
+            state = index.build()
+            with self._file_lock(exclusive=True):
+                index.install(state)
+                if self.index is not index or self._read_version() != self._version:
+                    # 构建期间其他进程修改过索引：从文件重新加载（已包含本次构建的结果）
+                    self.index = _create_index(self.user_id)
+                self._write_version()
+
+    def _build_in_background(self):
+        try:
+            self.build()
+        except Exception as e:
+            print(f"⚠️  向量索引构建失败（用户 {self.user_id}）: {e}")
+
+    def delete_document(self, document_id: int) -> int:
+        with self._file_lock(exclusive=True):
+            self._refresh()
+            removed = self.index.delete_document(document_id)
+            if removed:
+                self._write_version()
+            return removed
+
+    def delete_chunks(self, chunk_ids: List[int]) -> int:
+        with self._file_lock(exclusive=True):
+            self._refresh()
+            removed = self.index.delete_chunks(chunk_ids)
+            if removed:
+                self._write_version()
+            return removed
+
+    def indexed_chunk_ids(self, chunk_ids: List[int]) -> Set[int]:
+        return self._read("indexed_chunk_ids", chunk_ids)
+
+    def search(
+        self,
+        query_vector,
+        top_k: int = 5,
+        document_ids: List[int] = None,
+        ef_search: int = None,
+        nprobe: int = None
+    ) -> List[Tuple[int, float]]:
+        return self._read(
+            "search", query_vector, top_k, document_ids=document_ids, ef_search=ef_search, nprobe=nprobe
+        )
+
+    def _read(self, method: str, *args, **kwargs):
+        """共享锁下执行只读操作（版本号变化时先在排他锁下重新加载）"""
+        with self._file_lock(exclusive=False):
+            if self._read_version() == self._version:
+                return getattr(self.index, method)(*args, **kwargs)
+
+        with self._file_lock(exclusive=True):
+            self._refresh()
+            return getattr(self.index, method)(*args, **kwargs)
+
+
+def get_vector_index(user_id: int) -> SharedVectorIndex:
+    """获取用户的向量索引（进程内单例，跨进程修改后自动重新加载）"""
+    index = _indexes.get(user_id)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(user_id)
+            if index is None:
+                index = SharedVectorIndex(user_id)
+                _indexes[user_id] = index
+
+    return index
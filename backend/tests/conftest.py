@@ -0,0 +1,68 @@
+"""
+测试公共配置
+所有数据（SQLite数据库、上传文件、向量索引、解析缓存）写入临时目录；
+使用本地哈希嵌入，不访问网络
+"""
+
+import os
+import asyncio
+import tempfile
+
+import pytest
+
+# 必须在导入应用模块之前设置（配置和数据库引擎在导入时创建）
+_TMP_DIR = tempfile.mkdtemp(prefix="rag-test-")
+os.environ.update(
+    DATABASE_URL=f"sqlite+aiosqlite:///{_TMP_DIR}/test.db",
+    DEBUG="false",
+    UPLOAD_DIR=os.path.join(_TMP_DIR, "uploads"),
+    VECTOR_INDEX_DIR=os.path.join(_TMP_DIR, "vector_index"),
+    PARSE_ARTIFACT_DIR=os.path.join(_TMP_DIR, "artifacts"),
+    BAIYUN_TOKEN_CACHE_FILE=os.path.join(_TMP_DIR, "token.json"),
+    EMBEDDING_PROVIDER="hashing",
+    MILVUS_DIMENSION="32",
+    PQ_M="8",
+    ENABLE_REDIS="false",
+    INGEST_EMBEDDED_WORKER="false",
+)
+
+from core.database import init_db, AsyncSessionLocal  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    """整个测试会话共用一个事件循环（数据库连接池绑定在事件循环上）"""
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(init_db())
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def run(event_loop):
+    """在共用事件循环中执行协程"""
+    return event_loop.run_until_complete
+
+
+@pytest.fixture
+def db(run):
+    session = AsyncSessionLocal()
+    yield session
+    run(session.close())
+
+
+_user_seq = 0
+
+
+@pytest.fixture
+def user(run, db):
+    """新建一个测试用户（各测试的数据按用户隔离）"""
+    from models.user import User
+
+    global _user_seq
+    _user_seq += 1
+    user = User(username=f"user{_user_seq}", email=f"user{_user_seq}@example.com", hashed_password="x")
+    db.add(user)
+    run(db.commit())
+    run(db.refresh(user))
+    return user
@@ -0,0 +1,124 @@
+"""
+测试用的内存版Redis客户端
+实现 TieredCache / 令牌管理器用到的 redis.asyncio 接口子集（get/mget/set/incr/pipeline/pub/sub），
+过期时间按可手动推进的时钟计算；可设置 fail 模拟Redis故障
+"""
+
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+
+class FakeRedis:
+    def __init__(self):
+        self.now = 0.0
+        self.fail = False
+        self.commands = []  # 执行过的命令名（统计往返次数）
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    def advance(self, seconds: float):
+        """推进时钟（使带过期时间的键过期）"""
+        self.now += seconds
+
+    def _call(self, name: str):
+        if self.fail:
+            raise ConnectionError("fake redis unavailable")
+        self.commands.append(name)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= self.now:
+            del self._data[key]
+            return None
+        return value
+
+    def _set(self, key: str, value, ex: int = None):
+        if not isinstance(value, bytes):
+            value = str(value).encode()
+        self._data[key] = (value, self.now + ex if ex else None)
+
+    async def ping(self):
+        self._call("ping")
+        return True
+
+    async def get(self, key: str) -> Optional[bytes]:
+        self._call("get")
+        return self._get(key)
+
+    async def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        self._call("mget")
+        return [self._get(key) for key in keys]
+
+    async def set(self, key: str, value, ex: int = None):
+        self._call("set")
+        self._set(key, value, ex)
+        return True
+
+    async def incr(self, key: str) -> int:
+        self._call("incr")
+        value = int(self._get(key) or 0) + 1
+        self._set(key, value)
+        return value
+
+    async def publish(self, channel: str, message: str) -> int:
+        self._call("publish")
+        queues = self._subscribers.get(channel, [])
+        for queue in queues:
+            queue.put_nowait({"type": "message", "channel": channel.encode(), "data": message.encode()})
+        return len(queues)
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+    def pubsub(self) -> "FakePubSub":
+        return FakePubSub(self)
+
+    async def close(self):
+        pass
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self._ops = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._ops.clear()
+
+    def set(self, key: str, value, ex: int = None):
+        self._ops.append((key, value, ex))
+        return self
+
+    async def execute(self):
+        self.redis._call("pipeline")
+        for key, value, ex in self._ops:
+            self.redis._set(key, value, ex)
+        return [True] * len(self._ops)
+
+
+class FakePubSub:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._channels: List[str] = []
+
+    async def subscribe(self, channel: str):
+        self.redis._call("subscribe")
+        self.redis._subscribers.setdefault(channel, []).append(self._queue)
+        self._channels.append(channel)
+        self._queue.put_nowait({"type": "subscribe", "channel": channel.encode(), "data": 1})
+
+    async def listen(self):
+        while True:
+            yield await self._queue.get()
+
+    async def close(self):
+        for channel in self._channels:
+            self.redis._subscribers[channel].remove(self._queue)
+        self._channels.clear()
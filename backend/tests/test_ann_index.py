@@ -0,0 +1,215 @@
+"""
+ANN索引：HNSW建图、IVF/量化器训练在检索锁之外进行（完成前精确检索），图结构增量持久化
+"""
+
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from core.config import settings
+from services.ann_index import HNSWIndex, IVFFlatIndex
+from services.quantization import ScalarQuantizer
+from services.vector_index import SharedVectorIndex, normalize
+
+DIM = 16
+
+
+def _vectors(seed: int, count: int) -> np.ndarray:
+    return normalize(np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32))
+
+
+def _hnsw(path: str) -> HNSWIndex:
+    return HNSWIndex(path, DIM, m=4, ef_construction=32, ef_search=32)
+
+
+def _build(index: HNSWIndex):
+    index.install(index.build())
+
+
+def _recall(index: HNSWIndex, data: np.ndarray, queries: np.ndarray, k: int = 5) -> float:
+    truth = np.argsort(-(queries @ data.T), axis=1)[:, :k]
+    found = [{chunk_id for chunk_id, _ in index.search(q, top_k=k, ef_search=64)} for q in queries]
+    return float(np.mean([len(f & set(t.tolist())) / k for f, t in zip(found, truth)]))
+
+
+def test_pending_vectors_are_searchable_before_build(tmp_path):
+    index = _hnsw(str(tmp_path))
+    data = _vectors(0, 50)
+    index.add(list(range(50)), [1] * 50, data)
+    assert index.needs_build()
+    assert index.graph_count == 0
+
+    # 未建图的向量精确检索
+    assert index.search(data[7], top_k=1)[0][0] == 7
+
+    _build(index)
+    assert not index.needs_build()
+    assert index.search(data[7], top_k=1)[0][0] == 7
+    assert index.delete_chunks([7]) == 1
+    assert 7 not in {chunk_id for chunk_id, _ in index.search(data[7], top_k=5)}
+
+
+def test_graph_is_persisted_incrementally(tmp_path):
+    path = str(tmp_path)
+    data = _vectors(0, 600)
+    index = _hnsw(path)
+    index.add(list(range(300)), [1] * 300, data[:300])
+    _build(index)
+    upper_nodes = os.path.join(path, "upper_nodes.bin")
+    inodes = {name: os.stat(os.path.join(path, f"{name}.bin")).st_ino for name in ("graph0", "upper_nodes")}
+    size = os.path.getsize(upper_nodes)
+
+    index.add(list(range(300, 600)), [1] * 300, data[300:])
+    _build(index)
+    assert {name: os.stat(os.path.join(path, f"{name}.bin")).st_ino for name in inodes} == inodes
+    assert os.path.getsize(upper_nodes) == index.upper_rows * 8 > size
+
+    reloaded = _hnsw(path)
+    assert reloaded.graph_count == 600
+    assert not reloaded.needs_build()
+    assert reloaded._upper == index._upper
+    assert _recall(reloaded, data, _vectors(1, 20)) >= 0.9
+
+
+def test_uncommitted_build_is_ignored(tmp_path):
+    path = str(tmp_path)
+    data = _vectors(0, 200)
+    index = _hnsw(path)
+    index.add(list(range(100)), [1] * 100, data[:100])
+    _build(index)
+
+    # 建图后未提交（模拟崩溃）：重新加载时这部分节点仍按未建图处理
+    index.add(list(range(100, 200)), [1] * 100, data[100:])
+    index.build()
+    reloaded = _hnsw(path)
+    assert reloaded.graph_count == 100
+    assert reloaded.needs_build()
+    assert reloaded.search(data[150], top_k=1)[0][0] == 150
+
+    _build(reloaded)
+    assert _hnsw(path).graph_count == 200
+    assert _recall(_hnsw(path), data, _vectors(1, 20)) >= 0.9
+
+
+def test_search_is_not_blocked_by_build(monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_INDEX_TYPE", "hnsw")
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION", "none")
+    monkeypatch.setattr(settings, "HNSW_M", 4)
+    monkeypatch.setattr(settings, "HNSW_EF_CONSTRUCTION", 32)
+    dim = settings.MILVUS_DIMENSION
+    data = normalize(np.random.default_rng(0).normal(size=(200, dim)).astype(np.float32))
+
+    shared = SharedVectorIndex(900001)
+    shared.add(list(range(100)), [1] * 100, data[:100])
+
+    # 让建图停在插入第一个新节点时
+    started, release = threading.Event(), threading.Event()
+    insert = HNSWIndex._insert
+
+    def blocking_insert(self, view, node):
+        started.set()
+        assert release.wait(10)
+        return insert(self, view, node)
+
+    monkeypatch.setattr(HNSWIndex, "_insert", blocking_insert)
+    writer = threading.Thread(target=shared.add, args=(list(range(100, 200)), [1] * 100, data[100:]))
+    writer.start()
+    try:
+        assert started.wait(10)
+        # 建图进行中：检索立即返回，新追加的向量已可检索
+        assert shared.search(data[5], top_k=1)[0][0] == 5
+        assert shared.search(data[150], top_k=1)[0][0] == 150
+    finally:
+        release.set()
+        writer.join(10)
+
+    assert not shared.index.needs_build()
+    assert shared.search(data[150], top_k=1)[0][0] == 150
+
+
+def test_ivf_serves_exact_search_until_trained(tmp_path):
+    path = str(tmp_path)
+    data = _vectors(0, 300)
+    index = IVFFlatIndex(path, DIM, nlist=4, nprobe=4)
+    index.add(list(range(100)), [1] * 100, data[:100])
+    assert not index.needs_build()
+    index.add(list(range(100, 200)), [1] * 100, data[100:200])
+    assert index.needs_build()
+
+    state = index.build()
+    # 训练完成但尚未切换：仍精确检索，训练期间追加的向量同样可检索
+    index.add(list(range(200, 300)), [1] * 100, data[200:])
+    assert not index.is_trained
+    assert index.search(data[250], top_k=1)[0][0] == 250
+
+    index.install(state)
+    assert index.is_trained and index.assigned == 300
+    assert index.search(data[250], top_k=1)[0][0] == 250
+
+    reloaded = IVFFlatIndex(path, DIM, nlist=4, nprobe=4)
+    assert reloaded.is_trained and reloaded.assigned == 300
+    assert reloaded.search(data[42], top_k=1)[0][0] == 42
+
+
+def test_search_is_not_blocked_by_quantizer_training(monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_INDEX_TYPE", "flat")
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION", "int8")
+    monkeypatch.setattr(ScalarQuantizer, "min_train_size", 150)
+    dim = settings.MILVUS_DIMENSION
+    data = normalize(np.random.default_rng(0).normal(size=(200, dim)).astype(np.float32))
+
+    shared = SharedVectorIndex(900002)
+    shared.add(list(range(100)), [1] * 100, data[:100])
+    assert not shared.index.quantizer.is_trained
+
+    started, release = threading.Event(), threading.Event()
+    train = ScalarQuantizer.train
+
+    def blocking_train(self, sample):
+        started.set()
+        assert release.wait(10)
+        return train(self, sample)
+
+    monkeypatch.setattr(ScalarQuantizer, "train", blocking_train)
+    writer = threading.Thread(target=shared.add, args=(list(range(100, 200)), [1] * 100, data[100:]))
+    writer.start()
+    try:
+        assert started.wait(10)
+        # 训练进行中：检索立即返回精确结果
+        assert shared.search(data[150], top_k=1)[0][0] == 150
+        assert not shared.index.quantizer.is_trained
+    finally:
+        release.set()
+        writer.join(10)
+
+    assert shared.index.quantizer.is_trained
+    assert shared.index.encoded == 200
+    assert shared.search(data[150], top_k=1)[0][0] == 150
+
+
+def test_query_parameters_are_bounded(tmp_path):
+    from pydantic import ValidationError
+    from api.chat import ChatRequest
+
+    for params in ({"nprobe": -1}, {"nprobe": 0}, {"ef_search": 0}, {"ef_search": 10 ** 9}):
+        with pytest.raises(ValidationError):
+            ChatRequest(message="年假", **params)
+    assert ChatRequest(message="年假", ef_search=128, nprobe=8).nprobe == 8
+
+    # 索引内部同样限制（不经过API的调用方）
+    data = _vectors(0, 400)
+    queries = _vectors(1, 10)
+    ivf = IVFFlatIndex(str(tmp_path / "ivf"), DIM, nlist=8, nprobe=4)
+    ivf.add(list(range(400)), [1] * 400, data)
+    ivf.install(ivf.build())
+    for q in queries:
+        assert ivf.search(q, top_k=5, nprobe=-3) == ivf.search(q, top_k=5, nprobe=1)
+
+    hnsw = HNSWIndex(str(tmp_path / "hnsw"), DIM, m=4, ef_construction=32, ef_search=8, max_ef_search=16)
+    hnsw.add(list(range(400)), [1] * 400, data)
+    _build(hnsw)
+    for q in queries:
+        assert hnsw.search(q, top_k=5, ef_search=10 ** 9) == hnsw.search(q, top_k=5, ef_search=16)
+        assert hnsw.search(q, top_k=5, ef_search=-1) == hnsw.search(q, top_k=5, ef_search=5)
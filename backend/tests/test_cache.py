@@ -0,0 +1,193 @@
+"""
+两级缓存：L1进程内LRU（淘汰/TTL/用户代数）+ L2 Redis（回填、跨worker失效、过期、故障退化）
+L2 使用内存版Redis客户端（tests/fake_redis.py）
+"""
+
+import asyncio
+
+import pytest
+
+import services.cache as cache_module
+from core.config import settings
+from services.cache import LRUCache, TieredCache, serialize, deserialize
+from tests.fake_redis import FakeRedis
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    return clock
+
+
+def _tiered(redis=None, ttl=300) -> TieredCache:
+    return TieredCache(LRUCache(max_entries=100, default_ttl=ttl), redis_client=redis, prefix="test:")
+
+
+def _drain(run):
+    """让pub/sub监听任务处理完已发布的消息"""
+    for _ in range(5):
+        run(asyncio.sleep(0))
+
+
+# ---------- L1 ----------
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2, default_ttl=0)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_byte_limit():
+    cache = LRUCache(max_entries=100, max_bytes=2000, default_ttl=0)
+    for i in range(10):
+        cache.set(f"k{i}", "x" * 300)
+    assert cache.stats()["bytes"] <= 2000
+    assert cache.get("k9") is not None
+    assert cache.get("k0") is None
+
+    # 单条超过上限的值不缓存
+    cache.set("huge", "x" * 5000)
+    assert cache.get("huge") is None
+
+
+def test_lru_ttl(clock):
+    cache = LRUCache(default_ttl=10)
+    cache.set("short", 1, expire_seconds=5)
+    cache.set("default", 2)
+    cache.set("forever", 3, expire_seconds=0)
+
+    clock.now += 6
+    assert cache.get("short") is None
+    assert cache.get("default") == 2
+
+    clock.now += 5
+    assert cache.get("default") is None
+    assert cache.get("forever") == 3
+    assert cache.stats()["expirations"] == 2
+
+
+def test_generation_invalidates_user_keys():
+    cache = LRUCache()
+    key = cache.user_key(7, "search", "q")
+    cache.set(key, ["hit"])
+
+    cache.bump_generation(7)
+    assert cache.user_key(7, "search", "q") != key
+    assert cache.get(cache.user_key(7, "search", "q")) is None
+    # 其他用户不受影响
+    assert cache.user_key(8, "search", "q") == "u8:g0:search:q"
+
+    # 同步其他worker的代数只前进不后退
+    cache.set_generation(7, 0)
+    assert cache.generation(7) == 1
+
+
+def test_serialize_roundtrip():
+    small = {"a": [1, 2.5, "文本"]}
+    large = [{"content": "员工手册" * 200, "score": 0.5}]
+    assert serialize(small)[:1] == b"j"
+    assert serialize(large)[:1] == b"z"
+    assert deserialize(serialize(small)) == small
+    assert deserialize(serialize(large)) == large
+
+
+# ---------- L1 + L2 ----------
+
+def test_l2_fill_between_workers(run):
+    redis = FakeRedis()
+    worker_a, worker_b = _tiered(redis), _tiered(redis)
+
+    run(worker_a.set_many({"k1": {"v": 1}, "k2": [1, 2]}))
+    assert redis.commands.count("pipeline") == 1
+
+    # B的L1未命中，一次MGET从L2读取并回填L1
+    assert run(worker_b.get_many(["k1", "k2", "missing"])) == {"k1": {"v": 1}, "k2": [1, 2]}
+    assert redis.commands.count("mget") == 1
+    assert worker_b.stats()["l2"] == {"enabled": True, "hits": 2, "misses": 1, "errors": 0}
+
+    # 再次读取由L1命中，不访问Redis
+    assert run(worker_b.get("k1")) == {"v": 1}
+    assert redis.commands.count("mget") == 1
+
+
+def test_l2_ttl(run):
+    redis = FakeRedis()
+    worker_a, worker_b = _tiered(redis, ttl=60), _tiered(redis, ttl=60)
+
+    run(worker_a.set("default", 1))
+    run(worker_a.set("short", 2, expire_seconds=5))
+    redis.advance(10)
+    assert run(worker_b.get_many(["default", "short"])) == {"default": 1}
+
+    redis.advance(60)
+    worker_b.l1.clear()
+    assert run(worker_b.get("default")) is None
+
+
+def test_invalidation_reaches_other_workers(run):
+    redis = FakeRedis()
+    worker_a, worker_b = _tiered(redis), _tiered(redis)
+    run(worker_a.start())
+    run(worker_b.start())
+    _drain(run)
+    try:
+        key_b = run(worker_b.user_key(3, "search", "q"))
+        run(worker_b.set(key_b, ["old"]))
+
+        # A递增代数（如入库worker索引了新文档），B通过pub/sub收到通知
+        assert run(worker_a.bump_generation(3)) == 1
+        _drain(run)
+        new_key = run(worker_b.user_key(3, "search", "q"))
+        assert new_key != key_b
+        assert run(worker_b.get(new_key)) is None
+
+        # 新启动的worker从Redis读取当前代数
+        worker_c = _tiered(redis)
+        assert run(worker_c.user_key(3, "search", "q")) == new_key
+    finally:
+        run(worker_a.close())
+        run(worker_b.close())
+
+
+def test_redis_failure_degrades_to_l1(run):
+    redis = FakeRedis()
+    cache = _tiered(redis)
+    redis.fail = True
+
+    run(cache.set("k", "v"))
+    assert run(cache.get("k")) == "v"
+    assert run(cache.get("missing")) is None
+    assert run(cache.bump_generation(1)) == 1
+    assert cache.stats()["l2"]["errors"] == 3
+
+
+def test_start_fails_when_redis_enabled_but_unavailable(run, monkeypatch):
+    monkeypatch.setattr(settings, "ENABLE_REDIS", True)
+    monkeypatch.setattr(settings, "REDIS_URL", "redis://127.0.0.1:1/0")
+    cache = _tiered()
+    with pytest.raises(RuntimeError, match="ENABLE_REDIS"):
+        run(cache.start())
+    assert cache.redis is None
+
+
+def test_split_ingestion_requires_redis():
+    from services.ingestion_queue import require_shared_cache
+
+    with pytest.raises(RuntimeError, match="ENABLE_REDIS"):
+        require_shared_cache(_tiered())
+    require_shared_cache(_tiered(FakeRedis()))
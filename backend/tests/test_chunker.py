@@ -0,0 +1,75 @@
+"""
+流式分块：句子切分、块大小与重叠、页码、超长句子硬切、惰性消费、局部修改后块边界重新对齐
+"""
+
+import itertools
+
+from services.chunker import TextChunker, chunk_hash, split_sentences
+
+
+def _policy(count: int = 40) -> list:
+    return [
+        f"第{i}条：员工应当遵守第{i}项管理制度。按规定提交申请并留存记录！Version {i}.5 is ready. See the policy."
+        for i in range(count)
+    ]
+
+
+def test_split_sentences():
+    text = "年假3.5天。“好的。”Hello world. Version 3.14 ok\n\n下一段"
+    sentences = list(split_sentences(text))
+    assert sentences == ["年假3.5天。", "“好的。”", "Hello world.", " Version 3.14 ok\n\n", "下一段"]
+    assert "".join(sentences) == text
+
+
+def test_chunk_size_and_overlap():
+    paragraphs = _policy()
+    chunker = TextChunker(chunk_size=200, chunk_overlap=40, min_chunk_size=50)
+    chunks = list(chunker.chunk(paragraphs))
+
+    assert len(chunks) > 10
+    assert all(len(c.content) <= 200 for c in chunks[:-1])
+    # 末尾过短的内容并入上一块
+    assert len(chunks[-1].content) <= 200 + 50
+    # 相邻块以上一块末尾的完整句子重叠
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current.content[:20] in previous.content[-40:]
+    # 不丢内容
+    text = "\n".join(c.content for c in chunks)
+    assert all(sentence.strip() in text for p in paragraphs for sentence in split_sentences(p))
+
+
+def test_pages_and_long_sentences():
+    chunker = TextChunker(chunk_size=200, chunk_overlap=40, min_chunk_size=50)
+    chunks = list(chunker.chunk([("页一内容。" * 30, 1), ("页二内容。" * 30, 2)]))
+    assert (chunks[0].page_start, chunks[-1].page_end) == (1, 2)
+    assert all(c.page_start <= c.page_end for c in chunks)
+
+    # 没有句子边界的超长文本按长度硬切
+    chunks = list(chunker.chunk(["a" * 1000]))
+    assert len(chunks) > 4
+    assert all(len(c.content) <= 200 for c in chunks[:-1])
+    assert "".join(c.content for c in chunks).count("a") >= 1000
+    assert chunks[0].page_start is None
+
+
+def test_chunks_are_produced_lazily():
+    chunker = TextChunker(chunk_size=200, chunk_overlap=40)
+    # 无限输入：只消费产出第一块所需的文本块
+    first = next(chunker.chunk(itertools.cycle(_policy())))
+    assert first.content.startswith("第0条")
+
+
+def test_local_edit_keeps_other_chunks():
+    chunker = TextChunker(chunk_size=200, chunk_overlap=40, min_chunk_size=50)
+    paragraphs = _policy()
+    before = list(chunker.chunk(paragraphs))
+
+    paragraphs[20] = "第20条：差旅报销改为线上审批。"
+    after = list(chunker.chunk(paragraphs))
+
+    # 修改处之前的块不变；之后的块边界重新对齐，同样可以复用
+    unchanged = {chunk_hash(c.content) for c in before}
+    reused = [chunk_hash(c.content) in unchanged for c in after]
+    assert all(reused[:len(reused) // 3])
+    assert all(reused[-(len(reused) // 3):])
+    assert not all(reused)
@@ -0,0 +1,138 @@
+"""
+向量生成流水线：缓存命中/未命中、去重分批、失败重试、缓存写入由调用方提交
+"""
+
+import pytest
+from sqlalchemy import select, func
+
+from models.embedding import EmbeddingCacheEntry
+from services.embedding_pipeline import EmbeddingCache, EmbeddingPipeline, embedding_cache_key
+
+
+class CountingProvider:
+    """记录每次调用的文本，可指定前几次调用失败"""
+
+    def __init__(self, engine: str, failures: int = 0):
+        self.engine = engine
+        self.batch_size = 2
+        self.failures = failures
+        self.calls = []
+
+    async def embed_batch(self, texts):
+        self.calls.append(list(texts))
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("temporary failure")
+        return [[float(len(text)), 1.0, 0.0] for text in texts]
+
+
+def _cached_count(run, db, engine: str) -> int:
+    return run(db.scalar(
+        select(func.count()).select_from(EmbeddingCacheEntry).where(EmbeddingCacheEntry.model == engine)
+    ))
+
+
+def test_miss_then_hit(run, db):
+    provider = CountingProvider("test-miss-hit")
+    pipeline = EmbeddingPipeline(provider, EmbeddingCache(db), concurrency=2, backoff=0)
+
+    vectors = run(pipeline.embed(["年假", "报销制度", "年假", "差旅"]))
+    assert vectors[0] == vectors[2] == [2.0, 1.0, 0.0]
+    # 去重后按 batch_size 分批
+    assert sorted(text for call in provider.calls for text in call) == ["差旅", "年假", "报销制度"]
+    assert all(len(call) <= 2 for call in provider.calls)
+    run(db.commit())
+
+    provider.calls.clear()
+    again = run(pipeline.embed(["差旅", "年假", "新条款"]))
+    assert provider.calls == [["新条款"]]
+    assert again[:2] == [vectors[3], vectors[0]]
+
+
+def test_cache_write_is_left_to_caller(run, db):
+    provider = CountingProvider("test-rollback")
+    pipeline = EmbeddingPipeline(provider, EmbeddingCache(db), backoff=0)
+
+    run(pipeline.embed(["第一条", "第二条"]))
+    assert _cached_count(run, db, "test-rollback") == 2
+
+    # 调用方回滚（如索引失败）时缓存写入一并撤销
+    run(db.rollback())
+    assert _cached_count(run, db, "test-rollback") == 0
+
+    run(pipeline.embed(["第一条"]))
+    run(db.commit())
+    key = embedding_cache_key("test-rollback", "第一条")
+    assert run(EmbeddingCache(db).get_many([key])) == {key: [3.0, 1.0, 0.0]}
+
+
+def test_retries_transient_failures(run, db):
+    provider = CountingProvider("test-retry", failures=2)
+    pipeline = EmbeddingPipeline(provider, EmbeddingCache(db), max_retries=2, backoff=0)
+
+    assert run(pipeline.embed(["重试"])) == [[2.0, 1.0, 0.0]]
+    assert len(provider.calls) == 3
+
+    provider = CountingProvider("test-retry-exhausted", failures=5)
+    pipeline = EmbeddingPipeline(provider, EmbeddingCache(db), max_retries=1, backoff=0)
+    with pytest.raises(ConnectionError):
+        run(pipeline.embed(["失败"]))
+    run(db.rollback())
+
+
+def test_failed_embedding_leaves_no_chunks(run, db, user, monkeypatch):
+    from core.config import settings
+    from models.chunk import DocumentChunk
+    from services.rag_service import RAGService
+
+    monkeypatch.setattr(settings, "RETRIEVAL_MODE", "hybrid")
+    user_id = user.id
+    rag = RAGService(db)
+    # 第一批成功（向量写入缓存表）、第二批失败：此时还没有插入任何文档块
+    provider = CountingProvider("test-index-failure")
+    rag.embedding_pipeline = EmbeddingPipeline(provider, EmbeddingCache(db), concurrency=1, max_retries=0, backoff=0)
+    embed_batch = provider.embed_batch
+
+    async def flaky(texts):
+        if provider.calls:
+            provider.failures = 1
+        return await embed_batch(texts)
+
+    provider.embed_batch = flaky
+    with pytest.raises(ConnectionError):
+        run(rag.index_document(1, user_id, "policy.txt", ["第一条", "第二条", "第三条"]))
+    run(db.rollback())
+
+    chunks = run(db.scalar(select(func.count()).select_from(DocumentChunk).where(DocumentChunk.user_id == user_id)))
+    assert chunks == 0
+    assert _cached_count(run, db, "test-index-failure") == 0
+
+
+def test_concurrency_is_shared_across_pipelines(run, monkeypatch):
+    import asyncio
+    from core.database import AsyncSessionLocal
+    from services import embedding_pipeline
+
+    monkeypatch.setattr(embedding_pipeline, "embedding_limiter", asyncio.Semaphore(2))
+    in_flight = peak = 0
+
+    class SlowProvider(CountingProvider):
+        async def embed_batch(self, texts):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return await super().embed_batch(texts)
+
+    async def job(i):
+        # 模拟多个入库任务：各自的数据库会话和流水线
+        async with AsyncSessionLocal() as session:
+            pipeline = EmbeddingPipeline(SlowProvider(f"test-shared-{i}"), EmbeddingCache(session), backoff=0)
+            await pipeline.embed([f"任务{i}第{j}条" for j in range(8)])
+
+    async def run_jobs():
+        await asyncio.gather(*[job(i) for i in range(3)])
+
+    run(run_jobs())
+    assert peak == 2
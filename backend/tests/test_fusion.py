@@ -0,0 +1,104 @@
+"""
+混合检索：RRF/加权分数融合、两路并发检索、单路超时不拖住整个检索
+"""
+
+import time
+import asyncio
+
+import pytest
+
+from core.config import settings
+from services.fusion import reciprocal_rank_fusion, weighted_score_fusion
+from services.rag_service import RAGService, KeywordSearchService
+
+# 只写入文档块和倒排记录，文档ID不与其他测试创建的文档重合
+DOC_ID = 900101
+
+CHUNKS = [
+    "年假申请须提前三天提交，年假天数按工龄计算。",
+    "员工入职满一年后享受年假。",
+    "报销制度：差旅发票须在十五天内提交。",
+]
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion(
+        {"keyword": [(1, 9.0), (2, 5.0)], "vector": [(2, 0.9), (3, 0.8)]},
+        k=60,
+        weights={"keyword": 0.5, "vector": 0.5}
+    )
+    # 两路都命中的块排第一；只依赖名次，与分数尺度无关
+    assert [chunk_id for chunk_id, _ in fused] == [2, 1, 3]
+    assert dict(fused) == pytest.approx({2: 0.5 / 62 + 0.5 / 61, 1: 0.5 / 61, 3: 0.5 / 62})
+
+    assert reciprocal_rank_fusion({"keyword": [], "vector": []}) == []
+
+
+def test_weighted_score_fusion():
+    fused = weighted_score_fusion(
+        {"keyword": [(1, 12.0), (2, 4.0), (3, 2.0)], "vector": [(3, 0.9), (1, 0.3)], "empty": []},
+        weights={"keyword": 0.25, "vector": 0.75}
+    )
+    # 各路min-max归一化到[0, 1]后加权求和
+    assert dict(fused) == pytest.approx({1: 0.25, 2: 0.25 * 0.2, 3: 0.75})
+    assert [chunk_id for chunk_id, _ in fused][0] == 3
+
+    # 只有一个结果（或分数全部相同）时归一化为1
+    assert weighted_score_fusion({"vector": [(7, 0.4)]}) == [(7, 1.0)]
+
+
+@pytest.fixture
+def hybrid(run, db, user, monkeypatch):
+    monkeypatch.setattr(settings, "RETRIEVAL_MODE", "hybrid")
+    monkeypatch.setattr(settings, "FUSION_METHOD", "rrf")
+    chunk_ids = run(KeywordSearchService(db).insert_chunks([
+        {
+            "user_id": user.id,
+            "document_id": DOC_ID,
+            "file_name": "policy.txt",
+            "content": content,
+            "chunk_index": index
+        }
+        for index, content in enumerate(CHUNKS)
+    ]))
+    return RAGService(db), user.id, chunk_ids
+
+
+def _stub_vector_hits(monkeypatch, hits, delay: float = 0.0):
+    async def vector_hits(self, query, user_id, top_k, document_ids, ef_search=None, nprobe=None):
+        await asyncio.sleep(delay)
+        return hits
+
+    monkeypatch.setattr(RAGService, "_vector_hits", vector_hits)
+
+
+def test_hybrid_search_returns_fused_scores(run, hybrid, monkeypatch):
+    service, user_id, chunk_ids = hybrid
+    # 向量检索额外命中一个关键词检索未命中的块
+    vector_hits = [(chunk_ids[2], 0.9), (chunk_ids[1], 0.8)]
+    _stub_vector_hits(monkeypatch, vector_hits)
+
+    keyword = run(service.search_service.search("年假", user_id, top_k=20))
+    expected = reciprocal_rank_fusion(
+        {"keyword": [(r["chunk_id"], r["score"]) for r in keyword], "vector": vector_hits},
+        k=settings.RRF_K,
+        weights={"keyword": 1 - settings.HYBRID_VECTOR_WEIGHT, "vector": settings.HYBRID_VECTOR_WEIGHT}
+    )
+
+    results = run(service.search("年假", user_id, top_k=5))
+    assert [(r["chunk_id"], r["score"]) for r in results] == expected
+    assert {r["chunk_id"] for r in results} == set(chunk_ids)
+    # 仅由向量检索命中的块回表读取了内容
+    assert next(r for r in results if r["chunk_id"] == chunk_ids[2])["content"] == CHUNKS[2]
+
+
+def test_slow_retriever_is_dropped(run, hybrid, monkeypatch):
+    service, user_id, chunk_ids = hybrid
+    monkeypatch.setattr(settings, "VECTOR_SEARCH_TIMEOUT", 0.05)
+    _stub_vector_hits(monkeypatch, [(chunk_ids[2], 0.9)], delay=5)
+
+    started = time.monotonic()
+    results = run(service.search("年假", user_id, top_k=5))
+    assert time.monotonic() - started < 2
+    # 向量检索超时按空结果处理，只剩关键词检索的结果
+    assert sorted(r["chunk_id"] for r in results) == sorted(chunk_ids[:2])
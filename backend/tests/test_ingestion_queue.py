@@ -0,0 +1,186 @@
+"""
+入库队列：并发领取互斥、租约过期后重新领取、失败退避重试、死信与重新投递
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from models.document import Document
+from models.job import IngestionJob
+from services import ingestion_queue
+from services.ingestion_queue import IngestionQueue, IngestionWorker, PermanentIngestionError, enqueue
+
+
+@pytest.fixture
+def make_job(run, user):
+    """为新建的文档入队一个任务；测试结束时把未结束的任务标记为成功，不留给其他测试的worker"""
+    job_ids = []
+
+    async def create(document_id: int = None) -> int:
+        async with AsyncSessionLocal() as db:
+            if document_id is None:
+                document = Document(
+                    user_id=user.id, title="制度", file_type="txt", file_size=0,
+                    filename="policy.txt", file_path="/nonexistent/policy.txt"
+                )
+                db.add(document)
+                await db.flush()
+            else:
+                document = await db.get(Document, document_id)
+            job = await enqueue(db, document)
+            await db.commit()
+            job_ids.append(job.id)
+            return job.id
+
+    yield lambda document_id=None: run(create(document_id))
+
+    async def cleanup():
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(IngestionJob)
+                .where(IngestionJob.id.in_(job_ids), IngestionJob.status.in_(["queued", "running"]))
+                .values(status="succeeded", lease_owner=None, lease_expires_at=None)
+            )
+            await db.commit()
+
+    run(cleanup())
+
+
+def _job(run, job_id: int) -> IngestionJob:
+    async def get():
+        async with AsyncSessionLocal() as db:
+            return await db.get(IngestionJob, job_id)
+
+    return run(get())
+
+
+def _set(run, job_id: int, **values):
+    async def set_values():
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(IngestionJob).where(IngestionJob.id == job_id).values(**values))
+            await db.commit()
+
+    run(set_values())
+
+
+def _past() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=1)
+
+
+def test_claim_is_exclusive(run, make_job):
+    job_id = make_job()
+
+    async def claim_concurrently():
+        return await asyncio.gather(*(IngestionQueue().claim(5) for _ in range(4)))
+
+    claimed = run(claim_concurrently())
+    assert sorted(job_ids for job_ids in claimed if job_ids) == [[job_id]]
+    job = _job(run, job_id)
+    assert job.status == "running" and job.attempts == 1
+
+
+def test_expired_lease_is_reclaimed(run, make_job):
+    job_id = make_job()
+    crashed, other = IngestionQueue("crashed"), IngestionQueue("other")
+
+    assert run(crashed.claim(1)) == [job_id]
+    assert run(crashed.heartbeat(job_id))
+    # 租约有效期内其他worker领不到
+    assert run(other.claim(1)) == []
+
+    # 模拟worker崩溃：停止续约，租约过期
+    _set(run, job_id, lease_expires_at=_past())
+    assert run(other.claim(1)) == [job_id]
+    job = _job(run, job_id)
+    assert job.lease_owner == "other" and job.attempts == 2
+
+    # 原worker恢复后已失去任务：续约失败，完成/失败的结果不生效
+    assert not run(crashed.heartbeat(job_id))
+    run(crashed.complete(job_id))
+    assert run(crashed.fail(job_id, "stale")) == "running"
+    assert _job(run, job_id).status == "running"
+
+    run(other.complete(job_id))
+    job = _job(run, job_id)
+    assert job.status == "succeeded" and job.lease_owner is None
+
+
+def test_retry_with_backoff_then_dead_letter(run, make_job, monkeypatch):
+    monkeypatch.setattr(settings, "INGEST_MAX_ATTEMPTS", 2)
+    job_id = make_job()
+    queue = IngestionQueue()
+
+    assert run(queue.claim(1)) == [job_id]
+    assert run(queue.fail(job_id, "timeout")) == "queued"
+    job = _job(run, job_id)
+    assert job.last_error == "timeout"
+    assert job.available_at > datetime.utcnow() + timedelta(seconds=settings.INGEST_RETRY_BACKOFF - 5)
+    # 退避期间不可领取
+    assert run(queue.claim(1)) == []
+
+    _set(run, job_id, available_at=_past())
+    assert run(queue.claim(1)) == [job_id]
+    assert run(queue.fail(job_id, "timeout again")) == "dead"
+
+    async def document_of(job_id):
+        async with AsyncSessionLocal() as db:
+            return await db.get(Document, (await db.get(IngestionJob, job_id)).document_id)
+
+    job, document = _job(run, job_id), run(document_of(job_id))
+    assert job.status == "dead" and job.finished_at is not None
+    assert document.status == "error" and document.error_message == "timeout again"
+    assert run(queue.claim(1)) == []
+
+    # 重新投递：重置重试次数，文档恢复为处理中
+    assert run(queue.retry_dead(job_id))
+    assert not run(queue.retry_dead(job_id))
+    job, document = _job(run, job_id), run(document_of(job_id))
+    assert job.status == "queued" and job.attempts == 0
+    assert document.status == "processing" and document.error_message is None
+    assert run(queue.claim(1)) == [job_id]
+
+
+def test_crashed_on_last_attempt_goes_dead(run, make_job, monkeypatch):
+    monkeypatch.setattr(settings, "INGEST_MAX_ATTEMPTS", 1)
+    job_id = make_job()
+
+    assert run(IngestionQueue("crashed").claim(1)) == [job_id]
+    _set(run, job_id, lease_expires_at=_past())
+
+    # 租约过期且重试次数耗尽：不再领取，直接进入死信
+    assert run(IngestionQueue("other").claim(1)) == []
+    job = _job(run, job_id)
+    assert job.status == "dead"
+    assert "租约过期" in job.last_error
+
+
+def test_jobs_of_same_document_run_one_at_a_time(run, make_job):
+    first = make_job()
+    second = make_job(_job(run, first).document_id)
+    queue = IngestionQueue()
+
+    # 同一文档的任务正在处理时，后上传版本的任务等待
+    assert run(queue.claim(5)) == [first]
+    assert run(queue.claim(5)) == []
+    run(queue.complete(first))
+    assert run(queue.claim(5)) == [second]
+
+
+def test_worker_dead_letters_permanent_errors(run, make_job, monkeypatch):
+    job_id = make_job()
+
+    async def process_job(job_id):
+        raise PermanentIngestionError("文档内容为空")
+
+    monkeypatch.setattr(ingestion_queue, "process_job", process_job)
+    worker = IngestionWorker(concurrency=2, poll_interval=0)
+    run(worker.drain())
+
+    job = _job(run, job_id)
+    assert job.status == "dead" and job.attempts == 1
+    assert worker.failed == 1 and worker.processed == 0
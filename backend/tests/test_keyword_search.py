@@ -0,0 +1,100 @@
+"""
+BM25倒排索引：分词、打分（与公式逐项核对）、文档过滤、删除后统计量更新
+"""
+
+import math
+from collections import Counter
+
+import pytest
+
+from services.rag_service import KeywordSearchService
+from services.tokenizer import tokenize
+
+# 只写入文档块和倒排记录，文档ID不与其他测试创建的文档重合
+DOC_A, DOC_B = 900001, 900002
+
+CHUNKS = [
+    (DOC_A, "年假申请须提前三天提交，年假天数按工龄计算。"),
+    (DOC_A, "报销制度：差旅发票须在十五天内提交。"),
+    (DOC_B, "员工入职满一年后享受年假。"),
+    (DOC_B, "Use the VPN client to access the intranet."),
+]
+
+
+def _bm25(query: str, texts, k1: float, b: float) -> dict:
+    """参考实现：按公式直接计算每个文本的BM25分数"""
+    docs = [Counter(tokenize(text)) for text in texts]
+    lengths = [sum(doc.values()) for doc in docs]
+    avg_len = sum(lengths) / len(docs)
+    scores = {}
+    for i, doc in enumerate(docs):
+        score = 0.0
+        for term in dict.fromkeys(tokenize(query)):
+            df = sum(1 for d in docs if term in d)
+            if not df or term not in doc:
+                continue
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            tf = doc[term]
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[i] / avg_len))
+        if score:
+            scores[i] = score
+    return scores
+
+
+@pytest.fixture
+def indexed(run, db, user):
+    service = KeywordSearchService(db)
+    chunk_ids = run(service.insert_chunks([
+        {
+            "user_id": user.id,
+            "document_id": document_id,
+            "file_name": f"{document_id}.txt",
+            "content": content,
+            "chunk_index": index
+        }
+        for index, (document_id, content) in enumerate(CHUNKS)
+    ]))
+    return service, user.id, chunk_ids
+
+
+def test_tokenize():
+    assert tokenize("年假天数") == ["年假", "假天", "天数"]
+    # 英文转小写，停用词去除
+    assert tokenize("The VPN and Intranet") == ["vpn", "intranet"]
+    assert tokenize("a" * 65) == []
+
+
+def test_scores_match_bm25_formula(run, indexed):
+    service, user_id, chunk_ids = indexed
+    expected = _bm25("年假怎么申请", [content for _, content in CHUNKS], service.k1, service.b)
+
+    results = run(service.search("年假怎么申请", user_id, top_k=10))
+    assert [r["chunk_id"] for r in results] == [chunk_ids[i] for i in sorted(expected, key=expected.get, reverse=True)]
+    for r in results:
+        assert r["score"] == pytest.approx(expected[chunk_ids.index(r["chunk_id"])])
+    # 含两次“年假”且命中“申请”的块排第一
+    assert results[0]["chunk_id"] == chunk_ids[0]
+
+    assert run(service.search("vpn", user_id))[0]["chunk_id"] == chunk_ids[3]
+    assert run(service.search("不存在的词汇", user_id)) == []
+
+
+def test_document_filter(run, indexed):
+    service, user_id, chunk_ids = indexed
+    results = run(service.search("年假", user_id, top_k=10, document_ids=[DOC_B]))
+    assert [r["chunk_id"] for r in results] == [chunk_ids[2]]
+    assert results[0]["document_id"] == DOC_B
+
+
+def test_delete_updates_statistics(run, indexed):
+    service, user_id, chunk_ids = indexed
+    assert run(service.delete_document(DOC_A, user_id)) == 2
+
+    remaining = [content for document_id, content in CHUNKS if document_id == DOC_B]
+    expected = _bm25("年假", remaining, service.k1, service.b)
+    results = run(service.search("年假", user_id, top_k=10))
+    assert [r["chunk_id"] for r in results] == [chunk_ids[2]]
+    assert results[0]["score"] == pytest.approx(expected[0])
+
+    assert run(service.delete_chunks(user_id, [chunk_ids[2]])) == 1
+    assert run(service.search("年假", user_id)) == []
@@ -0,0 +1,167 @@
+"""
+大模型调用网关：熔断器打开/半开/恢复、AIMD并发调整、排队上限与排队超时
+"""
+
+import time
+import asyncio
+
+import httpx
+import pytest
+
+from services.llm_gateway import LLMGateway, ProviderUnavailable, RateLimitedError
+
+
+def _call(gateway: LLMGateway, error: Exception = None, hold: asyncio.Event = None):
+    async def call():
+        async with gateway.slot():
+            if hold is not None:
+                await hold.wait()
+            if error is not None:
+                raise error
+            return "ok"
+
+    return call()
+
+
+def _fail(run, gateway: LLMGateway, error: Exception):
+    with pytest.raises(type(error)):
+        run(_call(gateway, error))
+
+
+def test_breaker_opens_after_consecutive_failures(run):
+    gateway = LLMGateway(max_concurrency=4, breaker_threshold=3, breaker_cooldown=60)
+
+    # 请求本身的错误不代表服务不健康，不计入熔断
+    _fail(run, gateway, ValueError("bad request"))
+    assert gateway.breaker.failures == 0
+
+    for _ in range(3):
+        _fail(run, gateway, httpx.ConnectError("connection refused"))
+    assert gateway.breaker.state == "open"
+
+    # 熔断期间立即拒绝，不占用并发名额
+    with pytest.raises(ProviderUnavailable) as exc:
+        run(_call(gateway))
+    assert 0 < exc.value.retry_after <= 60
+    assert gateway.in_flight == 0
+    assert gateway.stats()["breaker"] == "open"
+
+
+def test_half_open_allows_one_probe(run):
+    gateway = LLMGateway(max_concurrency=4, breaker_threshold=1, breaker_cooldown=0.05)
+    _fail(run, gateway, httpx.ConnectError("connection refused"))
+    assert gateway.breaker.state == "open"
+    time.sleep(0.06)
+
+    async def probe_and_second_call():
+        hold = asyncio.Event()
+        probe = asyncio.ensure_future(_call(gateway, hold=hold))
+        await asyncio.sleep(0)
+        assert gateway.breaker.state == "half_open"
+        # 试探请求进行中，其他请求被拒绝
+        with pytest.raises(ProviderUnavailable):
+            await _call(gateway)
+        hold.set()
+        return await probe
+
+    assert run(probe_and_second_call()) == "ok"
+    assert gateway.breaker.state == "closed"
+    assert gateway.breaker.failures == 0
+
+
+def test_failed_probe_reopens(run):
+    gateway = LLMGateway(max_concurrency=4, breaker_threshold=3, breaker_cooldown=0.05)
+    for _ in range(3):
+        _fail(run, gateway, httpx.ConnectError("connection refused"))
+    time.sleep(0.06)
+
+    # 半开状态下试探失败立即重新打开（不必再累计到阈值）
+    _fail(run, gateway, httpx.ReadTimeout("timeout"))
+    assert gateway.breaker.state == "open"
+    with pytest.raises(ProviderUnavailable):
+        run(_call(gateway))
+
+
+def test_cancelled_probe_releases_half_open(run):
+    gateway = LLMGateway(max_concurrency=4, breaker_threshold=1, breaker_cooldown=0.05)
+    _fail(run, gateway, httpx.ConnectError("connection refused"))
+    time.sleep(0.06)
+
+    async def cancel_probe():
+        probe = asyncio.ensure_future(_call(gateway, hold=asyncio.Event()))
+        await asyncio.sleep(0)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    run(cancel_probe())
+    # 试探请求被取消没有结论，下一个请求可以继续试探
+    assert gateway.breaker.state == "half_open"
+    assert run(_call(gateway)) == "ok"
+    assert gateway.breaker.state == "closed"
+
+
+def test_aimd(run, monkeypatch):
+    monkeypatch.setattr("services.llm_gateway.DECREASE_INTERVAL", 60)
+    gateway = LLMGateway(max_concurrency=8, min_concurrency=2)
+
+    # 限流：乘性减小，间隔内的连续限流只减小一次
+    _fail(run, gateway, RateLimitedError("qps limit"))
+    _fail(run, gateway, RateLimitedError("qps limit"))
+    assert gateway.limit == 4
+    assert gateway.rate_limited == 2
+    assert gateway.breaker.state == "closed"
+
+    # 成功：每次 +1/limit
+    run(_call(gateway))
+    assert gateway.limit == pytest.approx(4.25)
+    for _ in range(100):
+        run(_call(gateway))
+    assert gateway.limit == 8
+
+    monkeypatch.setattr("services.llm_gateway.DECREASE_INTERVAL", 0)
+    for _ in range(5):
+        _fail(run, gateway, RateLimitedError("qps limit"))
+    assert gateway.limit == 2
+
+
+def test_slow_success_decreases_limit(run):
+    gateway = LLMGateway(max_concurrency=8, latency_target=0.01)
+
+    async def slow_call():
+        async with gateway.slot():
+            await asyncio.sleep(0.02)
+
+    run(slow_call())
+    assert gateway.limit == 4
+    assert gateway.completed == 1
+
+
+def test_queue_limits(run):
+    gateway = LLMGateway(max_concurrency=1, max_queue=1, queue_timeout=0.05)
+
+    async def saturate():
+        hold = asyncio.Event()
+        running = asyncio.ensure_future(_call(gateway, hold=hold))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(_call(gateway))
+        await asyncio.sleep(0)
+        assert gateway.stats()["queue_depth"] == 1
+
+        # 队列已满：立即拒绝
+        with pytest.raises(ProviderUnavailable, match="排队已满"):
+            await _call(gateway)
+        # 排队超时：拒绝并移出队列
+        with pytest.raises(ProviderUnavailable, match="排队超时"):
+            await queued
+        assert gateway.stats()["queue_depth"] == 0
+
+        # 名额释放后排队的请求依次执行
+        waiting = asyncio.ensure_future(_call(gateway))
+        await asyncio.sleep(0)
+        hold.set()
+        return await running, await waiting
+
+    assert run(saturate()) == ("ok", "ok")
+    assert gateway.rejected == 2
+    assert gateway.in_flight == 0
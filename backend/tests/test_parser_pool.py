@@ -0,0 +1,87 @@
+"""
+解析进程池：子进程按任务数替换、超时/取消时终止子进程、其他在途任务重新提交、子进程崩溃
+"""
+
+import os
+import time
+import asyncio
+
+import pytest
+
+from services.document_parser import ParserPool, ParseError, ParseTimeoutError
+
+
+# 子进程中执行的函数（spawn方式启动，须可按模块路径导入）
+def _pid() -> int:
+    return os.getpid()
+
+
+def _sleep(seconds: float) -> int:
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def _crash():
+    os._exit(1)
+
+
+@pytest.fixture
+def pool():
+    pool = ParserPool(max_workers=2, max_tasks_per_child=0, timeout=30)
+    yield pool
+    pool.shutdown()
+
+
+def test_child_is_replaced_after_max_tasks(run):
+    pool = ParserPool(max_workers=1, max_tasks_per_child=1, timeout=30)
+    try:
+        pids = [run(pool.run(_pid)) for _ in range(3)]
+    finally:
+        pool.shutdown()
+    assert len(set(pids)) == 3
+    assert pool.completed == 3 and pool.recycles == 0
+
+
+def test_timeout_terminates_child_and_resubmits_others(run, pool):
+    async def slow_and_normal():
+        # 先启动两个子进程，超时只计算执行时间
+        await asyncio.gather(pool.run(_sleep, 0.5), pool.run(_sleep, 0.5))
+        return await asyncio.gather(
+            pool.run(_sleep, 30, timeout=1),
+            pool.run(_sleep, 2),
+            return_exceptions=True
+        )
+
+    started = time.monotonic()
+    timed_out, normal = run(slow_and_normal())
+    assert time.monotonic() - started < 20
+    assert isinstance(timed_out, ParseTimeoutError)
+    # 回收进程池时同时在执行的任务重新提交一次，正常完成
+    assert isinstance(normal, int)
+    assert pool.timeouts == 1 and pool.recycles == 1
+
+    # 回收后进程池可以继续使用
+    assert isinstance(run(pool.run(_pid)), int)
+
+
+def test_cancel_terminates_child(run, pool):
+    pid = run(pool.run(_pid))
+
+    async def cancel_slow():
+        task = asyncio.ensure_future(pool.run(_sleep, 30))
+        await asyncio.sleep(1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    run(cancel_slow())
+    assert pool.recycles == 1
+    assert run(pool.run(_pid)) != pid
+
+
+def test_crashing_child(run, pool):
+    # 重新提交后再次崩溃，不再重试
+    with pytest.raises(ParseError, match="异常退出"):
+        run(pool.run(_crash))
+    assert pool.recycles == 2
+    assert isinstance(run(pool.run(_pid)), int)
@@ -0,0 +1,165 @@
+"""
+文档解析器注册表：按内容识别格式（不依赖扩展名）、各格式流式解析、PDF按页范围并行解析、解析结果缓存
+"""
+
+import os
+import uuid
+import zipfile
+
+import pytest
+
+from core.config import settings
+from services import parsers
+from services.document_parser import ParseError
+from services.parsers import (
+    BlockReader, artifact_path, detect_format, parse_document, register_format, remove_artifacts
+)
+
+
+def _write(path, data: bytes) -> str:
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def _pdf(path, pages: int) -> str:
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for number in range(1, pages + 1):
+        doc.new_page().insert_text((72, 72), f"page {number} annual leave policy")
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def _docx(path) -> str:
+    from docx import Document
+
+    doc = Document()
+    doc.add_paragraph("Annual leave policy")
+    table = doc.add_table(rows=2, cols=2)
+    for r, row in enumerate([["Type", "Days"], ["Annual", "10"]]):
+        for c, text in enumerate(row):
+            table.cell(r, c).text = text
+    doc.add_paragraph("Effective immediately")
+    doc.save(str(path))
+    return str(path)
+
+
+def _xlsx(path) -> str:
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    wb.active.title = "Leave"
+    wb.active.append(["Type", "Days", None])
+    wb.active.append(["Annual", 10])
+    wb.save(str(path))
+    return str(path)
+
+
+def _hash() -> str:
+    return uuid.uuid4().hex * 2
+
+
+def _blocks(run, fmt, path, file_hash=None) -> list:
+    reader = run(parse_document(fmt, path, file_hash))
+    try:
+        return list(reader)
+    finally:
+        if hasattr(reader, "close"):
+            reader.close()
+
+
+def test_detect_format_by_content(tmp_path):
+    pdf = _pdf(tmp_path / "a.pdf", 1)
+    docx = _docx(tmp_path / "a.docx")
+    xlsx = _xlsx(tmp_path / "a.xlsx")
+    text = _write(tmp_path / "a.txt", "年假制度".encode("utf-8"))
+
+    assert detect_format(pdf).name == "pdf"
+    assert detect_format(docx).name == "docx"
+    assert detect_format(xlsx).name == "xlsx"
+    assert detect_format(text).name == "text"
+    # 扩展名只用于区分同类内容
+    assert detect_format(text, "README.md").name == "markdown"
+    assert detect_format(pdf, "report.txt").name == "pdf"
+    assert detect_format(docx, "sheet.xlsx").name == "docx"
+
+    archive = tmp_path / "other.zip"
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("readme.txt", "hello")
+    assert detect_format(str(archive), "fake.docx") is None
+    assert detect_format(_write(tmp_path / "a.bin", b"\x00\x01\x02binary")) is None
+
+
+def test_text_encoding(run, tmp_path):
+    fmt = parsers.resolve_format("text/plain", "")
+    gbk = _write(tmp_path / "gbk.txt", "第一条：年假\n第二条：报销\n".encode("gbk"))
+    utf8 = _write(tmp_path / "utf8.txt", "\ufeff第一条：年假\n".encode("utf-8"))
+    assert _blocks(run, fmt, gbk) == ["第一条：年假\n", "第二条：报销\n"]
+    assert _blocks(run, fmt, utf8) == ["第一条：年假\n"]
+
+
+def test_office_formats(run, tmp_path):
+    docx = _docx(tmp_path / "a.docx")
+    assert _blocks(run, detect_format(docx), docx) == [
+        "Annual leave policy", "Type | Days", "Annual | 10", "Effective immediately"
+    ]
+    xlsx = _xlsx(tmp_path / "a.xlsx")
+    assert _blocks(run, detect_format(xlsx), xlsx) == ["--- Sheet: Leave ---", "Type | Days", "Annual | 10"]
+
+
+def test_pdf_pages_are_parsed_in_parallel_ranges(run, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PDF_PAGES_PER_TASK", 2)
+    pdf = _pdf(tmp_path / "a.pdf", 5)
+    blocks = _blocks(run, detect_format(pdf), pdf)
+    # 各页范围的结果按页序拼接
+    assert [page for _, page in blocks] == [1, 2, 3, 4, 5]
+    assert "page 3 annual leave policy" in blocks[2][0]
+    assert not [name for name in os.listdir(settings.UPLOAD_DIR) if name.startswith(".parse-")]
+
+
+def test_parse_artifact_is_cached(run, tmp_path, monkeypatch):
+    docx = _docx(tmp_path / "a.docx")
+    fmt = detect_format(docx)
+    file_hash = _hash()
+
+    first = _blocks(run, fmt, docx, file_hash)
+    assert os.path.exists(artifact_path(file_hash, fmt))
+
+    # 命中缓存：不再提交到解析进程池
+    async def no_parse(*args, **kwargs):
+        raise AssertionError("不应重新解析")
+
+    monkeypatch.setattr(parsers.parser_pool, "run", no_parse)
+    assert _blocks(run, fmt, docx, file_hash) == first
+
+    assert remove_artifacts(file_hash) == 1
+    assert not os.path.exists(artifact_path(file_hash, fmt))
+
+
+def test_corrupt_artifact_is_removed(tmp_path):
+    path = _write(tmp_path / "broken.jsonl.gz", b"not gzip")
+    with pytest.raises(ParseError, match="损坏"):
+        list(BlockReader([path], artifact=True))
+    assert not os.path.exists(path)
+
+
+def test_registered_format_takes_precedence(run, tmp_path):
+    def parse_records(file_path):
+        with open(file_path, encoding="utf-8") as f:
+            yield from (line.split("=", 1)[1].strip() for line in f if "=" in line)
+
+    register_format(
+        "records", "text/x-records", ["rec"],
+        sniff=lambda head, file_path, ext: head.startswith(b"#records"),
+        isolated=False
+    )(parse_records)
+    try:
+        path = _write(tmp_path / "a.txt", "#records\ntitle=年假制度\n".encode("utf-8"))
+        fmt = detect_format(path)
+        assert fmt.name == "records"
+        assert _blocks(run, fmt, path) == ["年假制度"]
+    finally:
+        parsers._FORMATS.pop()
@@ -0,0 +1,143 @@
+"""
+新版本上传的增量重建索引：未变化的块保留原记录，变化的块重新索引，旧块从关键词索引和向量索引中删除；
+索引中途失败后由队列重试，最终每个文档块都有向量
+"""
+
+import os
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+from core.config import settings
+from models.chunk import DocumentChunk
+from models.document import Document
+from services.document_service import DocumentService
+from services.ingestion_queue import IngestionWorker
+from services.quantization import ScalarQuantizer
+from services.rag_service import RAGService, HashingEmbedding
+from services.embedding_pipeline import EmbeddingPipeline
+from services.vector_index import get_vector_index, SharedVectorIndex
+from core.database import AsyncSessionLocal
+
+
+def _policy(changed: bool = False) -> str:
+    paragraphs = [f"第{i}条：员工应当遵守第{i}项管理制度，按规定提交申请并留存记录。" for i in range(60)]
+    if changed:
+        paragraphs[30] = "第30条：差旅报销改为线上审批，发票须在十五天内上传。"
+        paragraphs.append("第60条：本制度自发布之日起施行。")
+    return "\n\n".join(paragraphs)
+
+
+def _upload(run, user, text: str) -> Document:
+    """上传（同一 doc_key 的新版本）并由入库worker处理到队列清空"""
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(settings.UPLOAD_DIR, f".test-{uuid.uuid4().hex}")
+    data = text.encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(data)
+
+    async def upload():
+        async with AsyncSessionLocal() as db:
+            service = DocumentService(db, RAGService(db))
+            return await service.upload_document(
+                user_id=user.id,
+                file_path=path,
+                filename="policy.txt",
+                file_size=len(data),
+                mime_type="text/plain",
+                doc_key="policy"
+            )
+
+    document, _ = run(upload())
+    run(IngestionWorker(concurrency=1, poll_interval=0).drain())
+    return document
+
+
+def _indexed_chunks(run, document_id: int) -> dict:
+    async def query():
+        async with AsyncSessionLocal() as db:
+            document = await db.get(Document, document_id)
+            result = await db.execute(
+                select(DocumentChunk.id, DocumentChunk.chunk_index)
+                .where(DocumentChunk.document_id == document_id)
+            )
+            return document, dict(result.all())
+
+    return run(query())
+
+
+def _vector_chunk_ids(run, user_id: int) -> set:
+    query = run(HashingEmbedding().embed_query("员工管理制度"))
+    hits = get_vector_index(user_id).search(query, top_k=10000, ef_search=10000, nprobe=settings.IVF_NLIST)
+    return {chunk_id for chunk_id, _ in hits}
+
+
+@pytest.mark.parametrize("index_type, quantization", [
+    ("flat", "none"),
+    ("flat", "int8"),
+    ("flat", "pq"),
+    ("hnsw", "none"),
+    ("ivf", "none"),
+])
+def test_new_version_reindexes_changed_chunks(run, user, monkeypatch, index_type, quantization):
+    monkeypatch.setattr(settings, "RETRIEVAL_MODE", "hybrid")
+    monkeypatch.setattr(settings, "VECTOR_INDEX_TYPE", index_type)
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION", quantization)
+    # 让int8量化器在少量向量上完成训练，覆盖压缩码检索路径
+    monkeypatch.setattr(ScalarQuantizer, "min_train_size", 4)
+
+    first = _upload(run, user, _policy())
+    document, v1_chunks = _indexed_chunks(run, first.id)
+    assert document.status == "indexed"
+    assert _vector_chunk_ids(run, user.id) == set(v1_chunks)
+
+    second = _upload(run, user, _policy(changed=True))
+    assert second.id == first.id
+    document, v2_chunks = _indexed_chunks(run, first.id)
+    assert document.status == "indexed"
+    assert document.version == 2
+
+    # 块序号连续，未变化的块沿用原记录
+    assert sorted(v2_chunks.values()) == list(range(len(v2_chunks)))
+    assert set(v1_chunks) & set(v2_chunks)
+    assert set(v2_chunks) != set(v1_chunks)
+
+    # 向量索引中只剩当前版本的块（旧块已标记删除）
+    assert _vector_chunk_ids(run, user.id) == set(v2_chunks)
+
+
+def _fail_once(monkeypatch, cls, name: str):
+    """让 cls.name 第一次调用时失败"""
+    original = getattr(cls, name)
+    calls = []
+
+    def failing(*args, **kwargs):
+        calls.append(name)
+        if len(calls) == 1:
+            raise ConnectionError(f"{name} temporarily unavailable")
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(cls, name, failing)
+    return calls
+
+
+@pytest.mark.parametrize("cls, name", [
+    (EmbeddingPipeline, "embed"),
+    (SharedVectorIndex, "add"),
+])
+def test_retry_after_failed_indexing_indexes_every_chunk(run, user, monkeypatch, cls, name):
+    monkeypatch.setattr(settings, "RETRIEVAL_MODE", "hybrid")
+    monkeypatch.setattr(settings, "VECTOR_INDEX_TYPE", "flat")
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION", "none")
+    monkeypatch.setattr(settings, "INGEST_RETRY_BACKOFF", 0)
+    calls = _fail_once(monkeypatch, cls, name)
+
+    # 第一次失败（写入向量索引失败时文档块已提交），队列重试后所有块都有向量
+    document = _upload(run, user, _policy())
+    assert len(calls) > 1
+    document, chunks = _indexed_chunks(run, document.id)
+    assert document.status == "indexed"
+    assert document.chunk_count == len(chunks)
+    assert sorted(chunks.values()) == list(range(len(chunks)))
+    assert _vector_chunk_ids(run, user.id) == set(chunks)
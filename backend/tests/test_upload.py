@@ -0,0 +1,115 @@
+"""
+流式multipart上传：分片边界任意切分、边接收边计算SHA-256、超限中止并清理临时文件、类型在接收数据前校验
+"""
+
+import os
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+
+from core.upload import receive_upload, MULTIPART_OVERHEAD, MAX_FIELD_SIZE
+
+BOUNDARY = "----test-boundary-7MA4YWxkTrZu0gW"
+
+
+def _body(parts) -> bytes:
+    """parts: [(字段名, 文件名或None, 内容)]"""
+    body = b""
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n".encode("utf-8")
+        if filename is not None:
+            body += b"Content-Type: text/plain\r\n"
+        body += b"\r\n" + content + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+class FakeRequest:
+    """按固定大小分片发送请求体；read=False 时读取请求体即失败"""
+
+    def __init__(self, body: bytes, chunk_size: int = 7, content_length: int = None, read: bool = True):
+        self.headers = {
+            "content-type": f"multipart/form-data; boundary={BOUNDARY}",
+            "content-length": str(len(body) if content_length is None else content_length)
+        }
+        self.body = body
+        self.chunk_size = chunk_size
+        self.read = read
+
+    async def stream(self):
+        assert self.read, "请求体不应被读取"
+        for start in range(0, len(self.body), self.chunk_size):
+            yield self.body[start:start + self.chunk_size]
+
+
+def _leftovers(path) -> list:
+    return [name for name in os.listdir(path) if name.startswith(".upload-")] if os.path.exists(path) else []
+
+
+def test_receive_file_and_fields(run, tmp_path):
+    content = "年假申请须提前三天提交。\r\n--not-a-boundary\r\n".encode("utf-8") * 200
+    body = _body([
+        ("title", None, "员工手册".encode("utf-8")),
+        ("file", "..\\evil/policy.txt", content),
+        ("doc_key", None, b"handbook"),
+    ])
+
+    upload = run(receive_upload(FakeRequest(body), str(tmp_path), max_size=len(content)))
+    try:
+        assert upload.filename == "policy.txt"
+        assert upload.content_type == "text/plain"
+        assert upload.size == len(content)
+        assert upload.sha256 == hashlib.sha256(content).hexdigest()
+        # 文件之后的字段同样收集
+        assert upload.fields == {"title": "员工手册", "doc_key": "handbook"}
+        assert os.path.dirname(upload.path) == str(tmp_path)
+        with open(upload.path, "rb") as f:
+            assert f.read() == content
+    finally:
+        upload.discard()
+    assert not os.path.exists(upload.path)
+
+
+def test_oversized_file_is_aborted(run, tmp_path):
+    body = _body([("file", "big.txt", b"x" * 5000)])
+    with pytest.raises(HTTPException) as exc:
+        run(receive_upload(FakeRequest(body, chunk_size=1024), str(tmp_path), max_size=4096))
+    assert exc.value.status_code == 413
+    assert _leftovers(tmp_path) == []
+
+
+def test_content_length_precheck(run, tmp_path):
+    body = _body([("file", "big.txt", b"x")])
+    request = FakeRequest(body, content_length=4096 + MULTIPART_OVERHEAD + 1, read=False)
+    with pytest.raises(HTTPException) as exc:
+        run(receive_upload(request, str(tmp_path), max_size=4096))
+    assert exc.value.status_code == 413
+
+
+@pytest.mark.parametrize("parts, detail", [
+    ([("file", "run.exe", b"MZ")], "不支持此文件类型"),
+    ([("title", None, b"no file")], "未找到上传文件"),
+    ([("file", "a.txt", b"a"), ("file", "b.txt", b"b")], "一次只能上传一个文件"),
+    ([("title", None, b"x" * (MAX_FIELD_SIZE + 1)), ("file", "a.txt", b"a")], "表单字段过长"),
+])
+def test_rejected_uploads_leave_no_temp_file(run, tmp_path, parts, detail):
+    with pytest.raises(HTTPException) as exc:
+        run(receive_upload(FakeRequest(_body(parts), chunk_size=4096), str(tmp_path), 1 << 20, ["txt", "pdf"]))
+    assert exc.value.status_code == 400
+    assert detail in exc.value.detail
+    assert _leftovers(tmp_path) == []
+
+
+def test_malformed_request(run, tmp_path):
+    request = FakeRequest(b"--wrong-boundary\r\n\r\ngarbage")
+    with pytest.raises(HTTPException) as exc:
+        run(receive_upload(request, str(tmp_path), 1 << 20))
+    assert exc.value.status_code == 400
+    assert _leftovers(tmp_path) == []
+
+    request.headers["content-type"] = "application/json"
+    with pytest.raises(HTTPException, match="multipart/form-data"):
+        run(receive_upload(request, str(tmp_path), 1 << 20))
@@ -0,0 +1,153 @@
+"""
+断点续传：分段追加、偏移量不符/并发写入/未传完时返回当前偏移量（409）、临时文件被截断后从实际长度继续、
+哈希中间状态丢失后重新计算、完成失败时保留会话
+"""
+
+import os
+import hashlib
+
+import pytest
+
+from api.documents import _conflict
+from services import upload_session
+from services.upload_session import UploadSessionService, UploadConflictError, UploadTooLargeError
+
+DATA = "年假申请须提前三天提交。".encode("utf-8") * 500
+
+
+async def _stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.fixture
+def sessions(db):
+    return UploadSessionService(db)
+
+
+def _create(run, sessions, user, size: int, doc_key: str = None) -> tuple:
+    session = run(sessions.create(user.id, "policy.txt", size, doc_key=doc_key))
+    return session.id, session.user_id
+
+
+def _reload(run, db, sessions, key):
+    """读取会话的最新状态（追加/完成由条件UPDATE更新）"""
+    db.expire_all()
+    return run(sessions.get(*key))
+
+
+def _append(run, db, sessions, key, offset: int, *chunks) -> int:
+    return run(sessions.append(_reload(run, db, sessions, key), offset, _stream(*chunks)))
+
+
+def _complete(run, db, sessions, key, fail: bool = False):
+    received = []
+
+    async def ingest(upload):
+        if fail:
+            raise RuntimeError("ingest failed")
+        with open(upload.path, "rb") as f:
+            received.append((upload, f.read()))
+        return "document"
+
+    assert run(sessions.complete(_reload(run, db, sessions, key), ingest)) == "document"
+    return received[0]
+
+
+def test_resume_after_interruption(run, db, user, sessions):
+    key = _create(run, sessions, user, len(DATA), doc_key="handbook")
+    half = len(DATA) // 2
+
+    assert _append(run, db, sessions, key, 0, DATA[:1000], DATA[1000:half]) == half
+    # 偏移量不符：返回已接收的偏移量，客户端据此继续
+    with pytest.raises(UploadConflictError) as exc:
+        _append(run, db, sessions, key, 1000, DATA[1000:])
+    assert exc.value.offset == half
+
+    error = _conflict(exc.value)
+    assert error.status_code == 409
+    assert error.headers == {"Upload-Offset": str(half)}
+
+    # 未传完不能完成
+    with pytest.raises(UploadConflictError) as exc:
+        _complete(run, db, sessions, key)
+    assert exc.value.offset == half
+
+    assert _append(run, db, sessions, key, half, DATA[half:]) == len(DATA)
+    upload, content = _complete(run, db, sessions, key)
+    assert content == DATA
+    assert upload.size == len(DATA)
+    assert upload.sha256 == hashlib.sha256(DATA).hexdigest()
+    assert upload.fields == {"doc_key": "handbook"}
+    assert _reload(run, db, sessions, key) is None
+
+
+def test_concurrent_append_is_rejected(run, db, user, sessions):
+    key = _create(run, sessions, user, len(DATA))
+
+    # 另一个请求正在写入（持有租约）
+    lease = run(sessions._claim(key[0], 0))
+    with pytest.raises(UploadConflictError) as exc:
+        _append(run, db, sessions, key, 0, DATA)
+    assert exc.value.offset == 0
+
+    assert run(sessions._release(key[0], lease, 0))
+    assert _append(run, db, sessions, key, 0, DATA) == len(DATA)
+
+
+def test_truncated_part_resumes_from_actual_length(run, db, user, sessions):
+    key = _create(run, sessions, user, len(DATA))
+    assert _append(run, db, sessions, key, 0, DATA[:3000]) == 3000
+
+    # 已接收的数据部分丢失：退回到实际长度
+    with open(sessions.temp_path(key[0]), "r+b") as f:
+        f.truncate(1200)
+    with pytest.raises(UploadConflictError) as exc:
+        _append(run, db, sessions, key, 3000, DATA[3000:])
+    assert exc.value.offset == 1200
+    assert _reload(run, db, sessions, key).offset == 1200
+
+    assert _append(run, db, sessions, key, 1200, DATA[1200:]) == len(DATA)
+    upload, content = _complete(run, db, sessions, key)
+    assert content == DATA
+    assert upload.sha256 == hashlib.sha256(DATA).hexdigest()
+
+
+def test_hash_is_recomputed_without_cached_state(run, db, user, sessions):
+    key = _create(run, sessions, user, len(DATA))
+    assert _append(run, db, sessions, key, 0, DATA[:2000]) == 2000
+
+    # 后续分段由其他进程接收（或服务重启）：进程内没有哈希中间状态
+    upload_session._hashers.clear()
+    assert _append(run, db, sessions, key, 2000, DATA[2000:]) == len(DATA)
+    upload_session._hashers.clear()
+
+    upload, _ = _complete(run, db, sessions, key)
+    assert upload.sha256 == hashlib.sha256(DATA).hexdigest()
+
+
+def test_too_large_keeps_received_prefix(run, db, user, sessions):
+    key = _create(run, sessions, user, 100)
+    with pytest.raises(UploadTooLargeError):
+        _append(run, db, sessions, key, 0, DATA[:60], DATA[60:120])
+    assert _reload(run, db, sessions, key).offset == 60
+    assert os.path.getsize(sessions.temp_path(key[0])) == 60
+
+    run(sessions.abort(_reload(run, db, sessions, key)))
+    assert _reload(run, db, sessions, key) is None
+    assert not os.path.exists(sessions.temp_path(key[0]))
+
+
+def test_failed_ingest_keeps_session(run, db, user, sessions):
+    key = _create(run, sessions, user, len(DATA))
+    assert _append(run, db, sessions, key, 0, DATA) == len(DATA)
+
+    with pytest.raises(RuntimeError):
+        _complete(run, db, sessions, key, fail=True)
+    assert _reload(run, db, sessions, key).lease_expires_at is None
+    assert os.path.exists(sessions.temp_path(key[0]))
+
+    # 重试完成（租约已释放）
+    upload, content = _complete(run, db, sessions, key)
+    assert content == DATA
+    assert _reload(run, db, sessions, key) is None
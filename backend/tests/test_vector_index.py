@@ -0,0 +1,122 @@
+"""
+flat向量索引的增量持久化：追加写入、墓碑删除、压缩、崩溃遗留数据、旧版 .npy 格式转换
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from services.vector_index import LocalVectorIndex, normalize
+
+DIM = 8
+
+
+def _vectors(seed: int, count: int) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+
+
+def _all_chunk_ids(index: LocalVectorIndex) -> set:
+    return {chunk_id for chunk_id, _ in index.search(np.ones(DIM), top_k=100000)}
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    return str(tmp_path)
+
+
+def test_add_appends_without_rewriting(index_dir):
+    index = LocalVectorIndex(1, DIM, index_dir)
+    index.add([1, 2, 3], [10, 10, 10], _vectors(0, 3))
+    vectors_file = index._file("vectors")
+    inode = os.stat(vectors_file).st_ino
+
+    index.add([4, 5], [11, 11], _vectors(1, 2))
+    assert os.stat(vectors_file).st_ino == inode
+    assert os.path.getsize(vectors_file) == 5 * DIM * 4
+
+    reloaded = LocalVectorIndex(1, DIM, index_dir)
+    assert reloaded.size == 5
+    np.testing.assert_allclose(reloaded.vectors, normalize(np.vstack([_vectors(0, 3), _vectors(1, 2)])), rtol=1e-6)
+    assert reloaded.chunk_ids.tolist() == [1, 2, 3, 4, 5]
+
+
+def test_delete_writes_tombstones(index_dir):
+    index = LocalVectorIndex(1, DIM, index_dir)
+    index.add(list(range(1, 11)), [1] * 5 + [2] * 5, _vectors(0, 10))
+    inodes = {name: os.stat(index._file(name)).st_ino for name in ("vectors", "chunk_ids", "deleted")}
+
+    assert index.delete_chunks([1, 2, 99]) == 2
+    assert index.delete_chunks([1]) == 0
+    assert index.delete_document(2) == 5
+    assert {name: os.stat(index._file(name)).st_ino for name in inodes} == inodes
+
+    assert index.size == 3
+    assert _all_chunk_ids(index) == {3, 4, 5}
+    assert index.search(np.ones(DIM), top_k=10, document_ids=[2]) == []
+
+    reloaded = LocalVectorIndex(1, DIM, index_dir)
+    assert reloaded.size == 3
+    assert _all_chunk_ids(reloaded) == {3, 4, 5}
+    assert reloaded.chunk_ids.tolist() == [3, 4, 5]
+
+
+def test_compaction(index_dir, monkeypatch):
+    monkeypatch.setattr(LocalVectorIndex, "COMPACT_MIN_ROWS", 4)
+    index = LocalVectorIndex(1, DIM, index_dir)
+    index.add(list(range(1, 9)), list(range(1, 9)), _vectors(0, 8))
+    old_file = index._file("vectors")
+
+    index.delete_chunks([1, 2, 3, 4])
+    assert index.generation == 0  # 刚好一半，不压缩
+    index.delete_chunks([5])
+    assert index.generation == 1
+    assert not os.path.exists(old_file)
+    assert index.rows == index.size == 3
+    assert os.path.getsize(index._file("vectors")) == 3 * DIM * 4
+
+    index.add([9], [9], _vectors(1, 1))
+    reloaded = LocalVectorIndex(1, DIM, index_dir)
+    assert reloaded.chunk_ids.tolist() == [6, 7, 8, 9]
+    assert _all_chunk_ids(reloaded) == {6, 7, 8, 9}
+
+
+def test_uncommitted_tail_is_ignored(index_dir):
+    index = LocalVectorIndex(1, DIM, index_dir)
+    index.add([1, 2], [1, 1], _vectors(0, 2))
+
+    # 模拟追加写入过程中崩溃：数据已写入但 flat.json 未更新
+    with open(index._file("vectors"), "ab") as f:
+        f.write(_vectors(1, 1).tobytes())
+    with open(index._file("chunk_ids"), "ab") as f:
+        f.write(np.array([999], dtype=np.int64).tobytes())
+
+    reloaded = LocalVectorIndex(1, DIM, index_dir)
+    assert reloaded.chunk_ids.tolist() == [1, 2]
+    reloaded.add([3], [1], _vectors(2, 1))
+    assert LocalVectorIndex(1, DIM, index_dir).chunk_ids.tolist() == [1, 2, 3]
+
+
+def test_legacy_npy_format_is_converted(index_dir):
+    path = os.path.join(index_dir, "user_1")
+    os.makedirs(path)
+    vectors = normalize(_vectors(0, 3))
+    np.save(os.path.join(path, "vectors.npy"), vectors)
+    np.save(os.path.join(path, "chunk_ids.npy"), np.array([7, 8, 9], dtype=np.int64))
+    np.save(os.path.join(path, "document_ids.npy"), np.array([1, 1, 2], dtype=np.int64))
+    assert LocalVectorIndex.has_data(path)
+
+    index = LocalVectorIndex(1, DIM, index_dir)
+    assert index.chunk_ids.tolist() == [7, 8, 9]
+    assert not os.path.exists(os.path.join(path, "vectors.npy"))
+    assert LocalVectorIndex.has_data(path)
+
+    reloaded = LocalVectorIndex(1, DIM, index_dir)
+    np.testing.assert_allclose(reloaded.vectors, vectors)
+    assert reloaded.document_ids.tolist() == [1, 1, 2]
+
+
+def test_dimension_mismatch(index_dir):
+    LocalVectorIndex(1, DIM, index_dir).add([1], [1], _vectors(0, 1))
+    with pytest.raises(ValueError, match="MILVUS_DIMENSION"):
+        LocalVectorIndex(1, DIM * 2, index_dir)
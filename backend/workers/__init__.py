@@ -0,0 +1,3 @@
+"""
+后台worker进程
+"""
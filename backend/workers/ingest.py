@@ -0,0 +1,55 @@
+"""
+文档入库worker（独立进程）
+从数据库队列领取上传的文档，解析、分块、索引；可与API分开部署并按需扩容
+
+用法：
+    python -m workers.ingest [--concurrency N] [--once]
+"""
+
+import argparse
+import asyncio
+import signal
+
+from core.config import settings
+from core.database import init_db
+from core.http import get_http_client, close_http_client
+from services.cache import search_cache
+from services.token_manager import qianfan_token
+from services.document_parser import parser_pool
+from services.ingestion_queue import IngestionWorker, require_shared_cache
+
+
+async def main(concurrency: int, once: bool):
+    await init_db()
+    await search_cache.start()
+    require_shared_cache(search_cache)
+    get_http_client()
+    await qianfan_token.start()
+
+    worker = IngestionWorker(concurrency=concurrency)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, worker.stop)
+        except NotImplementedError:  # Windows
+            pass
+
+    try:
+        if once:
+            await worker.drain()
+            print(f"✅ 入库队列已清空：成功 {worker.processed}，失败 {worker.failed}")
+        else:
+            await worker.run()
+    finally:
+        parser_pool.shutdown()
+        await qianfan_token.close()
+        await close_http_client()
+        await search_cache.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="文档入库worker")
+    parser.add_argument("--concurrency", type=int, default=settings.INGEST_CONCURRENCY, help="同时处理的文档数")
+    parser.add_argument("--once", action="store_true", help="处理完当前可领取的任务后退出")
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency, args.once))
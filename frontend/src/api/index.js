@@ -1,5 +1,6 @@
 import axios from 'axios'
 import { ElMessage } from 'element-plus'
+import { createSHA256 } from 'hash-wasm'
 
 const API_BASE = '/api/v1'
 
@@ -60,17 +61,86 @@ export const login = (formData) => {
 export const getUserInfo = () => request.get('/users/me')
 
 // 文档API
-export const uploadDocument = (file, title, description) => {
+// 计算文件SHA-256：按分段读取增量计算，内存占用与文件大小无关
+// （浏览器的 crypto.subtle 只能一次性计算整个文件，且非HTTPS环境下不可用）
+const HASH_SLICE_SIZE = 4 * 1024 * 1024
+
+export const sha256File = async (file) => {
+  const hasher = await createSHA256()
+  hasher.init()
+  for (let offset = 0; offset < file.size; offset += HASH_SLICE_SIZE) {
+    const slice = await file.slice(offset, offset + HASH_SLICE_SIZE).arrayBuffer()
+    hasher.update(new Uint8Array(slice))
+  }
+  return hasher.digest('hex')
+}
+
+export const probeDocument = (data) => request.post('/documents/probe', data)
+
+// 先按哈希探测，已上传过相同内容时直接返回已有文档（duplicate: true），不再传输文件
+// docKey 为文档逻辑标识（默认文件名，与已有文档相同时作为新版本）；onProgress 接收 0~1 的上传进度
+export const uploadDocument = async (file, title, description, { docKey, onProgress } = {}) => {
+  // 无法计算哈希时（如浏览器禁用了WebAssembly）跳过探测，直接上传
+  const sha256 = await sha256File(file).catch(() => null)
+  if (sha256) {
+    const probe = await probeDocument({ sha256, size: file.size })
+    if (probe.exists) return { ...probe.document, duplicate: true }
+  }
+
+  if (file.size > RESUMABLE_THRESHOLD) return uploadResumable(file, { docKey, onProgress })
+
   const formData = new FormData()
   formData.append('file', file)
+  if (docKey) formData.append('doc_key', docKey)
   if (title) formData.append('title', title)
   if (description) formData.append('description', description)
 
-  return axios.post('/documents/upload', formData, {
-    headers: { 'Content-Type': 'multipart/form-data' }
+  return request.post('/documents/upload', formData, {
+    timeout: 0,
+    headers: { 'Content-Type': 'multipart/form-data' },
+    onUploadProgress: (event) => onProgress?.(event.loaded / (event.total || file.size))
   })
 }
 
+// 超过该大小的文件使用断点续传（分段上传，网络中断只重传当前分段）
+const RESUMABLE_THRESHOLD = 8 * 1024 * 1024
+const RESUMABLE_MAX_RETRIES = 5
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms))
+
+export const uploadResumable = async (file, { docKey, onProgress } = {}) => {
+  const session = await request.post('/documents/uploads', {
+    filename: file.name,
+    size: file.size,
+    doc_key: docKey || null
+  })
+  const url = `${API_BASE}/documents/uploads/${session.upload_id}`
+  let offset = session.offset
+  let failures = 0
+  onProgress?.(offset / file.size)
+
+  while (offset < file.size) {
+    try {
+      // 分段请求不经过拦截器，失败重试时不重复提示
+      const { data } = await axios.patch(url, file.slice(offset, offset + session.chunk_size), {
+        timeout: 0,
+        headers: { 'Content-Type': 'application/offset+octet-stream', 'Upload-Offset': offset }
+      })
+      offset = data.offset
+      failures = 0
+      onProgress?.(offset / file.size)
+    } catch (error) {
+      const status = error.response?.status
+      if ((status && status !== 409) || ++failures > RESUMABLE_MAX_RETRIES) throw error
+      await sleep(1000 * failures)
+      // 查询服务端已接收的偏移量后继续
+      offset = (await axios.get(url)).data.offset
+    }
+  }
+
+  return request.post(`/documents/uploads/${session.upload_id}/complete`)
+}
+
 export const getDocuments = (params) => request.get('/documents', { params })
 export const getDocumentDetail = (id) => request.get(`/documents/${id}`)
 export const deleteDocument = (id) => request.delete(`/documents/${id}`)